@@ -4,11 +4,13 @@ import uvicorn
 from typing import Optional
 import json
 import asyncio
+import itertools
+import threading
 
 class VeloDriverClient:
     def __init__(self, dispatch_url: str = "http://localhost:8000", 
                  driver_id: str = None, driver_name: str = None,
-                 driver_port: int = 9000):
+                 driver_port: int = 9000, use_gateway: bool = False):
         self.dispatch_url = dispatch_url
         self.driver_id = driver_id or f"DRIVER-{driver_port}"
         self.driver_name = driver_name or f"Driver {driver_port}"
@@ -19,6 +21,13 @@ class VeloDriverClient:
         self.rides_completed = 0
         self.pending_ride = None  # NEW: Store pending ride offer
         
+        # Driver gateway: one WebSocket instead of a local server + heartbeat requests
+        self.use_gateway = use_gateway
+        self._gateway_loop = None
+        self._gateway_socket = None
+        self._gateway_ids = itertools.count(1)
+        self._gateway_replies = {}
+        
         # Create FastAPI app for this driver
         self.app = FastAPI(title=f"VELO Driver {self.driver_id}")
         self.setup_routes()
@@ -75,6 +84,7 @@ class VeloDriverClient:
                 "driver_id": self.driver_id,
                 "name": self.driver_name,
                 "port": self.driver_port,
+                "transport": "web" if self.use_gateway else "http",
                 "location": self.current_location,
                 "is_available": self.is_available
             }
@@ -131,6 +141,9 @@ class VeloDriverClient:
     
     def update_location(self, location: dict) -> dict:
         """Update driver location on dispatch server"""
+        if self.use_gateway:
+            self.current_location = location
+            return self.gateway_request("location", lat=location["lat"], lng=location["lng"])
         try:
             self.current_location = location
             
@@ -195,8 +208,15 @@ class VeloDriverClient:
         ride_id = self.pending_ride.get('ride_id')
         print(f"\n✅ Accepting ride {ride_id}...")
         
-        # Update ride status to accepted
-        self.update_ride_status(ride_id, "accepted")
+        if self.use_gateway:
+            result = self.gateway_request("accept", match_id=self.pending_ride.get("match_id"))
+            if result.get("type") == "error":
+                print(f"⚠️ Could not accept: {result.get('detail')}")
+                self.pending_ride = None
+                return {"error": result.get("detail")}
+        else:
+            # Update ride status to accepted
+            self.update_ride_status(ride_id, "accepted")
         
         # Move pending ride to current ride
         self.current_ride = self.pending_ride
@@ -217,8 +237,11 @@ class VeloDriverClient:
         ride_id = self.pending_ride.get('ride_id')
         print(f"\n❌ Declining ride {ride_id}...")
         
-        # Update ride status back to pending so it can be reassigned
-        self.update_ride_status(ride_id, "pending")
+        if self.use_gateway:
+            self.gateway_request("decline", match_id=self.pending_ride.get("match_id"))
+        else:
+            # Update ride status back to pending so it can be reassigned
+            self.update_ride_status(ride_id, "pending")
         
         # Clear pending ride
         self.pending_ride = None
@@ -302,6 +325,114 @@ class VeloDriverClient:
                 await asyncio.sleep(10)
 
 
+    # ------------------------------------------------------------------
+    # Driver gateway mode
+    # ------------------------------------------------------------------
+    
+    def gateway_url(self) -> str:
+        numeric_id = int(str(self.driver_id).replace("DRIVER-", ""))
+        base = self.dispatch_url.replace("https://", "wss://").replace("http://", "ws://")
+        return f"{base}/ws/driver/{numeric_id}"
+    
+    def start_gateway(self):
+        """Connect the gateway socket on a background event loop"""
+        ready = threading.Event()
+        
+        def run_loop():
+            self._gateway_loop = asyncio.new_event_loop()
+            self._gateway_loop.call_soon(ready.set)
+            self._gateway_loop.run_until_complete(self.gateway_main())
+        
+        threading.Thread(target=run_loop, daemon=True).start()
+        ready.wait()
+    
+    def gateway_request(self, kind: str, **fields) -> dict:
+        """Send a frame and wait for its result/error reply (from any thread)"""
+        if self._gateway_loop is None:
+            return {"type": "error", "detail": "Gateway not started"}
+        future = asyncio.run_coroutine_threadsafe(self._gateway_request(kind, **fields), self._gateway_loop)
+        try:
+            return future.result(timeout=10)
+        except Exception as e:
+            return {"type": "error", "detail": f"Gateway request failed: {e}"}
+    
+    async def _gateway_request(self, kind: str, **fields) -> dict:
+        if self._gateway_socket is None:
+            return {"type": "error", "detail": "Not connected to the gateway"}
+        message_id = next(self._gateway_ids)
+        reply = asyncio.get_running_loop().create_future()
+        self._gateway_replies[message_id] = reply
+        try:
+            await self._gateway_socket.send(json.dumps({"type": kind, "id": message_id, **fields}))
+            return await asyncio.wait_for(reply, 10)
+        finally:
+            self._gateway_replies.pop(message_id, None)
+    
+    async def gateway_main(self):
+        """Stay connected: reconnect with backoff whenever the socket drops"""
+        import websockets
+        
+        backoff = 1
+        while True:
+            try:
+                async with websockets.connect(self.gateway_url()) as socket:
+                    self._gateway_socket = socket
+                    backoff = 1
+                    heartbeat = asyncio.create_task(self._gateway_heartbeat())
+                    try:
+                        async for raw in socket:
+                            await self._on_gateway_message(json.loads(raw))
+                    finally:
+                        heartbeat.cancel()
+                        self._gateway_socket = None
+            except Exception as e:
+                print(f"⚠️ Gateway connection lost: {e} (retrying in {backoff}s)")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+    
+    async def _gateway_heartbeat(self):
+        while True:
+            await self._gateway_socket.send(json.dumps({"type": "heartbeat"}))
+            await asyncio.sleep(10)
+    
+    async def _on_gateway_message(self, message: dict):
+        kind = message.get("type")
+        if kind == "connected":
+            print(f"🔌 Connected to driver gateway as driver {message.get('driver_id')}")
+            # Let the server know where we are straight away
+            await self._gateway_socket.send(json.dumps({"type": "location", **self.current_location}))
+        elif kind == "offer":
+            # Ack first: the notifier is waiting on it
+            await self._gateway_socket.send(json.dumps({"type": "ack", "id": message.get("id")}))
+            self.pending_ride = {k: v for k, v in message.items() if k not in ("type", "id")}
+            print(f"\n{'='*60}")
+            print(f"🚨 New Ride Offer! (match {message.get('match_id')})")
+            print(f"   Ride ID: {message.get('ride_id')}")
+            print(f"   Pickup: {message.get('pickup_location')}")
+            print(f"   Dropoff: {message.get('dropoff_location')}")
+            print(f"   Use commands: 'accept' or 'decline'")
+            print(f"{'='*60}\n")
+        elif kind == "offer_closed":
+            if self.pending_ride and self.pending_ride.get("match_id") in message.get("match_ids", []):
+                print(f"\n📴 Ride {self.pending_ride.get('ride_id')} offer is no longer available")
+                self.pending_ride = None
+        elif kind in ("result", "error"):
+            reply = self._gateway_replies.get(message.get("id"))
+            if reply is not None and not reply.done():
+                reply.set_result(message)
+            elif kind == "error":
+                print(f"⚠️ Gateway error: {message.get('detail')}")
+    
+    def run_gateway(self):
+        """Run without a local server: everything goes over the gateway socket"""
+        self.register()
+        print(f"\n🚀 VELO Driver Client Started (gateway mode)")
+        print(f"   Driver ID: {self.driver_id}")
+        print(f"   Gateway: {self.gateway_url()}")
+        print(f"\n⏳ Waiting for ride assignments...\n")
+        asyncio.run(self.gateway_main())
+
+
 def interactive_mode(driver: VeloDriverClient):
     """Interactive mode for testing driver actions"""
     print("\n" + "="*50)
@@ -310,6 +441,8 @@ def interactive_mode(driver: VeloDriverClient):
     
     # Register first
     driver.register()
+    if driver.use_gateway:
+        driver.start_gateway()
     
     while True:
         print("\nOptions:")
@@ -392,6 +525,8 @@ def main():
                        help='Initial longitude (default: Bangalore)')
     parser.add_argument('--interactive', action='store_true', 
                        help='Run in interactive mode (recommended for manual acceptance)')
+    parser.add_argument('--gateway', action='store_true',
+                       help='Connect over the driver gateway WebSocket instead of running a local server')
     
     args = parser.parse_args()
     
@@ -399,7 +534,8 @@ def main():
         dispatch_url=args.dispatch,
         driver_id=args.driver_id,
         driver_name=args.name,
-        driver_port=args.port
+        driver_port=args.port,
+        use_gateway=args.gateway
     )
     
     # Set initial location
@@ -407,6 +543,8 @@ def main():
     
     if args.interactive:
         interactive_mode(driver)
+    elif args.gateway:
+        driver.run_gateway()
     else:
         # Run as server
         driver.run()
@@ -68,6 +68,23 @@ class MiniUberClient:
         import os
         os._exit(0)
     
+    def register_endpoint(self):
+        """Tell the server to push ride assignments to this client's port"""
+        try:
+            requests.post(
+                f"{self.api_url}/clients/register",
+                json={
+                    "role": "user",
+                    "client_id": self.user_id,
+                    "transport": "http",
+                    "port": self.client_port
+                },
+                timeout=5
+            ).raise_for_status()
+        except requests.RequestException as e:
+            # Older servers probe the port instead
+            print(f"⚠️  Could not register client endpoint: {e}")
+    
     def create_ride_request(self, source_location: str, dest_location: str) -> dict:
         """Create a new ride request"""
         try:
@@ -115,7 +132,8 @@ class MiniUberClient:
         print(f"   Server: {self.base_url}")
         print("="*60)
         
-        # Create ride request
+        # Register where to push the assignment, then create ride request
+        self.register_endpoint()
         result = self.create_ride_request(source_location, dest_location)
         
         if "error" in result:
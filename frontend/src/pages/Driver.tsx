@@ -6,8 +6,8 @@ import {
   loginDriver,
   setDriverAvailability,
   updateDriverLocation,
-  getDriverStatus,
   getDriverPendingRide,
+  connectDriverGateway,
   acceptRideRequest,
   declineRideRequest,
   verifyRideOtp,
@@ -81,40 +81,43 @@ export default function Driver() {
     }
   };
 
-  // Poll for driver status and ride offers
+  const showOffer = (offer: any) => {
+    setCurrentRide((ride: any) => ride || {
+      id: offer.ride_id,
+      match_id: offer.match_id,
+      source: offer.pickup_location,
+      dest: offer.dropoff_location,
+      fare: offer.fare ? `₹${offer.fare}` : "₹100", // Use actual fare
+      type: offer.ride_type
+    });
+  };
+
+  // Ride offers are pushed over the driver gateway socket
   useEffect(() => {
     if (!isAvailable || !driverId) return;
 
-    const pollInterval = setInterval(async () => {
-      try {
-        // NOTE: Location updates now happen via Map Click (Manual)
-        // We only poll for status/rides here.
-
-        const driverStatus = await getDriverStatus(parseInt(driverId));
-        if (driverStatus) {
-          // Only update local status if changed, maybe?
-          // For now just keep it simple
-        }
-
-        // Check for pending ride offer
-        const pendingRide = await getDriverPendingRide(parseInt(driverId));
-        if (pendingRide && pendingRide.has_ride && !currentRide) {
-          setCurrentRide({
-            id: pendingRide.ride_id,
-            match_id: pendingRide.match_id,
-            source: pendingRide.pickup_location,
-            dest: pendingRide.dropoff_location,
-            fare: pendingRide.fare ? `₹${pendingRide.fare}` : "₹100", // Use actual fare
-            type: pendingRide.ride_type
-          });
+    return connectDriverGateway(
+      parseInt(driverId),
+      showOffer,
+      (matchIds) => {
+        // Taken by another driver, withdrawn or expired
+        setCurrentRide((ride: any) =>
+          ride && !ride.status && matchIds.includes(ride.match_id) ? null : ride
+        );
+      },
+      async () => {
+        // Offers made while we were disconnected were left for polling: catch up once
+        try {
+          const pendingRide = await getDriverPendingRide(parseInt(driverId));
+          if (pendingRide && pendingRide.has_ride) {
+            showOffer(pendingRide);
+          }
+        } catch (error) {
+          console.error('Failed to check for pending ride:', error);
         }
-      } catch (error) {
-        console.error('Polling error:', error);
       }
-    }, 3000);
-
-    return () => clearInterval(pollInterval);
-  }, [isAvailable, driverId, currentRide]);
+    );
+  }, [isAvailable, driverId]);
 
   // Handle Map Click for Location Update
   const handleMapClick = async (lat: number, lng: number) => {
@@ -134,6 +137,12 @@ export default function Driver() {
       // Transition to "In Ride" mode (waiting for OTP)
       setCurrentRide({ ...currentRide, status: 'accepted' });
     } catch (error) {
+      if (error instanceof Error && error.message === 'Ride already taken') {
+        // Broadcast offer: another driver accepted first
+        setCurrentRide(null);
+        alert("Another driver accepted this ride first");
+        return;
+      }
       alert("Failed to accept ride");
     }
   };
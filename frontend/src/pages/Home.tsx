@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import MapView from '../shared/MapView';
 import RideForm from '../shared/RideForm';
@@ -6,6 +6,7 @@ import { useAuth } from '../context/AuthContext';
 import {
   createRideRequest,
   getAvailableDrivers,
+  subscribeUserRideStatus,
   DriverForMap
 } from '../utils/api';
 
@@ -30,6 +31,9 @@ export default function Home() {
   const [loading, setLoading] = useState(false);
   const [selectionMode, setSelectionMode] = useState<'pickup' | 'dropoff'>('pickup');
   const [assignedDriver, setAssignedDriver] = useState<AssignedDriver | null>(null);
+  // Latest value for the status stream handler, which outlives renders
+  const assignedDriverRef = useRef<AssignedDriver | null>(null);
+  assignedDriverRef.current = assignedDriver;
   const [waitingForDriver, setWaitingForDriver] = useState(false);
   const [activeSubscription, setActiveSubscription] = useState<any>(null);
 
@@ -44,53 +48,42 @@ export default function Home() {
   useEffect(() => {
     if (!user?.id) return;
 
-    const pollInterval = setInterval(async () => {
-      try {
-        const response = await fetch(`http://localhost:8000/api/user/${user.id}/ride-status`);
-        if (response.ok) {
-          const data = await response.json();
-          // console.log('🚗 Poll Data:', data); 
+    // One idle connection; the server pushes status, driver, OTP and location changes
+    return subscribeUserRideStatus(user.id, (data) => {
+      if (data.has_ride) {
+        setWaitingForDriver(false);
 
-          if (data.has_ride) {
-            setWaitingForDriver(false);
+        if (data.status === 'matched' || data.status === 'accepted' || data.status === 'in_progress') {
+          console.log('🔐 OTP from backend:', data.otp); // Debug log
+          setAssignedDriver({
+            ride_id: data.ride_id,
+            driver_id: data.driver_id,
+            driver_name: `Driver ${data.driver_id}`,
+            driver_location: data.driver_location || 'Unknown',
+            pickup_location: data.pickup_location,
+            dropoff_location: data.dropoff_location,
+            status: data.status,
+            otp: data.otp || null
+          });
 
-            if (data.status === 'matched' || data.status === 'accepted' || data.status === 'in_progress') {
-              console.log('🔐 OTP from backend:', data.otp); // Debug log
-              setAssignedDriver({
-                ride_id: data.ride_id,
-                driver_id: data.driver_id,
-                driver_name: `Driver ${data.driver_id}`,
-                driver_location: data.driver_location || 'Unknown',
-                pickup_location: data.pickup_location,
-                dropoff_location: data.dropoff_location,
-                status: data.status,
-                otp: data.otp || null
-              });
-
-              if (data.ride_id) {
-                setRideId(data.ride_id);
-              }
-            } else if (data.status === 'completed') {
-              // Ride finished, clear state
-              setAssignedDriver(null);
-              setRideId(null);
-              alert("Ride Completed! 🏁");
-            }
-          } else {
-            // No active ride found
-            if (assignedDriver) {
-              setAssignedDriver(null);
-              setRideId(null);
-            }
+          if (data.ride_id) {
+            setRideId(data.ride_id);
           }
+        } else if (data.status === 'completed') {
+          // Ride finished, clear state
+          setAssignedDriver(null);
+          setRideId(null);
+          alert("Ride Completed! 🏁");
+        }
+      } else {
+        // No active ride found
+        if (assignedDriverRef.current) {
+          setAssignedDriver(null);
+          setRideId(null);
         }
-      } catch (error) {
-        console.error('Failed to poll ride status:', error);
       }
-    }, 2000);
-
-    return () => clearInterval(pollInterval);
-  }, [user, assignedDriver]);
+    });
+  }, [user]);
 
   // Fetch active subscription
   useEffect(() => {
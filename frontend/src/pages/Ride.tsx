@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useNavigate, useSearchParams } from 'react-router-dom';
 import MapView from '../shared/MapView';
 import { useAuth } from '../context/AuthContext';
@@ -7,6 +7,7 @@ import {
   getAvailableDrivers,
   rateDriver,
   cancelRide,
+  subscribeUserRideStatus,
   DriverForMap
 } from '../utils/api';
 
@@ -32,6 +33,9 @@ export default function Ride() {
   const [loading, setLoading] = useState(false);
   const [selectionMode, setSelectionMode] = useState<'pickup' | 'dropoff'>('pickup');
   const [assignedDriver, setAssignedDriver] = useState<AssignedDriver | null>(null);
+  // Latest value for the status stream handler, which outlives renders
+  const assignedDriverRef = useRef<AssignedDriver | null>(null);
+  assignedDriverRef.current = assignedDriver;
   const [waitingForDriver, setWaitingForDriver] = useState(false);
   const [selectedRideType, setSelectedRideType] = useState<'auto' | 'school_pool' | 'school_priority'>('auto');
   const [showRatingModal, setShowRatingModal] = useState(false);
@@ -58,66 +62,57 @@ export default function Ride() {
   useEffect(() => {
     if (!user?.id) return;
 
-    const pollInterval = setInterval(async () => {
-      try {
-        const response = await fetch(`http://localhost:8000/api/user/${user.id}/ride-status`);
-        if (response.ok) {
-          const data = await response.json();
-
-          if (data.has_ride) {
-            setWaitingForDriver(false);
-
-            if (data.status === 'matched' || data.status === 'accepted' || data.status === 'in_progress') {
-              console.log('📊 Ride status data:', data);
-              console.log('🔐 OTP value:', data.otp);
-              setAssignedDriver({
-                ride_id: data.ride_id,
-                driver_id: data.driver_id,
-                driver_name: `Driver ${data.driver_id}`,
-                driver_location: data.driver_location || 'Unknown',
-                pickup_location: data.pickup_location,
-                dropoff_location: data.dropoff_location,
-                status: data.status,
-                otp: data.otp
-              });
-
-              // Parse driver location for map
-              if (data.driver_location) {
-                const [dLat, dLng] = data.driver_location.split(',').map(Number);
-                // Create a live driver object for the map
-                setDrivers([{
-                  driver_id: data.driver_id,
-                  lat: dLat,
-                  lng: dLng,
-                  available: false // Busy with this ride
-                }]);
-              }
+    // One idle connection; the server pushes status, driver, OTP and location changes
+    return subscribeUserRideStatus(user.id, (data) => {
+      const assignedDriver = assignedDriverRef.current;
+      if (data.has_ride) {
+        setWaitingForDriver(false);
+
+        if (data.status === 'matched' || data.status === 'accepted' || data.status === 'in_progress') {
+          console.log('📊 Ride status data:', data);
+          console.log('🔐 OTP value:', data.otp);
+          setAssignedDriver({
+            ride_id: data.ride_id,
+            driver_id: data.driver_id,
+            driver_name: `Driver ${data.driver_id}`,
+            driver_location: data.driver_location || 'Unknown',
+            pickup_location: data.pickup_location,
+            dropoff_location: data.dropoff_location,
+            status: data.status,
+            otp: data.otp
+          });
+
+          // Parse driver location for map
+          if (data.driver_location) {
+            const [dLat, dLng] = data.driver_location.split(',').map(Number);
+            // Create a live driver object for the map
+            setDrivers([{
+              driver_id: data.driver_id,
+              lat: dLat,
+              lng: dLng,
+              available: false // Busy with this ride
+            }]);
+          }
 
-              if (data.ride_id) {
-                setRideId(data.ride_id);
-              }
-            } else if (data.status === 'completed' && assignedDriver) {
-              // Ride just completed
-              setLastCompletedRide({ id: assignedDriver.ride_id!, driverId: assignedDriver.driver_id });
-              setAssignedDriver(null);
-              setShowRatingModal(true);
-            }
-          } else if (assignedDriver && (assignedDriver.status === 'in_progress' || assignedDriver.status === 'accepted')) {
-            // Handle case where has_ride becomes false (Completed)
-            // Catch both 'in_progress' and 'accepted' to handle race conditions where polling misses the in_progress state
-            console.log("🏁 Ride finished (detected via polling). Showing rating.");
-            setLastCompletedRide({ id: assignedDriver.ride_id!, driverId: assignedDriver.driver_id });
-            setAssignedDriver(null);
-            setShowRatingModal(true);
+          if (data.ride_id) {
+            setRideId(data.ride_id);
           }
+        } else if (data.status === 'completed' && assignedDriver) {
+          // Ride just completed
+          setLastCompletedRide({ id: assignedDriver.ride_id!, driverId: assignedDriver.driver_id });
+          setAssignedDriver(null);
+          setShowRatingModal(true);
         }
-      } catch (error) {
-        console.error('Failed to poll ride status:', error);
+      } else if (assignedDriver && (assignedDriver.status === 'in_progress' || assignedDriver.status === 'accepted')) {
+        // Handle case where has_ride becomes false (Completed)
+        // Catch both 'in_progress' and 'accepted': a quick start + finish can skip the in_progress push
+        console.log("🏁 Ride finished (pushed by the server). Showing rating.");
+        setLastCompletedRide({ id: assignedDriver.ride_id!, driverId: assignedDriver.driver_id });
+        setAssignedDriver(null);
+        setShowRatingModal(true);
       }
-    }, 2000);
-
-    return () => clearInterval(pollInterval);
-  }, [user, assignedDriver]);
+    });
+  }, [user]);
 
   const fetchDrivers = async () => {
     const driverData = await getAvailableDrivers();
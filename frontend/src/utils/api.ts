@@ -129,6 +129,65 @@ export const getRideStatus = async (rideId: number) => {
   return await response.json();
 };
 
+// Live rider status over server-sent events: the server pushes every change.
+// EventSource reconnects on its own. Returns a function that closes the stream.
+export const subscribeUserRideStatus = (userId: number, onStatus: (data: any) => void) => {
+  const source = new EventSource(`${API_BASE}/user/${userId}/ride-status/stream`);
+  source.onmessage = (event) => {
+    try {
+      onStatus(JSON.parse(event.data));
+    } catch (error) {
+      console.error('Bad ride status event:', error);
+    }
+  };
+  return () => source.close();
+};
+
+// Driver gateway: one WebSocket carries heartbeats and pushes ride offers
+const GATEWAY_BASE = API_BASE.replace(/^http/, 'ws').replace(/\/api$/, '');
+
+export const connectDriverGateway = (
+  driverId: number,
+  onOffer: (offer: any) => void,
+  onOfferClosed: (matchIds: number[]) => void,
+  onConnected: () => void
+) => {
+  let socket: WebSocket;
+  let heartbeat: ReturnType<typeof setInterval>;
+  let retry: ReturnType<typeof setTimeout>;
+  let closed = false;
+
+  const connect = () => {
+    socket = new WebSocket(`${GATEWAY_BASE}/ws/driver/${driverId}`);
+    socket.onopen = () => {
+      heartbeat = setInterval(() => socket.send(JSON.stringify({ type: 'heartbeat' })), 10000);
+    };
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === 'connected') {
+        onConnected();
+      } else if (message.type === 'offer') {
+        // Ack straight away: the server is waiting on it
+        socket.send(JSON.stringify({ type: 'ack', id: message.id }));
+        onOffer(message);
+      } else if (message.type === 'offer_closed') {
+        onOfferClosed(message.match_ids);
+      }
+    };
+    socket.onclose = () => {
+      clearInterval(heartbeat);
+      if (!closed) retry = setTimeout(connect, 3000);
+    };
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    clearTimeout(retry);
+    socket.close();
+  };
+};
+
 export const getAllRideRequests = async () => {
   try {
     const response = await fetch(`${API_BASE}/ride-requests`);
@@ -164,6 +223,7 @@ export const registerDriver = async (
         driver_id: driverId.startsWith('DRIVER-') ? driverId : `DRIVER-${driverId}`,
         name: name,
         port: parseInt(driverId.replace('DRIVER-', '')) || 9000,
+        transport: 'web',
         location: location,
         vehicle_type: vehicleType,
         phone_number: phoneNumber,
@@ -251,6 +311,7 @@ export const acceptRideRequest = async (driverId: number, matchId: number): Prom
     method: 'POST',
     headers: { 'Content-Type': 'application/json' }
   });
+  if (response.status === 409) throw new Error('Ride already taken');
   if (!response.ok) throw new Error('Failed to accept ride');
   return await response.json();
 };
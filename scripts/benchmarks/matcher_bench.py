@@ -0,0 +1,303 @@
+"""
+Matcher microbenchmark
+Runs the real matcher tick (claim -> index sync -> candidates -> assignment)
+from server_matcher.py against synthetic cities and reports per-tick wall
+time, peak allocations, DB round-trips and average pickup distance.
+
+Usage:
+    python scripts/benchmarks/matcher_bench.py                 # default scenarios, compare with baseline
+    python scripts/benchmarks/matcher_bench.py --full          # adds 100k-driver / 10k-ride cities
+    python scripts/benchmarks/matcher_bench.py --write-baseline
+
+Runs on a throwaway SQLite file unless BENCH_DATABASE_URL is set (point it
+at a scratch Postgres database to include real network round-trips; its
+tables are dropped and recreated). Driver liveness is pre-warmed, as in a
+steady-state matcher, so no HTTP probes are timed.
+"""
+import argparse
+import asyncio
+import atexit
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCH_DIR, "matcher_baseline.json")
+WORK_DIR = tempfile.mkdtemp(prefix="velo_bench_")
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+
+# Must be set before the matcher (and its engine) is imported
+os.environ["DATABASE_URL"] = os.getenv(
+    "BENCH_DATABASE_URL", f"sqlite:///{os.path.join(WORK_DIR, 'matcher_bench.db')}"
+)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "..", "serverapp"))
+# matcher.log is written to the working directory
+os.chdir(WORK_DIR)
+
+from sqlalchemy import event, insert
+
+import server_matcher as matcher
+from database.connections import engine, SessionLocal
+from database.models import Base, DriverInfo, RideRequest
+from services.liveness import LivenessService
+
+# Bangalore-sized service area (~30 x 30 km)
+CITY_CENTER = (12.97, 77.59)
+CITY_SPAN_DEG = 0.27
+HOTSPOTS = 6
+HOTSPOT_SIGMA_DEG = 0.015
+SCHOOL_POOL_SHARE = 0.05
+SAFE_DRIVER_SHARE = 0.2
+
+# (name, drivers, rides, distribution)
+SCENARIOS = [
+    ("uniform-1k-100", 1_000, 100, "uniform"),
+    ("clustered-1k-100", 1_000, 100, "clustered"),
+    ("uniform-10k-1k", 10_000, 1_000, "uniform"),
+    ("clustered-10k-1k", 10_000, 1_000, "clustered"),
+]
+FULL_SCENARIOS = [
+    ("uniform-100k-10k", 100_000, 10_000, "uniform"),
+    ("clustered-100k-10k", 100_000, 10_000, "clustered"),
+]
+MODES = ("greedy", "batch")
+
+# Stop a run after this many ticks even if rides are still being matched
+MAX_TICKS = 200
+
+
+def city_points(rng, count: int, distribution: str, hotspots) -> np.ndarray:
+    """count (lat, lng) points inside the service area"""
+    if distribution == "uniform":
+        offsets = rng.uniform(-CITY_SPAN_DEG / 2, CITY_SPAN_DEG / 2, size=(count, 2))
+        return offsets + CITY_CENTER
+    centers = hotspots[rng.integers(0, len(hotspots), size=count)]
+    return centers + rng.normal(0, HOTSPOT_SIGMA_DEG, size=(count, 2))
+
+
+def seed_city(drivers: int, rides: int, distribution: str, seed: int = 42):
+    """Recreate the tables and bulk-insert a synthetic city"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    rng = np.random.default_rng(seed)
+    hotspots = CITY_CENTER + rng.uniform(-CITY_SPAN_DEG / 3, CITY_SPAN_DEG / 3, size=(HOTSPOTS, 2))
+    driver_points = city_points(rng, drivers, distribution, hotspots)
+    ride_points = city_points(rng, rides, distribution, hotspots)
+    safe = rng.random(drivers) < SAFE_DRIVER_SHARE
+    school = rng.random(rides) < SCHOOL_POOL_SHARE
+
+    with SessionLocal() as db:
+        db.execute(insert(DriverInfo), [
+            {
+                "driver_id": 100_000 + i,
+                "available": True,
+                "current_location": f"{lat:.6f},{lng:.6f}",
+                "current_lat": lat,
+                "current_lng": lng,
+                "vehicle_type": "auto",
+                "is_verified_safe": bool(safe[i]),
+            }
+            for i, (lat, lng) in enumerate(driver_points)
+        ])
+        db.execute(insert(RideRequest), [
+            {
+                "user_id": 1_000_000 + i,
+                "source_location": f"{lat:.6f},{lng:.6f}",
+                "dest_location": f"{CITY_CENTER[0]},{CITY_CENTER[1]}",
+                "source_lat": lat,
+                "source_lng": lng,
+                "dest_lat": CITY_CENTER[0],
+                "dest_lng": CITY_CENTER[1],
+                "status": "pending",
+                "ride_type": "school_pool" if school[i] else "auto",
+            }
+            for i, (lat, lng) in enumerate(ride_points)
+        ])
+        db.commit()
+
+    return [100_000 + i for i in range(drivers)]
+
+
+def reset_matcher(mode: str, driver_ids):
+    """Fresh matcher state: empty index, warm liveness cache, chosen mode"""
+    matcher.MATCHER_ASSIGNMENT_MODE = mode
+    matcher.driver_index.clear()
+    matcher._index_synced_at = None
+    matcher._index_rebuilt_at = None
+    matcher.liveness = LivenessService(ttl_seconds=float("inf"))
+    for driver_id in driver_ids:
+        matcher.liveness.set(driver_id, True)
+
+
+class RoundTripCounter:
+    """Counts statements sent to the database"""
+
+    def __init__(self):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def run_scenario(name, drivers, rides, distribution, mode, counter, trace_alloc=False):
+    driver_ids = seed_city(drivers, rides, distribution)
+    reset_matcher(mode, driver_ids)
+
+    tick_ms, round_trips, peaks_kb = [], [], []
+    pickup_km = []
+    if trace_alloc:
+        tracemalloc.start()
+
+    with open(os.devnull, "w") as devnull:
+        for _ in range(MAX_TICKS):
+            db = SessionLocal()
+            try:
+                if trace_alloc:
+                    tracemalloc.reset_peak()
+                before = counter.count
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(devnull):
+                    assigned = asyncio.run(matcher.run_tick(db))
+                    db.commit()
+                elapsed = time.perf_counter() - started
+            finally:
+                db.close()
+
+            if not assigned:
+                break
+            tick_ms.append(elapsed * 1000)
+            round_trips.append(counter.count - before)
+            pickup_km.extend(dist for _, _, dist in assigned)
+            if trace_alloc:
+                peaks_kb.append(tracemalloc.get_traced_memory()[1] / 1024)
+
+    if trace_alloc:
+        tracemalloc.stop()
+        return {"alloc_peak_kb": round(max(peaks_kb), 1) if peaks_kb else 0.0}
+
+    return {
+        "drivers": drivers,
+        "rides": rides,
+        "distribution": distribution,
+        "mode": mode,
+        "ticks": len(tick_ms),
+        "matched": len(pickup_km),
+        "tick_ms": {
+            "mean": round(statistics.mean(tick_ms), 2) if tick_ms else 0.0,
+            "p50": round(statistics.median(tick_ms), 2) if tick_ms else 0.0,
+            "p95": round(sorted(tick_ms)[int(0.95 * (len(tick_ms) - 1))], 2) if tick_ms else 0.0,
+            "max": round(max(tick_ms), 2) if tick_ms else 0.0,
+        },
+        "db_round_trips_per_tick": round(statistics.mean(round_trips), 1) if round_trips else 0.0,
+        "avg_pickup_km": round(statistics.mean(pickup_km), 3) if pickup_km else None,
+    }
+
+
+# Metrics compared against the baseline; higher is worse for all of them
+TRACKED = (
+    ("tick_ms.p50", lambda r: r["tick_ms"]["p50"]),
+    ("db_round_trips_per_tick", lambda r: r["db_round_trips_per_tick"]),
+    ("alloc_peak_kb", lambda r: r.get("alloc_peak_kb")),
+    ("avg_pickup_km", lambda r: r["avg_pickup_km"]),
+)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Human-readable regressions beyond tolerance (e.g. 0.25 = 25% worse)"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get("results", {}).get(key)
+        if not base:
+            continue
+        for metric, get in TRACKED:
+            new, old = get(result), get(base)
+            if new is None or old is None or old <= 0:
+                continue
+            change = (new - old) / old
+            marker = "❌" if change > tolerance else "  "
+            print(f"   {marker} {key:28s} {metric:24s} {old:>10.2f} -> {new:>10.2f} ({change:+.0%})")
+            if change > tolerance:
+                regressions.append(f"{key} {metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Matcher microbenchmark")
+    parser.add_argument("--full", action="store_true", help="include the 100k-driver cities")
+    parser.add_argument("--mode", choices=MODES, help="only benchmark one assignment mode")
+    parser.add_argument("--scenario", help="only run scenarios whose name contains this")
+    parser.add_argument("--no-alloc", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--write-baseline", action="store_true", help=f"write results to {BASELINE_PATH}")
+    parser.add_argument("--output", help="also write results JSON here")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing")
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS + (FULL_SCENARIOS if args.full else [])
+    if args.scenario:
+        scenarios = [s for s in scenarios if args.scenario in s[0]]
+    modes = [args.mode] if args.mode else MODES
+
+    counter = RoundTripCounter()
+    results = {}
+    print(f"🏁 Matcher benchmark ({engine.dialect.name}, index={matcher.MATCHER_INDEX})")
+    for name, drivers, rides, distribution in scenarios:
+        for mode in modes:
+            key = f"{name}/{mode}"
+            result = run_scenario(name, drivers, rides, distribution, mode, counter)
+            if not args.no_alloc:
+                # Separate pass: tracing would distort the wall-clock numbers
+                result.update(run_scenario(name, drivers, rides, distribution, mode, counter, trace_alloc=True))
+            results[key] = result
+            print(f"   {key:28s} {result['ticks']:3d} ticks, p50 {result['tick_ms']['p50']:8.2f} ms, "
+                  f"{result['db_round_trips_per_tick']:7.1f} queries/tick, "
+                  f"{result.get('alloc_peak_kb', 0):9.1f} KB peak, "
+                  f"pickup {result['avg_pickup_km'] or 0:.2f} km ({result['matched']}/{rides} matched)")
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "index": matcher.MATCHER_INDEX,
+            "candidates": matcher.MATCHER_CANDIDATES,
+            "claim_batch": matcher.MATCHER_CLAIM_BATCH,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.write_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"💾 Baseline written to {BASELINE_PATH}")
+        return 0
+
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        print(f"\n📊 Compared with baseline (tolerance {args.tolerance:.0%}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s)")
+            return 1
+        print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
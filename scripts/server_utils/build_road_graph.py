@@ -0,0 +1,35 @@
+"""
+Build the matcher's road graph from an OpenStreetMap extract.
+
+Usage: python scripts/server_utils/build_road_graph.py city.osm road_graph.npz [landmarks]
+
+Export the .osm (XML) for your service area from openstreetmap.org or
+convert a .pbf with osmium, then point ROAD_GRAPH_PATH at the output.
+"""
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "serverapp"))
+
+from services.routing import RoadGraph
+
+
+def build(osm_path, out_path, landmarks=8):
+    started = time.time()
+    print(f"🗺️  Parsing {osm_path}...")
+    graph = RoadGraph.from_osm(osm_path)
+    print(f"   {len(graph)} nodes, {graph.edge_count} edges ({time.time() - started:.1f}s)")
+    
+    print(f"📍 Precomputing {landmarks} landmarks...")
+    graph.precompute_landmarks(landmarks)
+    
+    graph.save(out_path)
+    print(f"✅ Saved {out_path} ({time.time() - started:.1f}s total)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    build(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 8)
@@ -1,4 +1,5 @@
 from database.connections import engine
+from database.models import NotificationOutbox, BreadcrumbSegment
 from sqlalchemy import text
 
 def update_schema():
@@ -26,6 +27,62 @@ def update_schema():
             """))
             print("Ensured driver_ratings table exists")
             
+            # One open offer per driver, so parallel matcher workers can't double-book
+            conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS uq_matched_rides_open_offer_driver
+                ON matched_rides (driver_id)
+                WHERE status IN ('pending_notification', 'offered');
+            """))
+            print("Ensured one-open-offer-per-driver index exists")
+            
+            # Notification outbox; matches created before it existed get a row
+            NotificationOutbox.__table__.create(conn, checkfirst=True)
+            conn.execute(text("""
+                INSERT INTO notification_outbox (match_id, ride_id, status, attempts, next_attempt_at, created_at)
+                SELECT m.id, m.ride_id, 'pending', 0, now() at time zone 'utc', now() at time zone 'utc'
+                FROM matched_rides m
+                WHERE m.status = 'pending_notification'
+                  AND NOT EXISTS (SELECT 1 FROM notification_outbox o WHERE o.match_id = m.id);
+            """))
+            print("Ensured notification_outbox table exists (pending matches backfilled)")
+            
+            # Typed coordinates next to the "lat,lng" strings, backfilled from them
+            for table, prefixes in (("driver_info", ("current",)), ("ride_requests", ("source", "dest"))):
+                for prefix in prefixes:
+                    source = "current_location" if prefix == "current" else f"{prefix}_location"
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {prefix}_lat DOUBLE PRECISION;"))
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {prefix}_lng DOUBLE PRECISION;"))
+                    conn.execute(text(f"""
+                        UPDATE {table}
+                        SET {prefix}_lat = split_part({source}, ',', 1)::double precision,
+                            {prefix}_lng = split_part({source}, ',', 2)::double precision
+                        WHERE {prefix}_lat IS NULL
+                          AND {source} ~ '^\\s*-?[0-9]+(\\.[0-9]+)?\\s*,\\s*-?[0-9]+(\\.[0-9]+)?\\s*$';
+                    """))
+            print("Added and backfilled lat/lng columns")
+            
+            # Nearest-driver queries: bounding box, and index-ordered KNN on point(lng, lat)
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_driver_info_position ON driver_info (current_lat, current_lng);"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_driver_info_point ON driver_info USING gist (point(current_lng, current_lat));"))
+            print("Ensured driver position indexes exist")
+            
+            # With PostGIS, a geography column kept in step by Postgres, for metre-accurate KNN
+            try:
+                with conn.begin_nested():
+                    conn.execute(text("CREATE EXTENSION IF NOT EXISTS postgis;"))
+                    conn.execute(text("""
+                        ALTER TABLE driver_info ADD COLUMN IF NOT EXISTS geog geography(Point, 4326)
+                        GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(current_lng, current_lat), 4326)::geography) STORED;
+                    """))
+                    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_driver_info_geog ON driver_info USING gist (geog);"))
+                print("Ensured PostGIS geography column and index exist")
+            except Exception as e:
+                print(f"PostGIS not available, nearest-driver queries use the point index ({e.__class__.__name__})")
+            
+            # Driver location history
+            BreadcrumbSegment.__table__.create(conn, checkfirst=True)
+            print("Ensured breadcrumb_segments table exists")
+            
             conn.commit()
             print("Schema update successful")
         except Exception as e:
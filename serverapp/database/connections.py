@@ -1,7 +1,11 @@
 import os
+from uuid import uuid4
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,19 +16,126 @@ DATABASE_URL = os.getenv(
 )
 # DATABASE_URL = "sqlite:///./mini_uber.db"
 
+# The same database through an asyncio driver, for the API server's async endpoints
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url: str):
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername))
+
+
+# Pool settings can differ per service: MATCHER_DB_POOL_SIZE wins over DB_POOL_SIZE.
+# Each service sets VELO_SERVICE (api, matcher, notifier, pipeline) before importing this.
+VELO_SERVICE = os.getenv("VELO_SERVICE", "").upper()
+
+
+def db_setting(name: str, default: str) -> str:
+    if VELO_SERVICE:
+        value = os.getenv(f"{VELO_SERVICE}_DB_{name}")
+        if value is not None:
+            return value
+    return os.getenv(f"DB_{name}", default)
+
+
+# DATABASE_URL points at PgBouncer in transaction mode: it does the pooling,
+# and server-side prepared statements can't outlive a transaction
+DB_PGBOUNCER = db_setting("PGBOUNCER", "0") == "1"
+
+
+def engine_options(url, asyncio: bool = False) -> dict:
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    if DB_PGBOUNCER:
+        options = {"poolclass": NullPool}
+        if asyncio:
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            }
+        return options
+    return {
+        "pool_size": int(db_setting("POOL_SIZE", "5")),
+        "max_overflow": int(db_setting("MAX_OVERFLOW", "10")),
+        "pool_timeout": float(db_setting("POOL_TIMEOUT", "30")),
+        # Below the server's / load balancer's idle timeout
+        "pool_recycle": int(db_setting("POOL_RECYCLE", "1800")),
+        # Test each connection on checkout, so a failover or restart costs a retry, not an error
+        "pool_pre_ping": db_setting("POOL_PRE_PING", "1") == "1",
+    }
+
+
+# LISTEN holds a session-level connection, which transaction pooling can't give;
+# behind PgBouncer point this straight at Postgres (or at a session-mode pool)
+DATABASE_LISTEN_URL = os.getenv("DATABASE_LISTEN_URL", DATABASE_URL)
+# Streaming replica for read-only sessions; unset sends every read to the primary
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# Replicas further behind than this are skipped until they catch up
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+DB_REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "2"))
+
 # Create engine with error handling
 try:
     print(f"🔌 Connecting to database: {DATABASE_URL}")
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # Async sessions keep loaded attributes after commit: lazy reloads can't happen outside await
+    async_engine = create_async_engine(async_database_url(DATABASE_URL),
+                                       **engine_options(DATABASE_URL, asyncio=True))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
     Base = declarative_base()
-    
+
+    # One long-lived connection per listener, so no pool
+    if DATABASE_LISTEN_URL == DATABASE_URL:
+        listen_engine = engine
+        if DB_PGBOUNCER:
+            print("⚠️ DB_PGBOUNCER is set without DATABASE_LISTEN_URL: LISTEN through transaction pooling misses events")
+    else:
+        listen_engine = create_engine(DATABASE_LISTEN_URL, poolclass=NullPool)
+
+    if DATABASE_REPLICA_URL:
+        from database.replica import ReplicaRouter
+        print(f"🔌 Read replica: {make_url(DATABASE_REPLICA_URL).render_as_string(hide_password=True)}")
+        replica_engine = create_engine(DATABASE_REPLICA_URL, **engine_options(DATABASE_REPLICA_URL))
+        ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+        async_replica_engine = create_async_engine(async_database_url(DATABASE_REPLICA_URL),
+                                                   **engine_options(DATABASE_REPLICA_URL, asyncio=True))
+        AsyncReplicaSessionLocal = async_sessionmaker(async_replica_engine, autoflush=False,
+                                                      expire_on_commit=False)
+        replica_router = ReplicaRouter(replica_engine, DB_REPLICA_MAX_LAG_SECONDS, DB_REPLICA_CHECK_SECONDS)
+    else:
+        replica_router = None
+
+    def ReadSessionLocal():
+        """Session for read-only work: the replica while it keeps up, else the primary"""
+        if replica_router and replica_router.use_replica():
+            return ReplicaSessionLocal()
+        return SessionLocal()
+
+    def AsyncReadSessionLocal():
+        if replica_router and replica_router.use_replica():
+            return AsyncReplicaSessionLocal()
+        return AsyncSessionLocal()
+
     def get_db():
         db = SessionLocal()
         try:
             yield db
         finally:
             db.close()
+
+    def get_read_db():
+        """get_db for endpoints that only read; never write through this session"""
+        db = ReadSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
             
     def create_tables():
         """Create all database tables"""
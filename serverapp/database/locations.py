@@ -0,0 +1,18 @@
+"""
+Location strings
+Locations are stored as "lat,lng" strings; the models keep parsed lat/lng
+columns next to them, and the services parse them with the same helper.
+"""
+
+
+def parse_location(loc_str):
+    """Parse a 'lat,lng' string into a (lat, lng) tuple, or None if invalid"""
+    if not loc_str:
+        return None
+    try:
+        lat, lng = map(float, loc_str.split(','))
+    except (ValueError, AttributeError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
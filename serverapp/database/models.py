@@ -2,9 +2,11 @@
 Fixed Database Models
 All missing columns added, proper types defined
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Numeric
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, LargeBinary, Numeric, Index, text
+from sqlalchemy.orm import validates
 from datetime import datetime
 from .connections import Base
+from .locations import parse_location
 
 # NEW: Application User Model (Riders)
 class User(Base):
@@ -31,6 +33,19 @@ class RideRequest(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     ride_type = Column(String, default="auto")  # NEW: auto, school_pool, moto
     fare = Column(Integer, nullable=True)  # NEW: Fare amount in rupees
+    # Parsed from source_location/dest_location on assignment (NULL if unparseable)
+    source_lat = Column(Float, nullable=True)
+    source_lng = Column(Float, nullable=True)
+    dest_lat = Column(Float, nullable=True)
+    dest_lng = Column(Float, nullable=True)
+
+    @validates("source_location", "dest_location")
+    def _set_coordinates(self, key, value):
+        prefix = key.split("_")[0]
+        lat, lng = parse_location(value) or (None, None)
+        setattr(self, f"{prefix}_lat", lat)
+        setattr(self, f"{prefix}_lng", lng)
+        return value
 
 class DriverInfo(Base):
     """Driver information model"""
@@ -49,6 +64,23 @@ class DriverInfo(Base):
     rating_count = Column(Integer, default=0)      # NEW: Total number of ratings
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Parsed from current_location on assignment; nearest-driver queries use these
+    current_lat = Column(Float, nullable=True)
+    current_lng = Column(Float, nullable=True)
+
+    __table_args__ = (
+        # Bounding-box filter for nearest-driver queries
+        Index("ix_driver_info_position", "current_lat", "current_lng"),
+        # Index-ordered KNN (ORDER BY point <-> point) on Postgres without PostGIS
+        Index(
+            "ix_driver_info_point", text("point(current_lng, current_lat)"), postgresql_using="gist"
+        ).ddl_if(dialect="postgresql"),
+    )
+
+    @validates("current_location")
+    def _set_coordinates(self, key, value):
+        self.current_lat, self.current_lng = parse_location(value) or (None, None)
+        return value
 
 class DriverRating(Base):
     """Individual driver ratings"""
@@ -78,6 +110,82 @@ class MatchedRide(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)  # FIX: Added for stale detection
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # A driver holds at most one open offer, even with several matcher workers
+        Index(
+            "uq_matched_rides_open_offer_driver", "driver_id", unique=True,
+            postgresql_where=text("status IN ('pending_notification', 'offered')"),
+            sqlite_where=text("status IN ('pending_notification', 'offered')")
+        ),
+    )
+
+class NotificationOutbox(Base):
+    """
+    Match notifications waiting for the notifier
+    Written in the same transaction as the match, so an offer is never
+    created without a delivery (or delivered for a rolled-back match).
+    """
+    __tablename__ = "notification_outbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    match_id = Column(Integer, nullable=False, index=True)
+    ride_id = Column(Integer, nullable=True)
+    status = Column(String, default="pending")  # pending, delivered, skipped, dead
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    delivered_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Claim query: pending rows whose next attempt is due
+        Index("ix_notification_outbox_due", "status", "next_attempt_at"),
+    )
+
+class ClientEndpoint(Base):
+    """
+    Where to reach a rider or driver app
+    transport is "web" (browser, polls the API) or "http" (Python client
+    listening on callback_url).
+    """
+    __tablename__ = "client_endpoints"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    role = Column(String, nullable=False)  # user, driver
+    client_id = Column(Integer, nullable=False)
+    transport = Column(String, nullable=False)
+    callback_url = Column(String, nullable=True)
+    last_seen_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("uq_client_endpoints_role_client", "role", "client_id", unique=True),
+    )
+
+class BreadcrumbSegment(Base):
+    """
+    A few minutes of one driver's location history
+    points holds (time, lat, lng) samples as delta + zigzag varint encoded
+    milliseconds and microdegrees (services/breadcrumbs.py), a few bytes
+    per sample. Rows are only ever inserted, and deleted past retention.
+    """
+    __tablename__ = "breadcrumb_segments"
+    
+    id = Column(Integer, primary_key=True)
+    driver_id = Column(Integer, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    ended_at = Column(DateTime, nullable=False)
+    point_count = Column(Integer, nullable=False)
+    points = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        # Range queries: one driver, a time window
+        Index("ix_breadcrumb_segments_driver_time", "driver_id", "started_at"),
+        # Retention: delete everything that ended before the cutoff
+        Index("ix_breadcrumb_segments_ended_at", "ended_at"),
+    )
+
 # NEW: School Pool Pass Models
 
 class StudentProfile(Base):
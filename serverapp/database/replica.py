@@ -0,0 +1,70 @@
+"""
+Read-replica routing
+Read-only sessions (admin pages, plain status polls) go to a streaming
+replica while it is keeping up, and back to the primary when it falls
+behind or can't be reached. A background thread measures the replica's
+replay lag every few seconds, so picking a target never costs a query.
+"""
+import threading
+import time
+
+from sqlalchemy import text
+
+# Seconds the replica is behind the primary; 0 when it has replayed everything it received
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class ReplicaRouter:
+    """Says whether reads may go to the replica right now"""
+
+    def __init__(self, replica_engine, max_lag_seconds: float = 5.0, check_seconds: float = 2.0):
+        self.engine = replica_engine
+        self.max_lag_seconds = max_lag_seconds
+        self.check_seconds = check_seconds
+        # None until the first check: reads stay on the primary until the replica is known good
+        self.lag_seconds = None
+        self._healthy = False
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def use_replica(self) -> bool:
+        self._ensure_started()
+        return self._healthy
+
+    def check(self):
+        """Measure replication lag once and update the routing decision"""
+        try:
+            with self.engine.connect() as conn:
+                lag = float(conn.execute(REPLICA_LAG_SQL).scalar() or 0)
+        except Exception as e:
+            lag = None
+            healthy = False
+            reason = f"unreachable ({e.__class__.__name__})"
+        else:
+            healthy = lag <= self.max_lag_seconds
+            reason = f"{lag:.1f}s behind"
+        if healthy != self._healthy:
+            if healthy:
+                print(f"✅ Read replica back in use ({reason})")
+            else:
+                print(f"⚠️ Read replica {reason}, reading from the primary")
+        self.lag_seconds = lag
+        self._healthy = healthy
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="replica-lag", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self.check()
+            time.sleep(self.check_seconds)
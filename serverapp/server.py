@@ -1,8 +1,12 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 import random
-from datetime import datetime, timedelta
+import asyncio
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -12,11 +16,32 @@ import sys
 import os
 
 sys.path.insert(0, os.path.dirname(__file__))
+# Picks this service's database pool settings (e.g. API_DB_POOL_SIZE)
+os.environ.setdefault("VELO_SERVICE", "api")
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from database.connections import SessionLocal, engine
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.connections import SessionLocal, AsyncSessionLocal, AsyncReadSessionLocal, engine, listen_engine, get_read_db
 from database.models import Base, RideRequest, DriverInfo, MatchedRide, StudentProfile, Subscription, SubscriptionSchedule, DriverRating, User
 from models.schemas import RideCreate, DriverCreate, UpdateMatchPayload
+from services.events import EventListener, notify_matcher, subscribe_local
+from services.offers import (
+    OFFERS_CHANNEL, OPEN_OFFER_STATUSES, announce_closed, withdraw_other_offers, requeue_if_no_offers
+)
+from services.geo import parse_location
+from services.nearby import nearest_available_drivers
+from services.routing import get_router
+from services.metrics import OFFER_DECLINES, GATEWAY_CONNECTIONS, OFFER_MAILBOX_LOOKUPS, DRIVERS_PRESENT, metrics_response
+from services.endpoints import (
+    CLIENT_TRANSPORTS, TRANSPORT_WEB, TRANSPORT_GATEWAY, register_endpoint, local_callback_url
+)
+from services.driver_gateway import DriverGateway
+from services.location_buffer import LocationBuffer, write_location_batch
+from services.breadcrumbs import BreadcrumbRecorder, write_segments, load_track, simplify_track
+from services.presence import PresenceService, write_presence
+from services.liveness import HEARTBEAT_CUTOFF_SECONDS
+from services.offer_mailbox import OfferMailbox
+from services.ride_status import RIDES_CHANNEL, RideStatusHub, notify_rider
 
 # NEW: Schemas for School Pool
 class StudentCreate(BaseModel):
@@ -58,6 +83,67 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Live rider status and driver gateway: changes from every service arrive over LISTEN/NOTIFY
+server_events = EventListener(listen_engine, RIDES_CHANNEL, OFFERS_CHANNEL)
+ride_status_hub = RideStatusHub()
+server_events.add_handler(RIDES_CHANNEL, ride_status_hub.on_event)
+server_events.add_handler(OFFERS_CHANNEL, ride_status_hub.on_offer_event)
+# Base URL the notifier uses to reach drivers connected to this process; give
+# each API process its own (one uvicorn worker per URL) for direct pushes
+DRIVER_GATEWAY_URL = os.getenv("DRIVER_GATEWAY_URL", "http://localhost:8000")
+# Every ping is also kept as location history, written a segment at a time
+breadcrumbs = BreadcrumbRecorder(
+    segment_seconds=float(os.getenv("BREADCRUMB_SEGMENT_SECONDS", "300")),
+    flush_seconds=float(os.getenv("BREADCRUMB_FLUSH_SECONDS", "10")),
+    retention_days=float(os.getenv("BREADCRUMB_RETENTION_DAYS", "28"))
+)
+# Driver heartbeats are kept in memory; the database gets a snapshot now and then
+presence = PresenceService(
+    ttl_seconds=HEARTBEAT_CUTOFF_SECONDS,
+    snapshot_seconds=float(os.getenv("PRESENCE_SNAPSHOT_SECONDS", "15"))
+)
+DRIVERS_PRESENT.set_function(lambda: len(presence))
+# Driver locations (HTTP and gateway) are written in one batch per flush
+location_buffer = LocationBuffer(
+    flush_seconds=float(os.getenv("LOCATION_FLUSH_MS", "500")) / 1000,
+    min_move_meters=float(os.getenv("LOCATION_MIN_MOVE_METERS", "10")),
+    known_ttl_seconds=float(os.getenv("KNOWN_DRIVER_TTL_SECONDS", "300")),
+    trail=breadcrumbs,
+    presence=presence
+)
+driver_gateway = DriverGateway(location_buffer, presence)
+server_events.add_handler(OFFERS_CHANNEL, driver_gateway.on_offer_event)
+GATEWAY_CONNECTIONS.set_function(lambda: len(driver_gateway))
+# Pending-ride polls are answered from memory while offer events are coming in
+offer_mailbox = OfferMailbox(
+    is_live=lambda: server_events.listening,
+    ttl_seconds=float(os.getenv("OFFER_MAILBOX_TTL_SECONDS", "30"))
+)
+server_events.add_handler(OFFERS_CHANNEL, offer_mailbox.on_event)
+if not server_events.enabled:
+    # No LISTEN/NOTIFY: still push the changes made by this process
+    subscribe_local(RIDES_CHANNEL, ride_status_hub.on_event)
+    subscribe_local(OFFERS_CHANNEL, ride_status_hub.on_offer_event)
+    subscribe_local(OFFERS_CHANNEL, driver_gateway.on_offer_event)
+# Idle streams (and parked long polls) re-check the status this often
+RIDE_STREAM_KEEPALIVE_SECONDS = 15
+# Longest a long poll (?wait=) is held open
+LONG_POLL_MAX_WAIT_SECONDS = 30
+
+@app.on_event("startup")
+async def start_server_events():
+    try:
+        server_events.start()
+    except Exception as e:
+        print(f"⚠️ Could not LISTEN for ride/offer updates ({e}), polls will read the database")
+    start_location_writers()
+
+@app.on_event("shutdown")
+async def flush_locations():
+    await location_buffer.flush()
+    await breadcrumbs.flush(everything=True)
+    await presence.flush(closing=True)
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -66,6 +152,12 @@ def get_db():
     finally:
         db.close()
 
+# Async sessions for the hot ride-lifecycle, polling and location endpoints,
+# so they don't queue for the threadpool behind slow commits
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # Schema for driver registration
 class DriverRegister(BaseModel):
     driver_id: str
@@ -75,6 +167,8 @@ class DriverRegister(BaseModel):
     vehicle_type: str = "auto"
     phone_number: str = None
     vehicle_details: str = None
+    transport: Optional[str] = None      # "web" or "http" (Python client on `port`)
+    callback_url: Optional[str] = None   # defaults to http://localhost:{port}
 
 # Auth Configuration
 SECRET_KEY = "supersecretkey" # In prod, use environment variable
@@ -105,6 +199,22 @@ class TokenData(BaseModel):
 class DriverLogin(BaseModel):
     driver_id: int
 
+class ClientRegister(BaseModel):
+    role: str                            # "user" or "driver"
+    client_id: int
+    transport: str                       # "web" or "http"
+    port: Optional[int] = None
+    callback_url: Optional[str] = None
+
+class RouteMatrixRequest(BaseModel):
+    origins: list[str]       # "lat,lng"
+    destinations: list[str]  # "lat,lng"
+
+# Each matrix search is a Python Dijkstra: keep requests to a few hundred ms
+ROUTE_MATRIX_MAX_CELLS = int(os.getenv("ROUTE_MATRIX_MAX_CELLS", "1000"))
+ROUTE_MATRIX_MAX_SEARCHES = int(os.getenv("ROUTE_MATRIX_MAX_SEARCHES", "10"))
+ROUTE_MATRIX_MAX_SECONDS = float(os.getenv("ROUTE_MATRIX_MAX_SECONDS", "900"))
+
 # Auth Utils
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -122,7 +232,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -137,7 +247,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == token_data.email).first()
+    user = await db.scalar(select(User).where(User.email == token_data.email).limit(1))
     if user is None:
         raise credentials_exception
     return user
@@ -146,6 +256,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
 def read_root():
     return {"message": "Mini Uber API v3 - WORKING"}
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint"""
+    return metrics_response()
+
 # NEW: Auth Endpoints
 @app.post("/api/signup", response_model=Token)
 def signup(user: UserCreate, db: Session = Depends(get_db)):
@@ -181,6 +296,10 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Riders log in from the web app, which polls for ride updates
+    register_endpoint(db, "user", user.id, TRANSPORT_WEB)
+    db.commit()
+    
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.email}, expires_delta=access_token_expires
@@ -198,6 +317,10 @@ def login_json(user_login: UserLogin, db: Session = Depends(get_db)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Riders log in from the web app, which polls for ride updates
+    register_endpoint(db, "user", user.id, TRANSPORT_WEB)
+    db.commit()
+    
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.email}, expires_delta=access_token_expires
@@ -216,6 +339,8 @@ def read_users_me(current_user: User = Depends(get_current_user)):
 @app.post("/driver/register")
 def register_driver(driver: DriverRegister, db: Session = Depends(get_db)):
     """Register a new driver"""
+    if driver.transport and driver.transport not in CLIENT_TRANSPORTS:
+        raise HTTPException(status_code=400, detail=f"transport must be one of {CLIENT_TRANSPORTS}")
     try:
         print(f"\n📥 Driver registration: {driver.driver_id}")
         
@@ -268,7 +393,15 @@ def register_driver(driver: DriverRegister, db: Session = Depends(get_db)):
             )
             db.add(new_driver)
             print(f"✅ Created NEW driver {numeric_id} (Port: {driver.port})")
+        
+        # Older clients don't say; the notifier works it out on first delivery
+        if driver.transport:
+            register_endpoint(
+                db, "driver", numeric_id, driver.transport,
+                driver.callback_url or local_callback_url(driver.port)
+            )
             
+        notify_matcher(db, "driver_available", driver_id=numeric_id)
         db.commit()
         
         return {
@@ -283,12 +416,31 @@ def register_driver(driver: DriverRegister, db: Session = Depends(get_db)):
         print(f"❌ Registration error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/clients/register")
+def register_client(client: ClientRegister, db: Session = Depends(get_db)):
+    """Tell the notifier how to reach a rider/driver app (Python clients call this on startup)"""
+    if client.role not in ("user", "driver"):
+        raise HTTPException(status_code=400, detail="role must be 'user' or 'driver'")
+    if client.transport not in CLIENT_TRANSPORTS:
+        raise HTTPException(status_code=400, detail=f"transport must be one of {CLIENT_TRANSPORTS}")
+    callback_url = client.callback_url or (local_callback_url(client.port) if client.port else None)
+    try:
+        register_endpoint(db, client.role, client.client_id, client.transport, callback_url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    return {"status": "registered", "transport": client.transport, "callback_url": callback_url}
+
 @app.post("/driver/login")
 def login_driver(login: DriverLogin, db: Session = Depends(get_db)):
     driver = db.query(DriverInfo).filter(DriverInfo.driver_id == login.driver_id).first()
     if not driver:
         raise HTTPException(status_code=404, detail="Driver not found")
     
+    # Logged in from the web app, so offers are picked up by polling
+    register_endpoint(db, "driver", driver.driver_id, TRANSPORT_WEB)
+    db.commit()
+    
     return {
         "message": "Login successful",
         "driver_id": f"DRIVER-{driver.driver_id}",
@@ -300,34 +452,38 @@ def login_driver(login: DriverLogin, db: Session = Depends(get_db)):
     }
 
 @app.post("/driver/heartbeat")
-def driver_heartbeat(driver_id: str, db: Session = Depends(get_db)):
+async def driver_heartbeat(driver_id: str):
+    """Mark the driver online (in memory; written with the next presence snapshot)"""
     try:
         numeric_id = int(driver_id.replace("DRIVER-", ""))
-        driver = db.query(DriverInfo).filter(DriverInfo.driver_id == numeric_id).first()
-        if not driver:
+        if await unknown_drivers({numeric_id}):
             raise HTTPException(status_code=404, detail="Driver not found")
-        driver.updated_at = datetime.utcnow()
-        db.commit()
+        start_location_writers()
+        presence.beat(numeric_id)
         return {"status": "ok"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/driver/set-availability")
-def set_driver_availability(driver_id: str, is_available: bool, db: Session = Depends(get_db)):
+async def set_driver_availability(driver_id: str, is_available: bool, db: AsyncSession = Depends(get_async_db)):
     try:
         numeric_id = int(driver_id.replace("DRIVER-", ""))
-        driver = db.query(DriverInfo).filter(DriverInfo.driver_id == numeric_id).first()
+        driver = await db.scalar(select(DriverInfo).where(DriverInfo.driver_id == numeric_id).limit(1))
         if not driver:
             raise HTTPException(status_code=404, detail="Driver not found")
         driver.available = is_available
-        db.commit()
+        if is_available:
+            notify_matcher(db, "driver_available", driver_id=numeric_id)
+        await db.commit()
         print(f"✅ Driver {numeric_id} availability: {is_available}")
         return {"message": "Availability updated", "is_available": is_available}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/ride/")
-def create_ride(ride: RideCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_ride(ride: RideCreate, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     new = RideRequest(
         user_id=current_user.id, # Use authenticated user ID
         source_location=ride.pickup,
@@ -335,41 +491,47 @@ def create_ride(ride: RideCreate, current_user: User = Depends(get_current_user)
         status="pending"
     )
     db.add(new)
-    db.commit()
-    db.refresh(new)
+    await db.flush()
+    notify_matcher(db, "ride_created", ride_id=new.id)
+    notify_rider(db, current_user.id)
+    await db.commit()
+    await db.refresh(new)
     print(f"✅ Ride {new.id} created for user {current_user.id}")
     return {"message": "ride created", "ride_id": new.id}
 
 @app.post("/api/ride/{ride_id}/cancel")
-def cancel_ride(ride_id: int, db: Session = Depends(get_db)):
+async def cancel_ride(ride_id: int, db: AsyncSession = Depends(get_async_db)):
     """User cancels a ride request"""
-    ride = db.query(RideRequest).filter(RideRequest.id == ride_id).first()
+    ride = await db.get(RideRequest, ride_id)
     if not ride:
         raise HTTPException(status_code=404, detail="Ride not found")
         
     print(f"🚫 User cancelling ride {ride_id}")
     
-    # Check if there is a match in progress
-    match = db.query(MatchedRide).filter(MatchedRide.ride_id == ride_id).first()
-    if match:
+    # Check if there are matches in progress (several while broadcasting)
+    matches = (await db.scalars(select(MatchedRide).where(MatchedRide.ride_id == ride_id))).all()
+    announce_closed(db, *[(m.id, m.driver_id) for m in matches if m.status in OPEN_OFFER_STATUSES])
+    for match in matches:
         # If driver was assigned, free them
         if match.status == "accepted" or match.status == "in_progress":
-             driver = db.query(DriverInfo).filter(DriverInfo.driver_id == match.driver_id).first()
+             driver = await db.scalar(select(DriverInfo).where(DriverInfo.driver_id == match.driver_id).limit(1))
              if driver:
                  driver.available = True
+                 notify_matcher(db, "driver_available", driver_id=driver.driver_id)
                  print(f"   🔓 Driver {driver.driver_id} freed")
         
-        db.delete(match)
-        print(f"   🗑️  Match deleted")
+        await db.delete(match)
+        print(f"   🗑️  Match {match.id} deleted")
     
     # Mark ride as cancelled
     ride.status = "cancelled"
-    db.commit()
+    notify_rider(db, ride.user_id, *[m.driver_id for m in matches if m.status in ("accepted", "in_progress")])
+    await db.commit()
     
     return {"message": "Ride cancelled successfully"}
 
 @app.post("/api/ride-request")
-def create_ride_request(request: dict, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_ride_request(request: dict, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     """Frontend endpoint for creating ride requests"""
     try:
         # Accept both formats: {pickup, drop} or {source_location, dest_location}
@@ -391,8 +553,11 @@ def create_ride_request(request: dict, current_user: User = Depends(get_current_
             fare=request.get('fare')
         )
         db.add(new)
-        db.commit()
-        db.refresh(new)
+        await db.flush()
+        notify_matcher(db, "ride_created", ride_id=new.id)
+        notify_rider(db, user_id)
+        await db.commit()
+        await db.refresh(new)
         print(f"✅ Ride request {new.id} created for user {user_id}")
         
         return {
@@ -413,8 +578,27 @@ def create_ride_request(request: dict, current_user: User = Depends(get_current_
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/drivers/available")
-def get_available_drivers(db: Session = Depends(get_db)):
-    """Get all available drivers"""
+def get_available_drivers(near: Optional[str] = None, k: int = 50, radius_km: Optional[float] = None,
+                          db: Session = Depends(get_read_db)):
+    """Get all available drivers, or with ?near=lat,lng the k nearest (within radius_km)"""
+    if near is not None:
+        point = parse_location(near)
+        if point is None:
+            raise HTTPException(status_code=400, detail="near must be 'lat,lng'")
+        nearest = nearest_available_drivers(db, point[0], point[1], min(max(k, 0), 500), radius_km)
+        return {
+            "count": len(nearest),
+            "drivers": [
+                {
+                    "driver_id": driver_id,
+                    "location": f"{lat},{lng}",
+                    "available": True,
+                    "distance_km": round(dist, 3)
+                }
+                for driver_id, dist, lat, lng in nearest
+            ]
+        }
+    
     drivers = db.query(DriverInfo).filter(DriverInfo.available == True).all()
     return {
         "count": len(drivers),
@@ -430,7 +614,7 @@ def get_available_drivers(db: Session = Depends(get_db)):
     }
 
 @app.get("/api/drivers/{driver_id}")
-def get_driver_info(driver_id: int, db: Session = Depends(get_db)):
+def get_driver_info(driver_id: int, db: Session = Depends(get_read_db)):
     """Get specific driver info"""
     driver = db.query(DriverInfo).filter(DriverInfo.driver_id == driver_id).first()
     if not driver:
@@ -441,20 +625,44 @@ def get_driver_info(driver_id: int, db: Session = Depends(get_db)):
         "available": driver.available
     }
 
+@app.post("/api/route/matrix")
+def route_matrix(payload: RouteMatrixRequest):
+    """Driving times in seconds between points (rows: origins, columns: destinations)"""
+    router = get_router()
+    if router is None:
+        raise HTTPException(status_code=503, detail="No road graph configured (set ROAD_GRAPH_PATH)")
+    if len(payload.origins) * len(payload.destinations) > ROUTE_MATRIX_MAX_CELLS:
+        raise HTTPException(status_code=400, detail=f"Matrix too large (max {ROUTE_MATRIX_MAX_CELLS} cells)")
+    if min(len(payload.origins), len(payload.destinations)) > ROUTE_MATRIX_MAX_SEARCHES:
+        # One search per origin or per destination, whichever side is shorter
+        raise HTTPException(
+            status_code=400,
+            detail=f"Matrix too large (at most {ROUTE_MATRIX_MAX_SEARCHES} origins or destinations)"
+        )
+    
+    origins = [parse_location(p) for p in payload.origins]
+    destinations = [parse_location(p) for p in payload.destinations]
+    if None in origins or None in destinations:
+        raise HTTPException(status_code=400, detail="Locations must be 'lat,lng'")
+    
+    matrix = router.matrix(origins, destinations, max_seconds=ROUTE_MATRIX_MAX_SECONDS)
+    # Unreachable (or farther than ROUTE_MATRIX_MAX_SECONDS) pairs come back as null (JSON has no infinity)
+    return {
+        "durations": [[round(t, 1) if t != float('inf') else None for t in row] for row in matrix]
+    }
+
 @app.post("/driver/update-location")
-def update_driver_location(driver_id: str, location: dict, db: Session = Depends(get_db)):
-    """Update driver location"""
+async def update_driver_location(driver_id: str, location: dict):
+    """Update driver location (written with the next location flush)"""
     try:
         numeric_id = int(driver_id.replace("DRIVER-", ""))
-        driver = db.query(DriverInfo).filter(DriverInfo.driver_id == numeric_id).first()
-        if not driver:
+        if await unknown_drivers({numeric_id}):
             raise HTTPException(status_code=404, detail="Driver not found")
         
-        location_str = f"{location['lat']},{location['lng']}"
-        driver.current_location = location_str
-        driver.updated_at = datetime.utcnow()
-        db.commit()
-        return {"message": "Location updated", "location": location_str}
+        lat, lng = float(location['lat']), float(location['lng'])
+        start_location_writers()
+        location_buffer.record(numeric_id, lat, lng)
+        return {"message": "Location updated", "location": f"{lat},{lng}"}
     except HTTPException:
         raise
     except Exception as e:
@@ -463,108 +671,337 @@ def update_driver_location(driver_id: str, location: dict, db: Session = Depends
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+class LocationPing(BaseModel):
+    driver_id: int
+    lat: float
+    lng: float
+
+class LocationBatch(BaseModel):
+    locations: list[LocationPing]
+
+@app.post("/driver/locations")
+async def update_driver_locations(batch: LocationBatch):
+    """Location pings for many drivers at once (written with the next location flush)"""
+    unknown = await unknown_drivers({ping.driver_id for ping in batch.locations})
+    start_location_writers()
+    moved = 0
+    for ping in batch.locations:
+        if ping.driver_id not in unknown:
+            moved += location_buffer.record(ping.driver_id, ping.lat, ping.lng)
+    return {
+        "accepted": sum(1 for ping in batch.locations if ping.driver_id not in unknown),
+        "moved": moved,
+        "unknown": sorted(unknown)
+    }
+
+async def unknown_drivers(driver_ids: set) -> set:
+    """The ids with no driver_info row; a driver found is remembered for KNOWN_DRIVER_TTL_SECONDS"""
+    missing = {d for d in driver_ids if not location_buffer.is_known(d)}
+    if missing:
+        async with AsyncSessionLocal() as db:
+            found = set(await db.scalars(
+                select(DriverInfo.driver_id).where(DriverInfo.driver_id.in_(missing))
+            ))
+        location_buffer.mark_known(found)
+        missing -= found
+        for driver_id in missing:
+            # Deleted since it was last checked
+            location_buffer.forget(driver_id)
+    return missing
+
+def start_location_writers():
+    """Start the location, breadcrumb and presence flush tasks (idempotent)"""
+    location_buffer.start(flush_location_batch)
+    breadcrumbs.start(flush_breadcrumbs)
+    presence.start(flush_presence)
+
+def flush_presence(seen, online, offline):
+    """Snapshot driver last-seen times and publish online/offline changes (runs in a thread)"""
+    db = SessionLocal()
+    try:
+        write_presence(db, seen, online, offline)
+        db.commit()
+    finally:
+        db.close()
+
+def flush_breadcrumbs(segments, prune_before):
+    """Insert sealed breadcrumb segments and apply retention (runs in a thread)"""
+    db = SessionLocal()
+    try:
+        write_segments(db, segments, prune_before)
+        db.commit()
+    finally:
+        db.close()
+
+def flush_location_batch(moved):
+    """Write buffered locations in one transaction (runs in a thread)"""
+    db = SessionLocal()
+    try:
+        write_location_batch(db, moved)
+        db.commit()
+    finally:
+        db.close()
+
 @app.get("/api/driver/{driver_id}/pending-ride")
-def get_driver_pending_ride(driver_id: int, db: Session = Depends(get_db)):
-    """Check if there's a pending ride OFFERED to this driver"""
-    db.rollback()  # Fresh snapshot
-    
-    match = db.query(MatchedRide).filter(
-        MatchedRide.driver_id == driver_id,
-        MatchedRide.status == "offered"
-    ).first()
+async def get_driver_pending_ride(driver_id: int, wait: float = 0, since: Optional[str] = None):
+    """Check if there's a pending ride OFFERED to this driver (long poll with ?wait=&since=)"""
+    return await long_poll(
+        # Always the primary: the mailbox already keeps these polls off the database
+        lambda replica: pending_ride_status(driver_id), wait, since,
+        lambda: ride_status_hub.subscribe_driver(driver_id),
+        lambda wake: ride_status_hub.unsubscribe_driver(driver_id, wake)
+    )
+
+async def pending_ride_status(driver_id: int) -> dict:
+    """The pending-ride response, from the driver's mailbox when it can answer"""
+    hit, offer = offer_mailbox.get(driver_id)
+    OFFER_MAILBOX_LOOKUPS.labels("hit" if hit else "miss").inc()
+    if not hit:
+        version = offer_mailbox.version()
+        offer = await load_pending_offer(driver_id)
+        offer_mailbox.fill(driver_id, offer, version)
     
-    if not match:
-        # DEBUG: Why no match?
-        check = db.query(MatchedRide).filter(MatchedRide.driver_id == driver_id).first()
-        if check:
-            print(f"   🔍 Polling Debug: Driver {driver_id} has match {check.id} but status is '{check.status}' (Wanted 'offered')")
-        else:
-            # Only print occasionally to avoid spam
-            pass 
-        return {"has_ride": False}
-        
-    ride = db.query(RideRequest).filter(RideRequest.id == match.ride_id).first()
-    if not ride:
-        print(f"   ⚠️ Polling Error: Match {match.id} has no Ride {match.ride_id}")
+    if offer is None:
         return {"has_ride": False}
-    
-    print(f"   ✅ Driver {driver_id} found OFFERED ride {ride.id}")
-    return {
-        "has_ride": True,
-        "match_id": match.id,
-        "ride_id": ride.id,
-        "user_id": ride.user_id,
-        "pickup_location": ride.source_location,
-        "dropoff_location": ride.dest_location,
-        "status": "offered",
-        "ride_type": ride.ride_type,  # NEW: Return ride type
-        "fare": ride.fare  # NEW: Return fare amount
-    }
+    return {"has_ride": True, **offer, "status": "offered"}
+
+async def load_pending_offer(driver_id: int):
+    """The offer waiting for this driver (OFFER_FIELDS), or None"""
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(MatchedRide, RideRequest).join(
+                RideRequest, RideRequest.id == MatchedRide.ride_id
+            ).where(
+                MatchedRide.driver_id == driver_id,
+                MatchedRide.status == "offered"
+            ).limit(1)
+        )).first()
+        if not row:
+            return None
+        match, ride = row
+        print(f"   ✅ Driver {driver_id} found OFFERED ride {ride.id}")
+        return {
+            "match_id": match.id,
+            "ride_id": ride.id,
+            "user_id": ride.user_id,
+            "driver_id": driver_id,
+            "pickup_location": ride.source_location,
+            "dropoff_location": ride.dest_location,
+            "ride_type": ride.ride_type,
+            "fare": ride.fare
+        }
 
 @app.post("/api/driver/{driver_id}/accept-ride/{match_id}")
-def accept_ride(driver_id: int, match_id: int, db: Session = Depends(get_db)):
-    match = db.query(MatchedRide).filter(MatchedRide.id == match_id).first()
+async def accept_ride(driver_id: int, match_id: int, db: AsyncSession = Depends(get_async_db)):
+    match = await db.get(MatchedRide, match_id)
     if not match or match.driver_id != driver_id:
         raise HTTPException(status_code=404, detail="Match not found")
         
-    ride = db.query(RideRequest).filter(RideRequest.id == match.ride_id).first()
+    ride = await db.get(RideRequest, match.ride_id)
     if not ride:
         raise HTTPException(status_code=404, detail="Ride not found")
         
     otp = str(random.randint(1000, 9999))
     
-    # Explicit update to ensure persistence
-    rows_match = db.query(MatchedRide).filter(MatchedRide.id == match_id).update({
-        "status": "accepted",
-        "otp": otp
-    })
-    
-    rows_ride = db.query(RideRequest).filter(RideRequest.id == match.ride_id).update({
-        "status": "matched"
-    })
-    
-    driver = db.query(DriverInfo).filter(DriverInfo.driver_id == driver_id).first()
+    # Compare-and-set: only an offer that is still open can be accepted
+    rows_match = (await db.execute(
+        update(MatchedRide).where(
+            MatchedRide.id == match_id,
+            MatchedRide.status.in_(OPEN_OFFER_STATUSES)
+        ).values(status="accepted", otp=otp),
+        execution_options={"synchronize_session": False}
+    )).rowcount
+    
+    # ...and only one driver can move the ride to matched (row lock serializes racing accepts)
+    rows_ride = 0
+    if rows_match:
+        rows_ride = (await db.execute(
+            update(RideRequest).where(
+                RideRequest.id == match.ride_id,
+                RideRequest.status.in_(["broadcasting", "pending"])
+            ).values(status="matched"),
+            execution_options={"synchronize_session": False}
+        )).rowcount
+    
+    if not rows_ride:
+        ride_id = match.ride_id  # Rollback expires every loaded attribute
+        await db.rollback()
+        print(f"⚠️ Driver {driver_id} lost ride {ride_id} (offer {match_id} no longer open)")
+        raise HTTPException(status_code=409, detail="Ride already taken or offer expired")
+    
+    # First accept wins: pull every other open offer for this ride
+    withdrawn = await db.run_sync(withdraw_other_offers, match.ride_id, keep_match_id=match_id)
+    announce_closed(db, (match_id, driver_id))
+    
+    driver = await db.scalar(select(DriverInfo).where(DriverInfo.driver_id == driver_id).limit(1))
     if driver:
         driver.available = False
+    notify_rider(db, ride.user_id, driver_id)
         
-    db.commit()
+    await db.commit()
     
-    # Re-fetch to confirm
-    updated_ride = db.query(RideRequest).filter(RideRequest.id == match.ride_id).first()
-    print(f"✅ Driver {driver_id} ACCEPTED ride {updated_ride.id}. Status: {updated_ride.status}. OTP: {otp}")
+    if withdrawn:
+        print(f"   📴 Withdrew ride {match.ride_id} offers to drivers {withdrawn}")
+    print(f"✅ Driver {driver_id} ACCEPTED ride {match.ride_id}. OTP: {otp}")
     return {"status": "accepted", "otp": otp}
 
 @app.post("/api/driver/{driver_id}/decline-ride/{match_id}")
-def decline_ride(driver_id: int, match_id: int, db: Session = Depends(get_db)):
-    match = db.query(MatchedRide).filter(MatchedRide.id == match_id).first()
+async def decline_ride(driver_id: int, match_id: int, db: AsyncSession = Depends(get_async_db)):
+    match = await db.get(MatchedRide, match_id)
     if not match or match.driver_id != driver_id:
         raise HTTPException(status_code=404, detail="Match not found")
-        
-    # Update match status to declined
-    db.query(MatchedRide).filter(MatchedRide.id == match_id).update({
-        "status": "declined"
-    })
     
-    # Reset ride status to pending so it can be matched again
-    db.query(RideRequest).filter(RideRequest.id == match.ride_id).update({
-        "status": "pending"
-    })
-    
-    db.commit()
+    if match.status not in OPEN_OFFER_STATUSES:
+        # Already withdrawn/expired - nothing to undo
+        return {"status": match.status}
+        
+    # Compare-and-set, as in accept_ride: a racing accept or expiry wins
+    rows = (await db.execute(
+        update(MatchedRide).where(
+            MatchedRide.id == match_id,
+            MatchedRide.status.in_(OPEN_OFFER_STATUSES)
+        ).values(status="declined"),
+        execution_options={"synchronize_session": False}
+    )).rowcount
+    if not rows:
+        await db.rollback()
+        status = await db.scalar(select(MatchedRide.status).where(MatchedRide.id == match_id))
+        return {"status": status}
+    
+    announce_closed(db, (match_id, driver_id))
+    notify_rider(db, match.user_id)
+    
+    # Reset ride status to pending once no other driver still holds an offer
+    if await db.run_sync(requeue_if_no_offers, match.ride_id, exclude_match_id=match_id):
+        notify_matcher(db, "ride_requeued", ride_id=match.ride_id)
+    
+    await db.commit()
+    OFFER_DECLINES.inc()
     print(f"❌ Driver {driver_id} DECLINED ride {match.ride_id}")
     return {"status": "declined"}
 
+# ---------------------------------------------------------------------------
+# Driver gateway: one WebSocket per driver instead of a port per driver
+# ---------------------------------------------------------------------------
+
+async def set_gateway_endpoint(driver_id: int, connected: bool) -> bool:
+    """Route the driver's offers through this gateway, or back to polling; False if unknown driver"""
+    async with AsyncSessionLocal() as db:
+        if not await db.scalar(select(DriverInfo.id).where(DriverInfo.driver_id == driver_id).limit(1)):
+            return False
+        if connected:
+            await db.run_sync(register_endpoint, "driver", driver_id, TRANSPORT_GATEWAY,
+                              f"{DRIVER_GATEWAY_URL}/gateway/drivers/{driver_id}")
+        else:
+            await db.run_sync(register_endpoint, "driver", driver_id, TRANSPORT_WEB)
+        await db.commit()
+        return True
+
+async def run_driver_action(handler, driver_id: int, match_id: int) -> dict:
+    """accept_ride/decline_ride for a gateway message, in its own session"""
+    async with AsyncSessionLocal() as db:
+        return await handler(driver_id, match_id, db)
+
+async def handle_gateway_message(conn, message: dict):
+    """
+    One driver -> server frame. Heartbeats and locations are only recorded
+    in memory (flushed in batches); accept/decline reuse the HTTP handlers.
+    Returns the reply frame, or None.
+    """
+    kind = message.get("type")
+    message_id = message.get("id")
+    try:
+        if kind == "ack":
+            driver_gateway.handle_ack(conn, message_id)
+            return None
+        if kind == "heartbeat":
+            driver_gateway.mark_seen(conn)
+            result = {"status": "ok"}
+        elif kind == "location":
+            driver_gateway.set_location(conn, float(message["lat"]), float(message["lng"]))
+            result = {"status": "ok"}
+        elif kind in ("accept", "decline"):
+            handler = accept_ride if kind == "accept" else decline_ride
+            match_id = int(message["match_id"])
+            # The driver is answering this offer: no offer_closed for it
+            conn.offers.discard(match_id)
+            result = await run_driver_action(handler, conn.driver_id, match_id)
+        else:
+            return {"type": "error", "id": message_id, "status": 400, "detail": f"Unknown message type '{kind}'"}
+    except HTTPException as e:
+        return {"type": "error", "id": message_id, "status": e.status_code, "detail": e.detail}
+    except (KeyError, TypeError, ValueError) as e:
+        return {"type": "error", "id": message_id, "status": 400, "detail": f"Bad {kind} message: {e}"}
+    
+    # Heartbeats and pings without an id are fire-and-forget
+    if message_id is None and kind in ("heartbeat", "location"):
+        return None
+    return {"type": "result", "id": message_id, "request": kind, **result}
+
+@app.websocket("/ws/driver/{driver_id}")
+async def driver_gateway_socket(websocket: WebSocket, driver_id: int):
+    """
+    Persistent driver connection. Driver -> server frames: heartbeat,
+    location {lat, lng}, accept/decline {match_id}, ack {id}; frames with
+    an "id" get a result/error reply. Server -> driver: offer (ack it with
+    its id) and offer_closed {match_ids}.
+    """
+    await websocket.accept()
+    try:
+        server_events.start()
+    except Exception as e:
+        print(f"⚠️ Could not LISTEN for offer updates ({e})")
+    driver_gateway.start()
+    start_location_writers()
+    
+    if not await set_gateway_endpoint(driver_id, True):
+        await websocket.close(code=4404, reason="Driver not registered")
+        return
+    conn = await driver_gateway.connect(driver_id, websocket)
+    await conn.send({"type": "connected", "driver_id": driver_id})
+    print(f"🔌 Driver {driver_id} connected to gateway ({len(driver_gateway)} connected)")
+    
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                await conn.send({"type": "error", "status": 400, "detail": "Frames must be JSON objects"})
+                continue
+            if not isinstance(message, dict):
+                await conn.send({"type": "error", "status": 400, "detail": "Frames must be JSON objects"})
+                continue
+            reply = await handle_gateway_message(conn, message)
+            if reply:
+                await conn.send(reply)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if driver_gateway.disconnect(conn):
+            # Still the driver's latest socket: fall back to polling until they reconnect
+            await set_gateway_endpoint(driver_id, False)
+            print(f"🔌 Driver {driver_id} disconnected from gateway")
+
+@app.post("/gateway/drivers/{driver_id}/ride/assigned")
+async def gateway_push_offer(driver_id: int, offer: dict):
+    """Notifier push for a gateway driver: relayed over the socket, 200 once the driver acks"""
+    if not driver_gateway.is_connected(driver_id):
+        raise HTTPException(status_code=404, detail="Driver is not connected to this gateway")
+    if not await driver_gateway.deliver_offer(driver_id, offer):
+        raise HTTPException(status_code=504, detail="Driver did not acknowledge the offer")
+    return {"message": "Ride offer received", "status": "pending_acceptance"}
+
 @app.post("/api/ride/{ride_id}/verify-otp")
-def verify_otp(ride_id: int, otp: str, db: Session = Depends(get_db)):
-    ride = db.query(RideRequest).filter(RideRequest.id == ride_id).first()
+async def verify_otp(ride_id: int, otp: str, db: AsyncSession = Depends(get_async_db)):
+    ride = await db.get(RideRequest, ride_id)
     if not ride:
         raise HTTPException(status_code=404, detail="Ride not found")
         
     # Fix: Verify against the ACCEPTED match
-    match = db.query(MatchedRide).filter(
+    match = await db.scalar(select(MatchedRide).where(
         MatchedRide.ride_id == ride_id,
         MatchedRide.status == "accepted"
-    ).first()
+    ).limit(1))
     if not match:
         raise HTTPException(status_code=404, detail="Match not found")
         
@@ -573,21 +1010,30 @@ def verify_otp(ride_id: int, otp: str, db: Session = Depends(get_db)):
         
     ride.status = "in_progress"
     match.status = "in_progress"
-    db.commit()
+    notify_rider(db, ride.user_id, match.driver_id)
+    await db.commit()
     print(f"🚀 Ride {ride_id} STARTED")
     return {"status": "in_progress", "message": "Ride started"}
 
 @app.get("/api/driver/{driver_id}/current-ride")
-def get_driver_current_ride(driver_id: int, db: Session = Depends(get_db)):
-    match = db.query(MatchedRide).filter(
+async def get_driver_current_ride(driver_id: int, wait: float = 0, since: Optional[str] = None):
+    """The driver's accepted/in-progress ride (long poll with ?wait=&since=)"""
+    return await long_poll(
+        lambda replica: read_with_session(driver_current_ride, driver_id, replica), wait, since,
+        lambda: ride_status_hub.subscribe_driver(driver_id),
+        lambda wake: ride_status_hub.unsubscribe_driver(driver_id, wake)
+    )
+
+async def driver_current_ride(db, driver_id: int) -> dict:
+    match = await db.scalar(select(MatchedRide).where(
         MatchedRide.driver_id == driver_id,
         MatchedRide.status.in_(["accepted", "in_progress"])
-    ).first()
+    ).limit(1))
     
     if not match:
         return {"has_ride": False}
         
-    ride = db.query(RideRequest).filter(RideRequest.id == match.ride_id).first()
+    ride = await db.get(RideRequest, match.ride_id)
     if not ride:
         return {"has_ride": False}
         
@@ -601,21 +1047,20 @@ def get_driver_current_ride(driver_id: int, db: Session = Depends(get_db)):
         "otp": match.otp
     }
 
-@app.get("/api/user/{user_id}/ride-status")
-def get_user_ride_status(user_id: int, db: Session = Depends(get_db)):
-    db.rollback() # Ensure fresh data
-    ride = db.query(RideRequest).filter(
+async def ride_status_snapshot(db, user_id: int) -> dict:
+    """What the rider sees: latest ride, its current driver, OTP and driver location"""
+    ride = await db.scalar(select(RideRequest).where(
         RideRequest.user_id == user_id
-    ).order_by(RideRequest.created_at.desc()).first()
+    ).order_by(RideRequest.created_at.desc()).limit(1))
     
     if not ride or ride.status in ["completed", "cancelled"]:
         return {"has_ride": False}
         
-    # Fix: Get the LATEST match that is NOT declined
-    match = db.query(MatchedRide).filter(
+    # Fix: Get the LATEST match that is NOT declined (or withdrawn after another driver won)
+    match = await db.scalar(select(MatchedRide).where(
         MatchedRide.ride_id == ride.id,
-        MatchedRide.status != "declined"
-    ).order_by(MatchedRide.id.desc()).first()
+        MatchedRide.status.notin_(["declined", "withdrawn"])
+    ).order_by(MatchedRide.id.desc()).limit(1))
     
     response = {
         "has_ride": True,
@@ -628,29 +1073,126 @@ def get_user_ride_status(user_id: int, db: Session = Depends(get_db)):
     if match:
         response["driver_id"] = match.driver_id
         response["otp"] = match.otp
-        driver = db.query(DriverInfo).filter(DriverInfo.driver_id == match.driver_id).first()
+        driver = await db.scalar(select(DriverInfo).where(DriverInfo.driver_id == match.driver_id).limit(1))
         if driver:
-            response["driver_location"] = driver.current_location
+            # Pings reach this process before the database
+            response["driver_location"] = location_buffer.latest(match.driver_id) or driver.current_location
             
     return response
 
+@app.get("/api/user/{user_id}/ride-status")
+async def get_user_ride_status(user_id: int, wait: float = 0, since: Optional[str] = None):
+    """What the rider sees (long poll with ?wait=&since=; streaming clients use /stream)"""
+    return await long_poll(
+        lambda replica: read_with_session(ride_status_snapshot, user_id, replica), wait, since,
+        lambda: ride_status_hub.subscribe(user_id),
+        lambda wake: ride_status_hub.unsubscribe(user_id, wake),
+        on_read=lambda status: ride_status_hub.watch_driver(user_id, status.get("driver_id"))
+    )
+
+async def read_with_session(snapshot, client_id: int, replica: bool = False) -> dict:
+    """await snapshot(db, client_id) in its own short-lived session (on the read replica if asked)"""
+    async with (AsyncReadSessionLocal() if replica else AsyncSessionLocal()) as db:
+        return await snapshot(db, client_id)
+
+def response_version(body: dict) -> str:
+    """Fingerprint of a poll response; clients pass it back as ?since="""
+    return hashlib.sha1(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+async def long_poll(read, wait: float, since: Optional[str], subscribe, unsubscribe, on_read=None) -> dict:
+    """
+    Answer a polling endpoint with await read(replica) plus its
+    "version". Given ?wait=<seconds>&since=<version>, a response still at
+    that version is held until the hub reports a change or wait passes.
+    Plain polls may be served by the read replica; held ones read the
+    primary, since they are woken by changes the replica may not have yet.
+    """
+    wait = min(max(wait, 0), LONG_POLL_MAX_WAIT_SECONDS)
+    if not wait or since is None:
+        body = await read(True)
+        return {**body, "version": response_version(body)}
+    
+    try:
+        server_events.start()
+    except Exception as e:
+        print(f"⚠️ Could not LISTEN for ride updates ({e}), long polls will re-check every {RIDE_STREAM_KEEPALIVE_SECONDS}s")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    # Subscribe before reading so a change in between still wakes us
+    wake = subscribe()
+    try:
+        while True:
+            wake.clear()
+            body = await read(False)
+            if on_read:
+                on_read(body)
+            version = response_version(body)
+            remaining = deadline - loop.time()
+            if version != since or remaining <= 0:
+                return {**body, "version": version}
+            try:
+                # Also re-read now and then, as a safety net for missed notifications
+                await asyncio.wait_for(wake.wait(), min(remaining, RIDE_STREAM_KEEPALIVE_SECONDS))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        unsubscribe(wake)
+
+@app.get("/api/user/{user_id}/ride-status/stream")
+async def stream_user_ride_status(user_id: int):
+    """
+    Server-sent events: the ride-status payload, pushed whenever it changes
+    (status, driver assignment, OTP, driver location)
+    """
+    try:
+        server_events.start()
+    except Exception as e:
+        print(f"⚠️ Could not LISTEN for ride updates ({e}), streams will re-check every {RIDE_STREAM_KEEPALIVE_SECONDS}s")
+    wake = ride_status_hub.subscribe(user_id)
+    
+    async def events():
+        last = None
+        try:
+            while True:
+                wake.clear()
+                current = await read_with_session(ride_status_snapshot, user_id)
+                ride_status_hub.watch_driver(user_id, current.get("driver_id"))
+                if current != last:
+                    last = current
+                    yield f"data: {json.dumps(current)}\n\n"
+                try:
+                    await asyncio.wait_for(wake.wait(), RIDE_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Also a safety net for missed notifications: the loop re-reads
+                    yield ": keepalive\n\n"
+        finally:
+            ride_status_hub.unsubscribe(user_id, wake)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/driver/{driver_id}/complete-ride/{ride_id}")
-def complete_ride(driver_id: int, ride_id: int, db: Session = Depends(get_db)):
-    ride = db.query(RideRequest).filter(RideRequest.id == ride_id).first()
+async def complete_ride(driver_id: int, ride_id: int, db: AsyncSession = Depends(get_async_db)):
+    ride = await db.get(RideRequest, ride_id)
     if not ride:
         raise HTTPException(status_code=404, detail="Ride not found")
         
-    match = db.query(MatchedRide).filter(MatchedRide.ride_id == ride_id).first()
+    matches = (await db.scalars(select(MatchedRide).where(MatchedRide.ride_id == ride_id))).all()
     
     ride.status = "completed"
-    if match:
-        db.delete(match)
+    for match in matches:
+        await db.delete(match)
         
-    driver = db.query(DriverInfo).filter(DriverInfo.driver_id == driver_id).first()
+    driver = await db.scalar(select(DriverInfo).where(DriverInfo.driver_id == driver_id).limit(1))
     if driver:
         driver.available = True
+        notify_matcher(db, "driver_available", driver_id=driver_id)
+    notify_rider(db, ride.user_id, driver_id)
         
-    db.commit()
+    await db.commit()
     print(f"🏁 Ride {ride_id} COMPLETED")
     return {"status": "completed"}
 
@@ -1332,7 +1874,7 @@ def start_school_route(driver_id: int, route_id: int, db: Session = Depends(get_
 # ==================== ADMIN APIs ====================
 
 @app.get("/api/admin/drivers")
-def get_all_drivers_admin(db: Session = Depends(get_db)):
+def get_all_drivers_admin(db: Session = Depends(get_read_db)):
     """Get all drivers with verification status and details"""
     drivers = db.query(DriverInfo).all()
     
@@ -1404,7 +1946,7 @@ def unverify_driver(driver_id: int, db: Session = Depends(get_db)):
     }
 
 @app.get("/api/admin/drivers/verified")
-def get_verified_drivers(db: Session = Depends(get_db)):
+def get_verified_drivers(db: Session = Depends(get_read_db)):
     """Get only verified drivers"""
     drivers = db.query(DriverInfo).filter(DriverInfo.is_verified_safe == True).all()
     
@@ -1429,7 +1971,7 @@ def get_verified_drivers(db: Session = Depends(get_db)):
     }
 
 @app.get("/api/admin/drivers/{driver_id}/details")
-def get_driver_details(driver_id: int, db: Session = Depends(get_db)):
+def get_driver_details(driver_id: int, db: Session = Depends(get_read_db)):
     """Get detailed information about a specific driver"""
     driver = db.query(DriverInfo).filter(DriverInfo.driver_id == driver_id).first()
     if not driver:
@@ -1467,8 +2009,42 @@ def get_driver_details(driver_id: int, db: Session = Depends(get_db)):
         "assigned_subscriptions": subscription_details,
     }
 
+# Longest window one track request may cover
+TRACK_MAX_HOURS = 24
+
+@app.get("/api/admin/drivers/{driver_id}/track")
+def get_driver_track(driver_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                     tolerance_m: float = 0, db: Session = Depends(get_read_db)):
+    """
+    The driver's location history as [t_ms, lat, lng] points, by default
+    for the last hour. tolerance_m > 0 simplifies the line for map replay.
+    """
+    # Stored times are naive UTC
+    start, end = [t.astimezone(timezone.utc).replace(tzinfo=None) if t and t.tzinfo else t for t in (start, end)]
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=1)
+    if start > end or end - start > timedelta(hours=TRACK_MAX_HOURS):
+        raise HTTPException(status_code=400, detail=f"start must be before end, at most {TRACK_MAX_HOURS}h apart")
+    
+    points = load_track(db, driver_id, start, end)
+    # Samples this process hasn't written yet
+    start_ms = (start - datetime(1970, 1, 1)).total_seconds() * 1000
+    end_ms = (end - datetime(1970, 1, 1)).total_seconds() * 1000
+    recent = [p for p in breadcrumbs.pending(driver_id) if start_ms <= p[0] <= end_ms]
+    if recent:
+        points = sorted(set(points) | set(recent))
+    
+    simplified = simplify_track(points, tolerance_m)
+    return {
+        "driver_id": driver_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "samples": len(points),
+        "points": [[t, lat, lng] for t, lat, lng in simplified]
+    }
+
 @app.get("/api/admin/users")
-def get_all_users_admin(db: Session = Depends(get_db)):
+def get_all_users_admin(db: Session = Depends(get_read_db)):
     """Get all registered users with their ride statistics"""
     users = db.query(User).all()
     
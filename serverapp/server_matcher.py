@@ -1,11 +1,13 @@
 from fastapi import FastAPI, Depends
 from sqlalchemy.orm import Session
+from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
 import asyncio
-import requests
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import math
+import time
 import logging
 from contextlib import asynccontextmanager
 
@@ -19,237 +21,460 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 sys.path.insert(0, os.path.dirname(__file__))
+# Picks this service's database pool settings (e.g. MATCHER_DB_POOL_SIZE)
+os.environ.setdefault("VELO_SERVICE", "matcher")
 
-from database.connections import SessionLocal, engine
+from database.connections import SessionLocal, engine, listen_engine
 from database.models import Base, RideRequest, DriverInfo, MatchedRide
+from services.geo import parse_location, haversine_km
+from services.spatial_index import DriverGridIndex
+from services.driver_snapshot import DriverSnapshot
+from services.nearby import DatabaseDriverIndex
+from services.assignment import min_cost_assignment
+from services.events import EventListener, MATCHER_CHANNEL
+from services.liveness import HEARTBEAT_CUTOFF_SECONDS, LivenessService, driver_port
+from services.presence import PRESENCE_CHANNEL
+from services.routing import get_router, OFF_ROAD_SPEED_KMH
+from services.outbox import enqueue_match, wake_workers
+from services.ride_status import notify_rider
+from services.metrics import (
+    MATCHER_TICK_SECONDS, PENDING_RIDES, CANDIDATES_PER_RIDE, TIME_TO_MATCH_SECONDS,
+    MATCHES_CREATED, metrics_response
+)
 
 Base.metadata.create_all(bind=engine)
 
-def is_driver_online(driver_id: int, db=None) -> bool:
-    """Check if driver is online - for web drivers, check database; for Python clients, check port"""
-    # First check database if available
-    if db is not None:
-        driver = db.query(DriverInfo).filter(DriverInfo.driver_id == driver_id).first()
-        if driver and driver.available:
-            # For web drivers, trust the database availability flag
-            # Try to ping port as fallback (for Python clients), but don't fail if it doesn't exist
-            try:
-                driver_port = driver_id
-                response = requests.get(
-                    f"http://localhost:{driver_port}/status",
-                    timeout=0.5  # Very quick timeout
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    # Python client is online
-                    return data.get('driver_id') == f"DRIVER-{driver_id}" and data.get('is_available', False)
-            except:
-                # Port doesn't exist (web driver) - check heartbeat
-                pass
-            
-            # Check for recent heartbeat (within last 30 seconds)
-            # If no heartbeat in 30s, assume offline
-            if driver.updated_at:
-                # Handle naive vs aware datetime
-                now = datetime.utcnow()
-                last_update = driver.updated_at
-                if last_update.tzinfo:
-                    last_update = last_update.replace(tzinfo=None)
-                
-                time_diff = (now - last_update).total_seconds()
-                if time_diff < 30:
-                    return True
-                else:
-                    print(f"   ❌ Driver {driver_id} offline (Last heartbeat: {int(time_diff)}s ago)")
-                    return False
-            
-            # If updated_at is None (legacy), fallback to True but warn
-            print(f"   ⚠️  Driver {driver_id} has no heartbeat info, assuming online (Legacy)")
-            return True
-            
-        return False
+# Candidate search: k nearest eligible drivers within this radius
+MATCHER_CANDIDATES = int(os.getenv("MATCHER_CANDIDATES", "20"))
+MATCHER_SEARCH_RADIUS_KM = float(os.getenv("MATCHER_SEARCH_RADIUS_KM", "25"))
+# "greedy" (nearest driver per ride, in queue order) or "batch" (min-cost matching per tick)
+MATCHER_ASSIGNMENT_MODE = os.getenv("MATCHER_ASSIGNMENT_MODE", "greedy")
+# Fallback sweep interval; new/re-queued rides and freed drivers wake the loop via NOTIFY
+MATCHER_SWEEP_SECONDS = float(os.getenv("MATCHER_SWEEP_SECONDS", "15"))
+# Offer each ride to this many nearest online drivers at once (first accept wins)
+MATCHER_BROADCAST_K = int(os.getenv("MATCHER_BROADCAST_K", "1"))
+# Max rides one worker locks per tick (others are left for other workers)
+MATCHER_CLAIM_BATCH = int(os.getenv("MATCHER_CLAIM_BATCH", "200"))
+# Optional geographic sharding across workers: "index/count", e.g. "0/4"
+MATCHER_SHARD = os.getenv("MATCHER_SHARD", "0/1")
+MATCHER_SHARD_INDEX, MATCHER_SHARD_COUNT = (int(x) for x in MATCHER_SHARD.split("/"))
+# Pickup cell size used to assign rides to shards (~5.5 km)
+SHARD_CELL_DEG = 0.05
+MATCHER_PORT = int(os.getenv("MATCHER_PORT", "8001"))
+# Rebuild the index from scratch this often to drop deleted drivers
+INDEX_FULL_REFRESH_SECONDS = 60
+
+# "snapshot" (columnar NumPy arrays, vectorized ranking), "grid" (cell lookup)
+# or "db" (KNN query per ride, nothing held in memory)
+MATCHER_INDEX = os.getenv("MATCHER_INDEX", "snapshot")
+
+if MATCHER_INDEX == "db":
+    driver_index = DatabaseDriverIndex()
+elif MATCHER_INDEX == "grid":
+    driver_index = DriverGridIndex()
+else:
+    driver_index = DriverSnapshot()
+matcher_events = EventListener(listen_engine, MATCHER_CHANNEL, PRESENCE_CHANNEL)
+# Online/offline verdicts are reused for this long before re-probing a driver
+liveness = LivenessService(ttl_seconds=float(os.getenv("LIVENESS_TTL_SECONDS", "10")))
+_index_synced_at = None
+_index_rebuilt_at = None
+# driver_id -> when an API server last reported them online (PRESENCE_CHANNEL).
+# Trusted while listening and re-announced every snapshot, so a driver whose
+# API server died without announcing them offline drops out after the cutoff.
+present_drivers = {}
+_presence_pruned_at = 0.0
+
+
+def on_presence(payload: dict):
+    global _presence_pruned_at
+    now = time.monotonic()
+    if now - _presence_pruned_at > HEARTBEAT_CUTOFF_SECONDS:
+        _presence_pruned_at = now
+        for driver_id, seen in list(present_drivers.items()):
+            if now - seen >= HEARTBEAT_CUTOFF_SECONDS:
+                del present_drivers[driver_id]
+    for driver_id in payload.get("online", ()):
+        present_drivers[driver_id] = now
+    # Gone quiet on one API server; another may still hear them, so re-check rather than trust
+    for driver_id in payload.get("offline", ()):
+        present_drivers.pop(driver_id, None)
+
+
+def is_present(driver_id: int) -> bool:
+    seen = present_drivers.get(driver_id)
+    return seen is not None and time.monotonic() - seen < HEARTBEAT_CUTOFF_SECONDS
+
+
+# Presence only feeds the liveness cache; it's no reason to run a tick
+matcher_events.add_handler(PRESENCE_CHANNEL, on_presence, wake=False)
+
+
+def sync_driver_index(db):
+    """
+    Apply driver changes since the last sync to the driver index.
+    Every location update/heartbeat/availability change bumps updated_at,
+    so only rows touched since the previous tick are re-read.
+    """
+    global _index_synced_at, _index_rebuilt_at
+    if MATCHER_INDEX == "db":
+        # Nothing to load: every lookup reads the database's spatial index
+        driver_index.bind(db)
+        return
+    now = datetime.utcnow()
     
-    # Fallback: try port check (for Python clients)
-    try:
-        driver_port = driver_id
-        
-        # FIX: Try to get port from DB object if we have it
-        if db is not None:
-             driver = db.query(DriverInfo).filter(DriverInfo.driver_id == driver_id).first()
-             if driver and driver.vehicle_details and "{" in driver.vehicle_details:
-                 try:
-                     import json
-                     details = json.loads(driver.vehicle_details)
-                     if "port" in details:
-                         driver_port = details["port"]
-                 except:
-                     pass
-
-        response = requests.get(
-            f"http://localhost:{driver_port}/status",
-            timeout=1
-        )
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('driver_id') == f"DRIVER-{driver_id}" and data.get('is_available', False)
-        return False
-    except Exception as e:
-        # print(f"   ⚠️  Driver {driver_id} port check failed: {e}")
-        return False
+    query = db.query(
+        DriverInfo.driver_id, DriverInfo.available, DriverInfo.current_location,
+        DriverInfo.vehicle_type, DriverInfo.is_verified_safe
+    )
+    
+    full = _index_rebuilt_at is None or (now - _index_rebuilt_at).total_seconds() > INDEX_FULL_REFRESH_SECONDS
+    if full:
+        driver_index.clear()
+        rows = query.filter(DriverInfo.available == True).all()
+        _index_rebuilt_at = now
+    else:
+        # Small overlap so writes committed mid-sync are not missed
+        rows = query.filter(DriverInfo.updated_at >= _index_synced_at - timedelta(seconds=5)).all()
+    
+    for driver_id, available, location, vehicle_type, is_safe in rows:
+        if not full:
+            # updated_at moved: heartbeat, location ping or availability flip
+            if available:
+                liveness.record_heartbeat(driver_id)
+            else:
+                liveness.set(driver_id, False)
+        pos = parse_location(location) if available else None
+        if pos:
+            driver_index.upsert(driver_id, pos[0], pos[1], vehicle_type, is_safe)
+        else:
+            driver_index.remove(driver_id)
+    
+    _index_synced_at = now
+
+async def online_drivers(db, driver_ids) -> dict:
+    """Concurrent, TTL-cached liveness for a batch of candidate drivers"""
+    if matcher_events.listening:
+        result = {d: True if is_present(d) else liveness.cached(d) for d in driver_ids}
+    else:
+        # Presence events may have been missed
+        present_drivers.clear()
+        result = {d: liveness.cached(d) for d in driver_ids}
+    unknown = [d for d, online in result.items() if online is None]
+    if unknown:
+        rows = db.query(
+            DriverInfo.driver_id, DriverInfo.available,
+            DriverInfo.updated_at, DriverInfo.vehicle_details
+        ).filter(DriverInfo.driver_id.in_(unknown)).all()
+        for d in unknown:
+            result[d] = False
+        result.update(await liveness.check_many(rows))
+    return result
+
+
+async def is_driver_online(driver_id: int, db) -> bool:
+    """Check if driver is online - Python clients answer on their port, web drivers need a recent heartbeat"""
+    return (await online_drivers(db, [driver_id]))[driver_id]
 
 def calculate_distance(loc1_str: str, loc2_str: str) -> float:
     """Calculate Haversine distance between two 'lat,lng' strings"""
+    p1 = parse_location(loc1_str)
+    p2 = parse_location(loc2_str)
+    if not p1 or not p2:
+        return float('inf')
+    return haversine_km(p1[0], p1[1], p2[0], p2[1])
+
+def find_candidates(db, ride, exclude, quiet=False):
+    """
+    k nearest eligible drivers for a ride as [(driver_id, distance_km, cost)],
+    best first. cost is road ETA in seconds when a road graph is loaded,
+    otherwise the straight-line distance in km.
+    """
+    logger.info(f"   📍 Processing pending ride {ride.id} from user {ride.user_id}")
+    
+    pickup = parse_location(ride.source_location)
+    if not pickup:
+        print(f"   ⚠️  Ride {ride.id}: Invalid pickup location '{ride.source_location}'")
+        return []
+    
+    if MATCHER_INDEX != "db" and len(driver_index) == 0:
+        logger.info("   ℹ️  No available (free) drivers in database")
+        return []
+    
+    # Get declined drivers for THIS ride
+    declined_matches = db.query(MatchedRide).filter(
+        MatchedRide.ride_id == ride.id,
+        MatchedRide.status == "declined"
+    ).all()
+    declined_driver_ids = {m.driver_id for m in declined_matches}
+    
+    # k nearest eligible drivers (Safe Drivers only if School Priority)
+    driver_distances = driver_index.nearest(
+        pickup[0], pickup[1],
+        k=MATCHER_CANDIDATES,
+        radius_km=MATCHER_SEARCH_RADIUS_KM,
+        safe_only=ride.ride_type == "school_priority",
+        exclude=exclude | declined_driver_ids
+    )
+    CANDIDATES_PER_RIDE.observe(len(driver_distances))
+    
+    if driver_distances:
+        print(f"   👥 Ride {ride.id}: Found {len(driver_distances)} candidate(s) (excluding {len(declined_driver_ids)} declined)")
+    elif not quiet:
+        print(f"   ℹ️  No eligible drivers within {MATCHER_SEARCH_RADIUS_KM} km of ride {ride.id}")
+    
+    router = get_router()
+    if router is None or not driver_distances:
+        return [(driver_id, dist, dist) for driver_id, dist in driver_distances]
+    
+    # Re-rank the straight-line shortlist by driving time to the pickup. A driver
+    # on a disconnected bit of road would otherwise make the search walk the
+    # whole graph: stop at twice the farthest candidate's off-road estimate.
+    max_seconds = 2 * max(dist for _, dist in driver_distances) / OFF_ROAD_SPEED_KMH * 3600
+    etas = router.many_to_one([driver_index.position(d) for d, _ in driver_distances], pickup, max_seconds)
+    ranked = []
+    for (driver_id, dist), eta in zip(driver_distances, etas):
+        if eta == float('inf'):
+            # Off the road graph: pessimistic straight-line estimate
+            eta = dist / OFF_ROAD_SPEED_KMH * 3600
+        ranked.append((driver_id, dist, eta))
+    ranked.sort(key=lambda c: c[2])
+    return ranked
+
+
+def ride_shard(source_location: str) -> int:
+    """Shard that owns a ride, by the grid cell of its pickup"""
+    pickup = parse_location(source_location)
+    if not pickup:
+        return 0
+    cell = (math.floor(pickup[0] / SHARD_CELL_DEG), math.floor(pickup[1] / SHARD_CELL_DEG))
+    return hash(cell) % MATCHER_SHARD_COUNT
+
+
+def claim_pending_rides(db):
+    """
+    Lock this worker's pending rides for the rest of the tick's transaction.
+    Rides already locked by another matcher worker are skipped (SKIP LOCKED),
+    so parallel workers never process the same ride.
+    """
+    query = db.query(RideRequest).filter(RideRequest.status == "pending")
+    
+    if MATCHER_SHARD_COUNT > 1:
+        pending = db.query(RideRequest.id, RideRequest.source_location).filter(
+            RideRequest.status == "pending"
+        ).all()
+        own_ids = [ride_id for ride_id, loc in pending if ride_shard(loc) == MATCHER_SHARD_INDEX]
+        if not own_ids:
+            return []
+        query = query.filter(RideRequest.id.in_(own_ids))
+    
+    # School pool first, then by ID (FIFO)
+    return query.order_by(
+        case((RideRequest.ride_type == "school_pool", 0), else_=1),
+        RideRequest.id
+    ).limit(MATCHER_CLAIM_BATCH).with_for_update(skip_locked=True).all()
+
+
+def create_match(db, ride, driver_id: int):
+    """
+    Mark the ride as broadcasting and create a match plus its outbox row
+    for the notifier, atomically.
+    Returns None if another worker reserved the driver first (the unique
+    open-offer index rejects the second insert).
+    """
     try:
-        lat1, lng1 = map(float, loc1_str.split(','))
-        lat2, lng2 = map(float, loc2_str.split(','))
+        with db.begin_nested():
+            ride.status = "broadcasting"
+            new_match = MatchedRide(
+                user_id=ride.user_id,
+                driver_id=driver_id,
+                ride_id=ride.id,
+                status="pending_notification",
+                created_at=datetime.utcnow()
+            )
+            db.add(new_match)
+            db.flush()
+            enqueue_match(db, new_match)
+    except IntegrityError:
+        print(f"   ⚠️  Driver {driver_id} was just reserved by another matcher")
+        return None
+    
+    notify_rider(db, ride.user_id)
+    print(f"   🚀 Match Created: Ride {ride.id} -> Driver {driver_id} (ID: {new_match.id})")
+    return new_match
+
+
+async def assign_greedy(db, rides, busy_driver_ids: set):
+    """
+    One ride at a time: each ride takes its nearest online driver, or is
+    broadcast to its MATCHER_BROADCAST_K nearest when that is above 1.
+    """
+    assigned = []
+    for ride in rides:
+        # Log only if this is the only ride, otherwise it's spammy
+        driver_distances = find_candidates(db, ride, busy_driver_ids, quiet=len(rides) > 1)
+        if not driver_distances:
+            continue
         
-        R = 6371  # Earth radius in km
-        dlat = math.radians(lat2 - lat1)
-        dlng = math.radians(lng2 - lng1)
-        a = math.sin(dlat/2) * math.sin(dlat/2) + \
-            math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * \
-            math.sin(dlng/2) * math.sin(dlng/2)
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        return R * c
-    except:
-        return float('inf')
+        # Probe all candidates at once, then take them in order of proximity
+        online = await online_drivers(db, [driver_id for driver_id, _, _ in driver_distances])
+        offered = []
+        for driver_id, dist, _ in driver_distances:
+            if online[driver_id]:
+                busy_driver_ids.add(driver_id)
+                if not create_match(db, ride, driver_id):
+                    continue
+                if not offered:
+                    print(f"   ✅ Ride {ride.id}: Match found! Driver {driver_id} ({dist:.2f} km away)")
+                    assigned.append((ride, driver_id, dist))
+                offered.append(driver_id)
+                if len(offered) >= MATCHER_BROADCAST_K:
+                    break
+        
+        if len(offered) > 1:
+            print(f"   📣 Ride {ride.id}: Broadcast to {len(offered)} drivers {offered}")
+            # Driver not found via port check OR heartbeat is stale
+    return assigned
+
+
+async def assign_batch(db, rides, busy_driver_ids: set):
+    """
+    Solve a min-cost matching over pickup cost (road ETA, or distance) for
+    all pending rides.
+    School pool rides are solved first so they keep priority over the
+    drivers; the remaining rides share whoever is left. Each ride gets a
+    single offer (MATCHER_BROADCAST_K only applies to greedy mode).
+    """
+    tiers = [
+        [r for r in rides if r.ride_type == "school_pool"],
+        [r for r in rides if r.ride_type != "school_pool"],
+    ]
+    
+    assigned = []
+    for tier in tiers:
+        if not tier:
+            continue
+        
+        candidates = {}
+        for ride in tier:
+            driver_distances = find_candidates(db, ride, busy_driver_ids, quiet=True)
+            if driver_distances:
+                candidates[ride.id] = driver_distances
+        
+        # One concurrent probe round for every candidate in the tier
+        online = await online_drivers(db, {c[0] for cands in candidates.values() for c in cands})
+        candidates = {
+            ride_id: [c for c in cands if online[c[0]]]
+            for ride_id, cands in candidates.items()
+        }
+        candidates = {ride_id: cands for ride_id, cands in candidates.items() if cands}
+        
+        if not candidates:
+            continue
+        
+        # Leaving a ride pending must cost more than any real pickup
+        max_cost = max(c[2] for cands in candidates.values() for c in cands)
+        result = min_cost_assignment(
+            {ride_id: [(d, cost) for d, _, cost in cands] for ride_id, cands in candidates.items()},
+            unmatched_cost=2 * max_cost + 1
+        )
+        
+        for ride in tier:
+            driver_id = result.get(ride.id)
+            if driver_id is None:
+                continue
+            dist = next(c[1] for c in candidates[ride.id] if c[0] == driver_id)
+            busy_driver_ids.add(driver_id)
+            if not create_match(db, ride, driver_id):
+                # Ride stays pending; next tick picks another driver
+                continue
+            print(f"   ✅ Ride {ride.id}: Batch match! Driver {driver_id} ({dist:.2f} km away)")
+            assigned.append((ride, driver_id, dist))
+    
+    return assigned
+
 
-# Background task to check for matches every 5 seconds
+async def run_tick(db):
+    """
+    One matching pass: claim pending rides, refresh the driver index and
+    create offers. Returns [(ride, driver_id, pickup_km)]; the caller commits.
+    """
+    # Claim pending rides (school_pool first); row locks are held
+    # until the caller commits so no other worker touches them
+    all_pending = claim_pending_rides(db)
+    
+    # Queue depth; count the table only when the claim hit the batch cap
+    if len(all_pending) < MATCHER_CLAIM_BATCH:
+        PENDING_RIDES.set(len(all_pending))
+    else:
+        PENDING_RIDES.set(db.query(RideRequest).filter(RideRequest.status == "pending").count())
+    
+    if not all_pending:
+        print("   ℹ️  No pending rides")
+        return []
+    
+    print(f"   📋 Processing {len(all_pending)} pending ride(s)...")
+    
+    # Bring the driver index up to date with driver moves since last tick
+    sync_driver_index(db)
+    
+    # Drivers who ALREADY have a pending/offered match
+    # (To prevent double-booking a driver who hasn't accepted yet)
+    active_matches = db.query(MatchedRide.driver_id).filter(
+        MatchedRide.status.in_(["pending_notification", "offered"])
+    ).all()
+    busy_driver_ids = {m[0] for m in active_matches}
+    
+    if MATCHER_ASSIGNMENT_MODE == "batch":
+        assigned = await assign_batch(db, all_pending, busy_driver_ids)
+    else:
+        assigned = await assign_greedy(db, all_pending, busy_driver_ids)
+    
+    if assigned:
+        # Outbox rows become visible to the notifier on commit
+        wake_workers(db)
+        total_km = sum(dist for _, _, dist in assigned)
+        now = datetime.utcnow()
+        MATCHES_CREATED.labels(MATCHER_ASSIGNMENT_MODE).inc(len(assigned))
+        for ride, _, _ in assigned:
+            if ride.created_at:
+                TIME_TO_MATCH_SECONDS.observe((now - ride.created_at).total_seconds())
+        total_wait = sum((now - ride.created_at).total_seconds() for ride, _, _ in assigned if ride.created_at)
+        summary = (f"   📏 [{MATCHER_ASSIGNMENT_MODE}] {len(assigned)} match(es), "
+                   f"pickup total {total_km:.2f} km, avg {total_km / len(assigned):.2f} km, "
+                   f"avg time-to-match {total_wait / len(assigned):.1f}s")
+        logger.info(summary)
+        print(summary)
+    
+    return assigned
+
+
+async def match_pending(reason: str):
+    """Run and commit one tick in its own session; returns [(ride_id, driver_id, pickup_km)]"""
+    logger.info(f"🔍 Auto-checking for pending rides ({reason})...")
+    print(f"🔍 Auto-checking for pending rides ({reason})...")
+    
+    db = SessionLocal()
+    try:
+        with MATCHER_TICK_SECONDS.labels(MATCHER_ASSIGNMENT_MODE).time():
+            assigned = [(ride.id, driver_id, km) for ride, driver_id, km in await run_tick(db)]
+            
+            # Publish matches and release the ride locks
+            db.commit()
+        return assigned
+    finally:
+        db.close()
+
+
+# Background task to check for matches on every event (or sweep timeout)
 async def matcher_loop():
-    """Background task that wakes every 5s and matches rides"""
+    """Background task that wakes on ride/driver events and matches rides"""
+    # Without LISTEN/NOTIFY the sweep is the only trigger, so keep it short
+    sweep = MATCHER_SWEEP_SECONDS if matcher_events.enabled else 5
     while True:
         try:
-            await asyncio.sleep(5)
-            logger.info("🔍 Auto-checking for pending rides...")
-            print("🔍 Auto-checking for pending rides...")
-            
-            # Get database session
-            db = SessionLocal()
-            try:
-                # Find pending rides - PRIORITIZE school_pool
-                # Fetch ALL pending rides to prevent blocking
-                school_rides = db.query(RideRequest).filter(
-                    RideRequest.status == "pending",
-                    RideRequest.ride_type == "school_pool"
-                ).all()
-                
-                normal_rides = db.query(RideRequest).filter(
-                    RideRequest.status == "pending",
-                    RideRequest.ride_type != "school_pool" # Avoid duplicates if we just did != school_pool
-                ).all()
-                
-                # Logic to avoid picking up school pool twice if simple query used
-                # Actually, simplest is fetch all pending and sort/filter in python or just concat
-                # But filter(...) is safer.
-                # Let's just fetch ALL pending and sort.
-                
-                all_pending = db.query(RideRequest).filter(RideRequest.status == "pending").all()
-                
-                if not all_pending:
-                    print("   ℹ️  No pending rides")
-                    continue
-                
-                # Sort: School pool first, then by ID (FIFO)
-                all_pending.sort(key=lambda r: (r.ride_type != "school_pool", r.id))
-                
-                print(f"   📋 Processing {len(all_pending)} pending ride(s)...")
-                
-                for ride in all_pending:
-                    logger.info(f"   📍 Processing pending ride {ride.id} from user {ride.user_id}")
-                    # print(f"   📍 Processing pending ride {ride.id} from user {ride.user_id}")
-                    
-                    # 1. Get Available Drivers (Fresh Query)
-                    available_drivers = db.query(DriverInfo).filter(
-                        DriverInfo.available == True
-                    ).all()
-                    
-                    # 2. Filter out drivers who ALREADY have a pending/offered match
-                    # (To prevent double-booking a driver who hasn't accepted yet)
-                    active_matches = db.query(MatchedRide.driver_id).filter(
-                        MatchedRide.status.in_(["pending_notification", "offered"])
-                    ).all()
-                    busy_driver_ids = {m[0] for m in active_matches}
-                    
-                    available_drivers = [d for d in available_drivers if d.driver_id not in busy_driver_ids]
-                    
-                    if not available_drivers:
-                        logger.info("   ℹ️  No available (free) drivers in database")
-                        # print("   ℹ️  No available (free) drivers in database")
-                        continue
-
-                    # NEW: Filter for Safe Drivers if School Priority
-                    if ride.ride_type == "school_priority":
-                        available_drivers = [d for d in available_drivers if d.is_verified_safe]
-                        if not available_drivers:
-                            print("   ⚠️  No SAFE drivers available for school ride")
-                            continue
-                    
-                    # Get declined drivers for THIS ride
-                    declined_matches = db.query(MatchedRide).filter(
-                        MatchedRide.ride_id == ride.id,
-                        MatchedRide.status == "declined"
-                    ).all()
-                    declined_driver_ids = {m.driver_id for m in declined_matches}
-                    
-                    # Filter out declined drivers
-                    candidates = [d for d in available_drivers if d.driver_id not in declined_driver_ids]
-                    
-                    if not candidates:
-                        # Log only if this is the only ride, otherwise it's spammy
-                        if len(all_pending) == 1:
-                            print(f"   ℹ️  All available drivers have declined ride {ride.id}")
-                        continue
-
-                    print(f"   👥 Ride {ride.id}: Found {len(candidates)} candidate(s) (excluding {len(declined_driver_ids)} declined)")
-                    
-                    # Calculate distances and sort
-                    driver_distances = []
-                    for driver in candidates:
-                        dist = calculate_distance(ride.source_location, driver.current_location)
-                        driver_distances.append((driver, dist))
-                    
-                    driver_distances.sort(key=lambda x: x[1])
-                    
-                    # Check drivers in order of proximity
-                    online_driver = None
-                    for driver, dist in driver_distances:
-                        # print(f"   🔌 Checking driver {driver.driver_id} ({dist:.2f} km away)...")
-                        if is_driver_online(driver.driver_id, db=db):
-                            online_driver = driver
-                            print(f"   ✅ Ride {ride.id}: Match found! Driver {driver.driver_id} ({dist:.2f} km away)")
-                            break
-                        else:
-                            # Driver not found via port check OR heartbeat is stale
-                            # print(f"   ❌ Driver {driver.driver_id} is OFFLINE")
-                            continue
-                    
-                    if not online_driver:
-                        # print(f"   ℹ️  Ride {ride.id}: No ONLINE drivers found among candidates")
-                        continue
-                    
-                    # Found a match!
-                    # Update status
-                    ride.status = "broadcasting"
-                    
-                    # Create match
-                    new_match = MatchedRide(
-                        user_id=ride.user_id,
-                        driver_id=online_driver.driver_id,
-                        ride_id=ride.id,
-                        status="pending_notification",
-                        created_at=datetime.utcnow()
-                    )
-                    db.add(new_match)
-                    db.commit()
-                    db.refresh(new_match)
-                    
-                    print(f"   🚀 Match Created: Ride {ride.id} -> Driver {online_driver.driver_id} (ID: {new_match.id})")
-                    
-                    # Since we matched this ride, we should probably stop processing this ride
-                    # And maybe move to next? Yes.
-                    
-            finally:
-                db.close()
+            woken = await matcher_events.wait(sweep)
+            await match_pending("event" if woken else "sweep")
                 
         except Exception as e:
             logger.error(f"   ⚠️  Matcher loop error: {e}")
@@ -261,10 +486,13 @@ async def matcher_loop():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    get_router()  # Load the road graph (if configured) before the first tick
     task = asyncio.create_task(matcher_loop())
-    print("🔄 Matcher loop started (checking every 5 seconds).")
+    print(f"🔄 Matcher loop started (event-driven, sweep every {MATCHER_SWEEP_SECONDS:g}s).")
     yield
     task.cancel()
+    matcher_events.close()
+    await liveness.aclose()
     print("🛑 Matcher loop stopped.")
 
 
@@ -281,7 +509,13 @@ def get_db():
 
 @app.get("/")
 def health():
-    return {"message": "Matcher running on port 8001"}
+    return {"message": f"Matcher running on port {MATCHER_PORT}"}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint"""
+    return metrics_response()
 
 
 @app.get("/matches/pending")
@@ -303,18 +537,19 @@ def get_pending_matches(db: Session = Depends(get_db)):
 
 
 @app.get("/drivers/online")
-def check_online_drivers(db: Session = Depends(get_db)):
+async def check_online_drivers(db: Session = Depends(get_db)):
     """Debug endpoint: Check which drivers are actually online"""
     all_drivers = db.query(DriverInfo).all()
+    online_by_id = await liveness.check_many(all_drivers)
     results = []
     
     for driver in all_drivers:
-        online = is_driver_online(driver.driver_id, db=db)
+        online = online_by_id[driver.driver_id]
         results.append({
             "driver_id": driver.driver_id,
             "db_available": driver.available,
             "actually_online": online,
-            "port": driver.driver_id,
+            "port": driver_port(driver),
             "type": "web" if driver.available and not online else "python_client"
         })
     
@@ -326,8 +561,9 @@ if __name__ == "__main__":
     print("\n" + "="*60)
     print("🎯 Mini Uber Matcher Service")
     print("="*60)
-    print("   Port: 8001")
-    print("   Checking for matches every 5 seconds")
+    print(f"   Port: {MATCHER_PORT}")
+    print(f"   Shard: {MATCHER_SHARD_INDEX + 1} of {MATCHER_SHARD_COUNT}")
+    print("   Matching on ride/driver events (LISTEN/NOTIFY)")
     print("   ✨ With online driver verification")
     print("="*60 + "\n")
-    uvicorn.run(app, host="0.0.0.0", port=8001, log_level="warning")
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=MATCHER_PORT, log_level="warning")
\ No newline at end of file
@@ -5,260 +5,304 @@ Key fixes:
 2. Safe datetime comparison with None checks
 3. Proper timezone conversion helper
 """
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, HTTPException
 from sqlalchemy.orm import Session
-import requests
 import asyncio
 import sys
 import os
+import time
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone  # FIX: Added timezone import
 
 sys.path.insert(0, os.path.dirname(__file__))
+# Picks this service's database pool settings (e.g. NOTIFIER_DB_POOL_SIZE)
+os.environ.setdefault("VELO_SERVICE", "notifier")
 
-from database.connections import SessionLocal, engine
-from database.models import Base, RideRequest, DriverInfo, MatchedRide
+from database.connections import SessionLocal, engine, listen_engine
+from database.models import Base, RideRequest, DriverInfo, MatchedRide, NotificationOutbox
+from services.events import EventListener, notify_matcher
+from services.offers import (
+    OFFERS_CHANNEL, OPEN_OFFER_STATUSES, announce_closed, announce_offered, expire_offers, requeue_if_no_offers
+)
+from services.offer_expiry import OfferExpiryScheduler
+from services.ride_status import notify_rider
+from services.notifications import NotificationClient, build_payload
+from services.endpoints import EndpointRegistry, ENDPOINTS_CHANNEL, register_endpoint
+from services.outbox import (
+    OUTBOX_CHANNEL, claim_due, mark_delivered, mark_skipped, mark_dead, schedule_retry
+)
+from services.metrics import (
+    NOTIFIER_TICK_SECONDS, PENDING_NOTIFICATIONS, TIME_TO_NOTIFY_SECONDS, OFFER_TIMEOUTS,
+    OFFER_EXPIRY_LAG_SECONDS, OUTBOX_DELIVERIES, metrics_response
+)
 
 Base.metadata.create_all(bind=engine)
 
 # Timeout for offering a ride to a driver (60 seconds)
 OFFER_TIMEOUT_SECONDS = 60
+# Matches delivered at once; each delivery notifies rider and driver in parallel
+NOTIFIER_CONCURRENCY = int(os.getenv("NOTIFIER_CONCURRENCY", "50"))
+# Outbox rows claimed per pass
+NOTIFIER_BATCH = int(os.getenv("NOTIFIER_BATCH", "100"))
+# Poll interval for due retries (new rows also wake the loop via NOTIFY)
+NOTIFIER_POLL_SECONDS = float(os.getenv("NOTIFIER_POLL_SECONDS", "1"))
 
-async def cleanup_stale_matches():
+notifications = NotificationClient(max_concurrency=NOTIFIER_CONCURRENCY)
+endpoints = EndpointRegistry()
+outbox_events = EventListener(listen_engine, OUTBOX_CHANNEL, ENDPOINTS_CHANNEL, OFFERS_CHANNEL)
+outbox_events.add_handler(ENDPOINTS_CHANNEL, endpoints.on_change)
+
+def expire_offers_now(match_ids):
+    """
+    Timer callback: decline offers whose timer fired and re-queue their rides.
+    One UPDATE ... RETURNING, so offers answered meanwhile are left alone.
+    """
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        expired = expire_offers(db, match_ids=match_ids)
+        now = datetime.utcnow()
+        for _, _, _, _, created_at in expired:
+            if created_at:
+                OFFER_EXPIRY_LAG_SECONDS.observe(
+                    max(0.0, (now - created_at).total_seconds() - OFFER_TIMEOUT_SECONDS)
+                )
+        requeue_expired(db, expired)
+        db.commit()
+    finally:
+        db.close()
+        NOTIFIER_TICK_SECONDS.labels("expiry").observe(time.perf_counter() - started)
+
+
+def requeue_expired(db, expired):
+    """Re-queue each ride once none of its broadcast offers are still open"""
+    if not expired:
+        return
+    # Clears driver mailboxes and withdraws the offer from gateway drivers' screens
+    announce_closed(db, *[(match_id, driver_id) for match_id, _, driver_id, _, _ in expired])
+    print(f"\n⏰ {len(expired)} offer(s) expired")
+    OFFER_TIMEOUTS.inc(len(expired))
+    for match_id, ride_id, driver_id, user_id, created_at in expired:
+        print(f"   💀 EXPIRED Match {match_id}: Driver {driver_id} (created {created_at})")
+    for user_id in {user_id for _, _, _, user_id, _ in expired}:
+        notify_rider(db, user_id)
+    # Rides are locked in id order, so two expiry batches can't deadlock
+    for ride_id in sorted({ride_id for _, ride_id, _, _, _ in expired if ride_id}):
+        if requeue_if_no_offers(db, ride_id):
+            notify_matcher(db, "ride_requeued", ride_id=ride_id)
+            print(f"   🔄 Ride {ride_id} re-queued (offers timed out)")
+
+
+offer_expiry = OfferExpiryScheduler(OFFER_TIMEOUT_SECONDS, expire_offers_now)
+outbox_events.add_handler(OFFERS_CHANNEL, offer_expiry.on_closed)
+
+
+def recover_offer_timers():
     """
-    Background task:
-    1. Checks for matches that have timed out (driver didn't accept in 10s).
-    2. Marks them as 'declined' so Matcher picks the next driver.
+    Startup safety net: offers that expired while no notifier was running
+    are declined in one statement, the rest get their timers re-armed.
     """
-    await asyncio.sleep(5)
-    print("⏰ Timeout manager started (checking every 2s)")
+    db = SessionLocal()
+    try:
+        cutoff_time = datetime.utcnow() - timedelta(seconds=OFFER_TIMEOUT_SECONDS)
+        requeue_expired(db, expire_offers(db, created_before=cutoff_time))
+        db.commit()
+        open_matches = db.query(MatchedRide.id, MatchedRide.created_at).filter(
+            MatchedRide.status.in_(OPEN_OFFER_STATUSES)
+        ).all()
+        for match_id, created_at in open_matches:
+            offer_expiry.arm(match_id, created_at)
+        print(f"⏰ Offer expiry armed for {len(open_matches)} open offer(s)")
+    finally:
+        db.close()
+
+
+def load_payload(db, match, client_endpoints: dict):
+    """Delivery payload for a match, or None if its ride or driver is gone"""
+    ride = None
+    if match.ride_id:
+        ride = db.query(RideRequest).filter(
+            RideRequest.id == match.ride_id
+        ).first()
     
-    while True:
-        try:
-            await asyncio.sleep(2)
-            
-            db = SessionLocal()
-            try:
-                # FIX: Use naive UTC to match DB default (avoid timezone confusion)
-                now = datetime.utcnow()
-                cutoff_time = now - timedelta(seconds=OFFER_TIMEOUT_SECONDS)
-                
-                # Find expired offers (pending_notification OR offered)
-                expired_matches = db.query(MatchedRide).filter(
-                    MatchedRide.status.in_(["pending_notification", "offered"]),
-                    MatchedRide.created_at < cutoff_time
-                ).all()
-                
-                if expired_matches:
-                    print(f"\n⏰ Found {len(expired_matches)} expired offer(s)...")
-                    print(f"   Current Time (UTC): {now}")
-                    print(f"   Cutoff Time (UTC):  {cutoff_time}")
-                    
-                    for match in expired_matches:
-                        print(f"   💀 EXPIRED Match {match.id}: Created at {match.created_at}")
-                        
-                        # Mark as DECLINED so matcher skips this driver next time
-                        match.status = "declined"
-                        
-                        # Re-queue the ride so matcher finds it again
-                        if match.ride_id:
-                            ride = db.query(RideRequest).filter(
-                                RideRequest.id == match.ride_id
-                            ).first()
-                            if ride and ride.status in ["broadcasting", "matched"]:
-                                ride.status = "pending"
-                                print(f"   🔄 Ride {match.ride_id} re-queued (Driver {match.driver_id} timed out)")
-                        
-                        print(f"   🚫 Match expired: User {match.user_id} -> Driver {match.driver_id}")
-                    
-                    db.commit()
-                
-            finally:
-                db.close()
-                
-        except Exception as e:
-            print(f"⚠️ Timeout manager error: {e}")
+    if not ride:
+        ride = db.query(RideRequest).filter(
+            RideRequest.user_id == match.user_id
+        ).order_by(RideRequest.created_at.desc()).first()
+    
+    driver = db.query(DriverInfo).filter(
+        DriverInfo.driver_id == match.driver_id
+    ).first()
+    
+    if not ride or not driver:
+        return None
+    return build_payload(
+        match, ride, driver,
+        user_endpoint=client_endpoints.get(("user", match.user_id)),
+        driver_endpoint=client_endpoints.get(("driver", match.driver_id))
+    )
+
+
+def record_learned_endpoints(db, payload: dict, learned: dict):
+    """Store transports probed for unregistered clients so they're never probed again"""
+    for role, transport in learned.items():
+        client_id = payload["user_id"] if role == "user" else payload["driver_id"]
+        url = payload[f"{role}_endpoint"]["url"] if transport == "http" else None
+        register_endpoint(db, role, client_id, transport, url)
+        endpoints.remember(role, client_id, transport, url)
+
+
+def apply_delivery(db, payload: dict, result: dict) -> str:
+    """
+    Record one delivery outcome on the match. Updates only apply while the
+    match is still pending_notification, so an offer accepted or withdrawn
+    meanwhile is left alone. Returns "offered", "gone", "driver_failed"
+    or "retry".
+    """
+    still_pending = db.query(MatchedRide).filter(
+        MatchedRide.id == payload["match_id"],
+        MatchedRide.status == "pending_notification"
+    )
+    
+    if result["user"] and result["driver"]:
+        # Python clients were pushed, web clients poll; either way the
+        # match stays until the driver accepts it
+        if not still_pending.update({"status": "offered"}, synchronize_session=False):
+            return "gone"
+        announce_offered(db, payload)
+        match = db.query(MatchedRide).filter(MatchedRide.id == payload["match_id"]).first()
+        if match.created_at:
+            TIME_TO_NOTIFY_SECONDS.observe((datetime.utcnow() - match.created_at).total_seconds())
+        print(f"   ✅ Match {payload['match_id']} offered"
+              f"{' (web client will poll)' if result['web'] else ''}")
+        return "offered"
+    
+    if not result["driver"]:
+        # Driver failed - mark unavailable and re-queue ride
+        if not still_pending.delete(synchronize_session=False):
+            return "gone"
+        db.query(DriverInfo).filter(
+            DriverInfo.driver_id == payload["driver_id"]
+        ).update({"available": False}, synchronize_session=False)
+        notify_rider(db, payload["user_id"])
+        if requeue_if_no_offers(db, payload["ride_id"]):
+            notify_matcher(db, "ride_requeued", ride_id=payload["ride_id"])
+            print(f"   🔄 Ride {payload['ride_id']} re-queued for another driver")
+        return "driver_failed"
+    
+    # Rider client unreachable: the outbox retries with backoff
+    return "retry"
+
+
+async def deliver_due(semaphore) -> int:
+    """
+    Claim a batch of due outbox rows, deliver them concurrently and record
+    the outcomes. Returns the number of rows claimed.
+    """
+    async def deliver(payload):
+        async with semaphore:
+            return await notifications.deliver(payload)
+    
+    db = SessionLocal()
+    try:
+        entries = claim_due(db, NOTIFIER_BATCH)
+        if not entries:
+            PENDING_NOTIFICATIONS.set(0)
+            return 0
+        
+        matches = {
+            m.id: m for m in db.query(MatchedRide).filter(
+                MatchedRide.id.in_([e.match_id for e in entries])
+            )
+        }
+        # Where to reach every rider and driver in the batch (cached, one query per role at most)
+        client_endpoints = endpoints.lookup_many(
+            db,
+            [("user", m.user_id) for m in matches.values()] +
+            [("driver", m.driver_id) for m in matches.values()]
+        )
+        work = []
+        for entry in entries:
+            match = matches.get(entry.match_id)
+            if not match or match.status != "pending_notification":
+                mark_skipped(entry, "offer no longer open")
+                OUTBOX_DELIVERIES.labels("skipped").inc()
+                continue
+            payload = load_payload(db, match, client_endpoints)
+            if payload is None:
+                print(f"   ⚠️  Match {match.id}: Missing ride or driver info")
+                match.status = "failed"
+                mark_dead(entry, "missing ride or driver")
+                OUTBOX_DELIVERIES.labels("dead").inc()
+                continue
+            # The offer's clock starts when the matcher created it
+            offer_expiry.arm(match.id, match.created_at)
+            work.append((entry, payload))
+        
+        # Publish the leases; no transaction is held while waiting on clients
+        db.commit()
+        print(f"\n📝 Delivering {len(work)} match notification(s)")
+        
+        results = await asyncio.gather(*(deliver(payload) for _, payload in work))
+        
+        for (entry, payload), result in zip(work, results):
+            record_learned_endpoints(db, payload, result["learned"])
+            outcome = apply_delivery(db, payload, result)
+            if outcome == "offered":
+                mark_delivered(entry)
+                OUTBOX_DELIVERIES.labels("delivered").inc()
+            elif outcome == "gone":
+                mark_skipped(entry, "offer no longer open")
+                OUTBOX_DELIVERIES.labels("skipped").inc()
+            elif outcome == "driver_failed":
+                offer_expiry.cancel(payload["match_id"])
+                mark_dead(entry, "driver client unreachable")
+                OUTBOX_DELIVERIES.labels("dead").inc()
+            elif schedule_retry(entry, "rider client unreachable"):
+                OUTBOX_DELIVERIES.labels("retry").inc()
+            else:
+                print(f"   ☠️  Match {payload['match_id']}: notification dead-lettered")
+                OUTBOX_DELIVERIES.labels("dead").inc()
+        
+        PENDING_NOTIFICATIONS.set(
+            db.query(NotificationOutbox).filter(NotificationOutbox.status == "pending").count()
+        )
+        db.commit()
+        return len(entries)
+    finally:
+        db.close()
+
 
 async def notifier_loop():
     """
-    Main notifier loop - checks for unnotified matches
-    FIX: Safe timezone handling for age calculations
+    Main notifier loop - drains the notification outbox. Wakes on new
+    outbox rows (LISTEN/NOTIFY) and polls the due-index for retries.
     """
     await asyncio.sleep(2)
-    print("🔍 Notifier starting checks...")
+    outbox_events.start()
+    recover_offer_timers()
+    print("🔍 Notifier draining outbox...")
+    semaphore = asyncio.Semaphore(NOTIFIER_CONCURRENCY)
+    claimed = 0
     
     while True:
         try:
-            await asyncio.sleep(3)
+            # A full batch means more is waiting: go again straight away
+            if claimed < NOTIFIER_BATCH:
+                await outbox_events.wait(NOTIFIER_POLL_SECONDS)
             
-            db = SessionLocal()
+            started = time.perf_counter()
             try:
-                unnotified_matches = db.query(MatchedRide).filter(
-                    MatchedRide.status == "pending_notification"
-                ).all()
-                
-                if unnotified_matches:
-                    recent_matches = []
-                    stale_count = 0
-                    
-                    for match in unnotified_matches:
-                        # FIX: Use simple naive comparison
-                        created = match.created_at
-                        if not created:
-                             recent_matches.append(match)
-                             continue
-                        
-                    if unnotified_matches:
-                        print(f" found {len(unnotified_matches)} pending matches")
-                else:
-                    # Print dot to show activity
-                    print(".", end="", flush=True)
-                
-                for match in unnotified_matches:
-                    print(f"\n📝 Processing match ID: {match.id}")
-                    print(f"   User ID: {match.user_id}")
-                    print(f"   Driver ID: {match.driver_id}")
-                    
-                    # Get ride and driver details
-                    ride = None
-                    if match.ride_id:
-                        ride = db.query(RideRequest).filter(
-                            RideRequest.id == match.ride_id
-                        ).first()
-                    
-                    if not ride:
-                        ride = db.query(RideRequest).filter(
-                            RideRequest.user_id == match.user_id
-                        ).order_by(RideRequest.created_at.desc()).first()
-                    
-                    driver = db.query(DriverInfo).filter(
-                        DriverInfo.driver_id == match.driver_id
-                    ).first()
-                    
-                    if not ride or not driver:
-                        print(f"   ⚠️  Missing ride or driver info")
-                        match.status = "failed"
-                        db.commit()
-                        continue
-                    
-                    user_port = match.user_id
-                    driver_port = match.driver_id
-                    
-                    # 1. Notify orchestrator
-                    try:
-                        requests.post(
-                            "http://localhost:8000/update_match/",
-                            json={"user_id": match.user_id, "driver_id": match.driver_id},
-                            timeout=2
-                        )
-                        print(f"   ✅ Orchestrator notified")
-                    except:
-                        pass
-                    
-                    # 2. Check if user is web or Python client
-                    user_notified = False
-                    is_web_user = False
-                    
-                    try:
-                        health = requests.get(f"http://localhost:{user_port}/status", timeout=0.5)
-                        if health.status_code == 200:
-                            # Python client exists
-                            resp = requests.post(
-                                f"http://localhost:{user_port}/ride/assigned",
-                                json={
-                                    "ride_id": ride.id,
-                                    "driver_id": match.driver_id,
-                                    "driver_name": f"Driver {match.driver_id}",
-                                    "driver_location": driver.current_location,
-                                    "pickup_location": ride.source_location,
-                                    "dropoff_location": ride.dest_location
-                                },
-                                timeout=2
-                            )
-                            if resp.status_code == 200:
-                                print(f"   ✅ User Python client notified")
-                                user_notified = True
-                    except:
-                        is_web_user = True
-                        print(f"   ℹ️  User is web client - will poll")
-                        user_notified = True
-                    
-                    # 3. Check if driver is web or Python client
-                    driver_notified = False
-                    is_web_driver = False
-                    
-                    # FIX: Try to get port from vehicle_details (JSON hack)
-                    driver_port = match.driver_id # Default
-                    try:
-                        import json
-                        if driver.vehicle_details and "{" in driver.vehicle_details:
-                            details = json.loads(driver.vehicle_details)
-                            if "port" in details:
-                                driver_port = details["port"]
-                                print(f"   🎯 Target Driver Port: {driver_port} (from DB)")
-                    except Exception:
-                        pass
-                    
-                    try:
-                        health = requests.get(f"http://localhost:{driver_port}/status", timeout=0.5)
-                        if health.status_code == 200:
-                            # Python client exists
-                            for attempt in range(3):
-                                try:
-                                    resp = requests.post(
-                                        f"http://localhost:{driver_port}/ride/assigned",
-                                        json={
-                                            "ride_id": ride.id,
-                                            "user_id": match.user_id,
-                                            "pickup_location": ride.source_location,
-                                            "dropoff_location": ride.dest_location
-                                        },
-                                        timeout=5
-                                    )
-                                    if resp.status_code == 200:
-                                        print(f"   ✅ Driver Python client notified")
-                                        driver_notified = True
-                                        break
-                                except:
-                                    if attempt == 2:
-                                        print(f"   ❌ Failed to notify driver after 3 attempts")
-                                    await asyncio.sleep(1)
-                        else:
-                            is_web_driver = True
-                    except:
-                        is_web_driver = True
-                        print(f"   ℹ️  Driver is web client (or connection failed) - will poll")
-                        driver_notified = True
-                    
-                    # 4. Handle notification results
-                    if user_notified and driver_notified:
-                        if is_web_user or is_web_driver:
-                            # Web clients: update status to 'offered' so they can poll it
-                            match.status = "offered"
-                            db.commit()
-                            print(f"   ✅ Match stored for web client polling (Status: offered)")
-                        else:
-                            # Both Python clients notified - delete match (legacy behavior? Or also keep as offered?)
-                            # If we delete, they can't accept it via ID?
-                            # Wait, 'accept_ride' requires the match to exist.
-                            # So we MUST NOT DELETE IT.
-                            
-                            match.status = "offered"
-                            db.commit()
-                            print(f"   ✅ Match set to 'offered' (waiting for accept)")
-                    
-                    elif not driver_notified:
-                         # Driver failed - mark unavailable and re-queue ride
-                        driver.available = False
-                        ride.status = "pending"
-                        db.delete(match)
-                        db.commit()
-                        print(f"   🔄 Ride re-queued for another driver")
-                    
+                claimed = await deliver_due(semaphore)
             finally:
-                db.close()
+                NOTIFIER_TICK_SECONDS.labels("notify").observe(time.perf_counter() - started)
+            
+            if not claimed:
+                # Print dot to show activity
+                print(".", end="", flush=True)
                 
         except Exception as e:
+            claimed = 0
             print(f"\n⚠️  Notifier loop error: {e}")
             import traceback
             traceback.print_exc()
@@ -267,12 +311,14 @@ async def notifier_loop():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     notifier_task = asyncio.create_task(notifier_loop())
-    cleanup_task = asyncio.create_task(cleanup_stale_matches())
-    print("🔄 Notifier loop started (every 3 seconds)")
-    print("🧹 Stale cleanup started (every 30 seconds)")
+    expiry_task = asyncio.create_task(offer_expiry.run())
+    print("🔄 Notifier loop started (outbox-driven)")
+    print(f"⏰ Offer expiry started ({OFFER_TIMEOUT_SECONDS}s timeout, timer wheel)")
     yield
     notifier_task.cancel()
-    cleanup_task.cancel()
+    expiry_task.cancel()
+    outbox_events.close()
+    await notifications.aclose()
 
 
 app = FastAPI(title="Notifier Server", lifespan=lifespan)
@@ -292,12 +338,15 @@ def get_db():
 @app.get("/stats")
 def get_stats(db: Session = Depends(get_db)):
     """Get notification statistics"""
-    pending = db.query(MatchedRide).filter(
-        MatchedRide.status == "pending_notification"
+    pending = db.query(NotificationOutbox).filter(
+        NotificationOutbox.status == "pending"
+    ).count()
+    dead = db.query(NotificationOutbox).filter(
+        NotificationOutbox.status == "dead"
     ).count()
     
-    # FIX: Use timezone-aware datetime
-    cutoff_time = datetime.now(timezone.utc) - timedelta(minutes=STALE_MATCH_THRESHOLD_MINUTES)
+    # Naive UTC like the created_at defaults; stale = past the offer timeout
+    cutoff_time = datetime.utcnow() - timedelta(seconds=OFFER_TIMEOUT_SECONDS)
     stale = db.query(MatchedRide).filter(
         MatchedRide.status == "pending_notification",
         MatchedRide.created_at < cutoff_time
@@ -305,10 +354,56 @@ def get_stats(db: Session = Depends(get_db)):
     
     return {
         "pending_notifications": pending,
-        "stale_matches": stale
+        "stale_matches": stale,
+        "dead_letters": dead
     }
 
 
+@app.get("/outbox/dead")
+def get_dead_letters(limit: int = 50, db: Session = Depends(get_db)):
+    """Most recent dead-lettered notifications"""
+    entries = db.query(NotificationOutbox).filter(
+        NotificationOutbox.status == "dead"
+    ).order_by(NotificationOutbox.id.desc()).limit(limit).all()
+    return {
+        "count": len(entries),
+        "entries": [
+            {
+                "id": e.id,
+                "match_id": e.match_id,
+                "ride_id": e.ride_id,
+                "attempts": e.attempts,
+                "last_error": e.last_error,
+                "created_at": e.created_at
+            }
+            for e in entries
+        ]
+    }
+
+
+@app.post("/outbox/{entry_id}/retry")
+def retry_dead_letter(entry_id: int, db: Session = Depends(get_db)):
+    """Put a dead-lettered notification back in the queue"""
+    rows = db.query(NotificationOutbox).filter(
+        NotificationOutbox.id == entry_id,
+        NotificationOutbox.status == "dead"
+    ).update({
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": datetime.utcnow()
+    }, synchronize_session=False)
+    if not rows:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    db.commit()
+    return {"status": "pending"}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint"""
+    return metrics_response()
+
+
 
 
 
@@ -0,0 +1,170 @@
+"""
+Single-process dispatch pipeline
+Runs ride intake, matching, notification and offer expiry as asyncio stages
+in one process, in place of the separate matcher and notifier services.
+Stages hand work to each other through bounded in-memory queues, so a slow
+stage makes the one before it wait instead of piling up work. The database
+stays the system of record: rides are still claimed with row locks and
+offers still go through the notification outbox, so nothing is lost on a
+restart and the two services can be run again instead at any time.
+
+    intake -> match -> notify -> expiry
+      ^                             |
+      +------ re-queued rides ------+
+"""
+from fastapi import FastAPI
+import asyncio
+import sys
+import os
+import time
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(__file__))
+# Picks this service's database pool settings (e.g. PIPELINE_DB_POOL_SIZE)
+os.environ.setdefault("VELO_SERVICE", "pipeline")
+
+import server_matcher as matcher
+import server_notifier as notifier
+from services.events import MATCHER_CHANNEL, subscribe_local
+from services.routing import get_router
+from services.metrics import NOTIFIER_TICK_SECONDS, PIPELINE_QUEUE_DEPTH, metrics_response
+
+PIPELINE_PORT = int(os.getenv("PIPELINE_PORT", "8001"))
+# Capacity of each queue between stages; a full queue makes the upstream stage wait
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "64"))
+
+# Reasons to run a matcher tick (new/re-queued ride, freed driver, sweep)
+intake_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+# Ride ids that just got offers waiting in the outbox
+offer_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+PIPELINE_QUEUE_DEPTH.labels("intake").set_function(intake_queue.qsize)
+PIPELINE_QUEUE_DEPTH.labels("offers").set_function(offer_queue.qsize)
+
+_loop = None
+
+
+def _put_intake(reason: str):
+    try:
+        intake_queue.put_nowait(reason)
+    except asyncio.QueueFull:
+        # A tick is already queued and will pick this ride up too
+        pass
+
+
+def wake_intake(payload: dict):
+    """Local MATCHER_CHANNEL handler: rides re-queued by this process (any thread)"""
+    if _loop is not None:
+        _loop.call_soon_threadsafe(_put_intake, payload.get("reason", "event"))
+
+
+if not matcher.matcher_events.enabled:
+    # No LISTEN/NOTIFY: expiry and failed deliveries re-queue rides in this
+    # process, so hand them to intake directly. With it, their NOTIFY wakes
+    # intake like any other matcher event, and only once.
+    subscribe_local(MATCHER_CHANNEL, wake_intake)
+
+
+def drain(queue: asyncio.Queue):
+    """Discard everything already queued; the pass about to run covers it"""
+    while not queue.empty():
+        queue.get_nowait()
+
+
+async def intake_stage():
+    """Rides and drivers from the API server (LISTEN/NOTIFY), plus the fallback sweep"""
+    sweep = matcher.MATCHER_SWEEP_SECONDS if matcher.matcher_events.enabled else 5
+    while True:
+        woken = await matcher.matcher_events.wait(sweep)
+        await intake_queue.put("event" if woken else "sweep")
+
+
+async def match_stage():
+    """One matcher tick per batch of wakeups; new offers go straight to the notify stage"""
+    while True:
+        reason = await intake_queue.get()
+        drain(intake_queue)
+        try:
+            assigned = await matcher.match_pending(reason)
+            if assigned:
+                # Waits while the notify stage is behind; rides stay pending in the DB meanwhile
+                await offer_queue.put([ride_id for ride_id, _, _ in assigned])
+        except Exception as e:
+            print(f"   ⚠️  Pipeline match error: {e}")
+
+
+async def notify_stage():
+    """Deliver outbox rows as soon as offers arrive; poll for due retries when idle"""
+    semaphore = asyncio.Semaphore(notifier.NOTIFIER_CONCURRENCY)
+    while True:
+        try:
+            await asyncio.wait_for(offer_queue.get(), notifier.NOTIFIER_POLL_SECONDS)
+            drain(offer_queue)
+        except asyncio.TimeoutError:
+            pass
+
+        try:
+            # A full batch means more is waiting: go again straight away
+            claimed = notifier.NOTIFIER_BATCH
+            while claimed >= notifier.NOTIFIER_BATCH:
+                started = time.perf_counter()
+                try:
+                    claimed = await notifier.deliver_due(semaphore)
+                finally:
+                    NOTIFIER_TICK_SECONDS.labels("notify").observe(time.perf_counter() - started)
+        except Exception as e:
+            print(f"\n⚠️  Pipeline notify error: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _loop
+    _loop = asyncio.get_running_loop()
+    get_router()  # Load the road graph (if configured) before the first tick
+    # Offer-closed and endpoint-change events still come from the API server
+    notifier.outbox_events.start()
+    notifier.recover_offer_timers()
+
+    stages = (intake_stage, match_stage, notify_stage, notifier.offer_expiry.run)
+    tasks = [asyncio.create_task(stage()) for stage in stages]
+    _put_intake("startup")
+    print(f"🔄 Dispatch pipeline started (queues of {PIPELINE_QUEUE_SIZE})")
+    yield
+    for task in tasks:
+        task.cancel()
+    matcher.matcher_events.close()
+    notifier.outbox_events.close()
+    await matcher.liveness.aclose()
+    await notifier.notifications.aclose()
+    print("🛑 Dispatch pipeline stopped.")
+
+
+app = FastAPI(title="Dispatch Pipeline", lifespan=lifespan)
+# The matcher's and notifier's debug endpoints, e.g. /notifier/stats
+app.mount("/matcher", matcher.app)
+app.mount("/notifier", notifier.app)
+
+
+@app.get("/")
+def health():
+    return {
+        "message": f"Dispatch pipeline running on port {PIPELINE_PORT}",
+        "queues": {"intake": intake_queue.qsize(), "offers": offer_queue.qsize()},
+        "open_offer_timers": len(notifier.offer_expiry)
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    return metrics_response()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    print("\n" + "="*60)
+    print("🚚 Mini Uber Dispatch Pipeline")
+    print("="*60)
+    print(f"   Port: {PIPELINE_PORT}")
+    print("   Intake -> match -> notify -> expiry in one process")
+    print("   Replaces server_matcher.py and server_notifier.py")
+    print("="*60 + "\n")
+    uvicorn.run(app, host="0.0.0.0", port=PIPELINE_PORT, log_level="warning")
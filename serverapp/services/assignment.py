@@ -0,0 +1,93 @@
+"""
+Min-cost ride-to-driver assignment
+Shortest augmenting path (Hungarian / Jonker-Volgenant) over a sparse
+candidate graph: each ride only has edges to its k nearest drivers, plus a
+private "stay pending" option so the problem is always feasible.
+"""
+import heapq
+
+
+def min_cost_assignment(candidates: dict, unmatched_cost: float) -> dict:
+    """
+    candidates: {ride_key: [(driver_key, cost), ...]}
+    unmatched_cost: cost of leaving a ride unassigned this round; should be
+        larger than any real edge so rides are only dropped when they must be.
+    Returns {ride_key: driver_key} for the rides that got a driver.
+    """
+    rides = list(candidates)
+
+    # Column ids: real drivers first, then one dummy "unmatched" column per ride
+    col_of = {}
+    edges = []
+    for ride in rides:
+        row_edges = {}
+        for driver, cost in candidates[ride]:
+            j = col_of.setdefault(driver, len(col_of))
+            if cost < row_edges.get(j, float('inf')):
+                row_edges[j] = cost
+        edges.append(list(row_edges.items()))
+    n_real = len(col_of)
+    for i in range(len(rides)):
+        edges[i].append((n_real + i, unmatched_cost))
+
+    n_cols = n_real + len(rides)
+    u = [0.0] * len(rides)          # row duals
+    v = [0.0] * n_cols              # column duals
+    col4row = [-1] * len(rides)
+    row4col = [-1] * n_cols
+
+    for cur_row in range(len(rides)):
+        shortest = {}
+        path = {}
+        done_cols = set()
+        done_rows = []
+        heap = []
+
+        i = cur_row
+        min_val = 0.0
+        sink = -1
+        while sink == -1:
+            done_rows.append(i)
+            for j, cost in edges[i]:
+                if j in done_cols:
+                    continue
+                r = min_val + cost - u[i] - v[j]
+                if r < shortest.get(j, float('inf')):
+                    shortest[j] = r
+                    path[j] = i
+                    heapq.heappush(heap, (r, row4col[j] != -1, j))
+
+            # Closest column not yet settled (prefer free ones on ties)
+            while True:
+                r, _, j = heapq.heappop(heap)
+                if j not in done_cols and r == shortest[j]:
+                    break
+            min_val = r
+            done_cols.add(j)
+            if row4col[j] == -1:
+                sink = j
+            else:
+                i = row4col[j]
+
+        # Update duals
+        u[cur_row] += min_val
+        for i in done_rows[1:]:
+            u[i] += min_val - shortest[col4row[i]]
+        for j in done_cols:
+            v[j] -= min_val - shortest[j]
+
+        # Augment along the alternating path back to cur_row
+        j = sink
+        while True:
+            i = path[j]
+            row4col[j] = i
+            col4row[i], j = j, col4row[i]
+            if i == cur_row:
+                break
+
+    drivers = list(col_of)
+    return {
+        rides[i]: drivers[j]
+        for i, j in enumerate(col4row)
+        if j < n_real
+    }
@@ -0,0 +1,248 @@
+"""
+Driver location history (breadcrumbs)
+Every location ping is kept as a (time, lat, lng) sample. Samples are
+encoded into an open segment per driver as they arrive, so memory holds
+about what the database will; the segment is sealed every few minutes
+and a flush task inserts sealed segments into breadcrumb_segments, one
+row per driver per segment.
+
+A segment stores its samples as integers (milliseconds, microdegrees),
+each one the zigzag varint of its difference to the previous sample. At
+1 Hz that is about five bytes per sample, so weeks of history stay small.
+
+Reads decode the segments overlapping a time range; simplify_track()
+thins a track with Douglas-Peucker for map replay.
+"""
+import asyncio
+import math
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert
+
+from database.models import BreadcrumbSegment
+from services.geo import EARTH_RADIUS_KM
+
+FORMAT_VERSION = 1
+# No segment spans more than this, so range queries can bound started_at
+MAX_SEGMENT_SECONDS = 3600
+# Retention deletes run at most this often
+PRUNE_INTERVAL_SECONDS = 3600
+
+
+def _append_deltas(out: bytearray, point, prev):
+    for value, last in zip(point, prev):
+        delta = value - last
+        z = delta << 1 if delta >= 0 else ((-delta) << 1) - 1
+        while z >= 0x80:
+            out.append((z & 0x7F) | 0x80)
+            z >>= 7
+        out.append(z)
+
+
+def encode_points(points) -> bytes:
+    """[(t_ms, lat_e6, lng_e6)] -> version byte + zigzag varint deltas"""
+    out = bytearray([FORMAT_VERSION])
+    prev = (0, 0, 0)
+    for point in points:
+        _append_deltas(out, point, prev)
+        prev = point
+    return bytes(out)
+
+
+def decode_points(data: bytes) -> list:
+    """Inverse of encode_points"""
+    if not data or data[0] != FORMAT_VERSION:
+        raise ValueError("Unknown breadcrumb segment format")
+    values = []
+    z = shift = 0
+    for byte in memoryview(data)[1:]:
+        z |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append((z >> 1) ^ -(z & 1))
+        z = shift = 0
+    points = []
+    t = lat = lng = 0
+    for i in range(0, len(values) - 2, 3):
+        t += values[i]
+        lat += values[i + 1]
+        lng += values[i + 2]
+        points.append((t, lat, lng))
+    return points
+
+
+def to_sample(t_ms: int, lat: float, lng: float):
+    return t_ms, round(lat * 1e6), round(lng * 1e6)
+
+
+def from_sample(sample):
+    """(t_ms, lat_e6, lng_e6) -> (t_ms, lat, lng)"""
+    return sample[0], sample[1] / 1e6, sample[2] / 1e6
+
+
+class Segment:
+    """One driver's samples, encoded as they arrive so memory stays at the stored size"""
+
+    __slots__ = ("driver_id", "data", "count", "started_ms", "last")
+
+    def __init__(self, driver_id: int):
+        self.driver_id = driver_id
+        self.data = bytearray([FORMAT_VERSION])
+        self.count = 0
+        self.started_ms = None
+        self.last = (0, 0, 0)
+
+    def add(self, sample):
+        if self.started_ms is None:
+            self.started_ms = sample[0]
+        _append_deltas(self.data, sample, self.last)
+        self.last = sample
+        self.count += 1
+
+    def samples(self) -> list:
+        return decode_points(self.data)
+
+
+class BreadcrumbRecorder:
+    """Open segment per driver in this process, plus sealed ones waiting to be written"""
+
+    def __init__(self, segment_seconds: float = 300, flush_seconds: float = 10, retention_days: float = 28):
+        self.segment_ms = int(min(segment_seconds, MAX_SEGMENT_SECONDS) * 1000)
+        self.flush_seconds = flush_seconds
+        self.retention_days = retention_days
+        # driver_id -> Segment still being recorded
+        self._open = {}
+        # [Segment] not written yet
+        self._sealed = []
+        self._flusher = None
+        self._write = None
+        self._pruned_at = None
+
+    def start(self, write):
+        """Start the flush task (idempotent); write(segments, prune_before) runs off the event loop"""
+        self._write = write
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    def append(self, driver_id: int, lat: float, lng: float):
+        sample = to_sample(int(time.time() * 1000), lat, lng)
+        segment = self._open.get(driver_id)
+        if segment is not None and sample[0] - segment.started_ms >= self.segment_ms:
+            self._sealed.append(segment)
+            segment = None
+        if segment is None:
+            segment = self._open[driver_id] = Segment(driver_id)
+        segment.add(sample)
+
+    def pending(self, driver_id: int) -> list:
+        """This process's unwritten samples for a driver, as (t_ms, lat, lng)"""
+        segments = [segment for segment in self._sealed if segment.driver_id == driver_id]
+        if driver_id in self._open:
+            segments.append(self._open[driver_id])
+        return [from_sample(s) for segment in segments for s in segment.samples()]
+
+    def take_sealed(self, everything: bool = False) -> list:
+        """Seal segments that are full (or all of them) and hand over everything sealed"""
+        now_ms = int(time.time() * 1000)
+        for driver_id, segment in list(self._open.items()):
+            if everything or now_ms - segment.started_ms >= self.segment_ms:
+                self._sealed.append(segment)
+                del self._open[driver_id]
+        sealed, self._sealed = self._sealed, []
+        return sealed
+
+    async def flush(self, everything: bool = False):
+        segments = self.take_sealed(everything)
+        prune_before = None
+        if self.retention_days and (
+            self._pruned_at is None or time.monotonic() - self._pruned_at > PRUNE_INTERVAL_SECONDS
+        ):
+            self._pruned_at = time.monotonic()
+            prune_before = datetime.utcnow() - timedelta(days=self.retention_days)
+        if (not segments and prune_before is None) or self._write is None:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, segments, prune_before)
+        except Exception as e:
+            print(f"⚠️ Breadcrumb flush error: {e}")
+            # Try again with the next flush
+            self._sealed[:0] = segments
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+
+def write_segments(db, segments, prune_before: datetime = None):
+    """Insert sealed Segments and drop history older than prune_before. The caller commits."""
+    if segments:
+        db.execute(insert(BreadcrumbSegment), [
+            {
+                "driver_id": segment.driver_id,
+                "started_at": datetime.utcfromtimestamp(segment.started_ms / 1000),
+                "ended_at": datetime.utcfromtimestamp(segment.last[0] / 1000),
+                "point_count": segment.count,
+                "points": bytes(segment.data),
+            }
+            for segment in segments
+        ])
+    if prune_before is not None:
+        db.execute(delete(BreadcrumbSegment).where(BreadcrumbSegment.ended_at < prune_before))
+
+
+def load_track(db, driver_id: int, start: datetime, end: datetime) -> list:
+    """A driver's stored samples between start and end (UTC) as [(t_ms, lat, lng)], oldest first"""
+    rows = db.query(BreadcrumbSegment.points).filter(
+        BreadcrumbSegment.driver_id == driver_id,
+        BreadcrumbSegment.started_at >= start - timedelta(seconds=MAX_SEGMENT_SECONDS),
+        BreadcrumbSegment.started_at <= end,
+        BreadcrumbSegment.ended_at >= start
+    ).all()
+    start_ms = (start - datetime(1970, 1, 1)).total_seconds() * 1000
+    end_ms = (end - datetime(1970, 1, 1)).total_seconds() * 1000
+    # Segments from several API workers can interleave, so sort the samples
+    return sorted(
+        from_sample(sample) for (data,) in rows for sample in decode_points(data)
+        if start_ms <= sample[0] <= end_ms
+    )
+
+
+def simplify_track(points, tolerance_m: float) -> list:
+    """
+    Douglas-Peucker: drop samples within tolerance_m of the line through
+    their neighbours that are kept. Works on [(t_ms, lat, lng)].
+    """
+    if len(points) < 3 or tolerance_m <= 0:
+        return list(points)
+    # Local flat projection in metres; fine at city scale
+    m_per_deg = math.pi * EARTH_RADIUS_KM * 1000 / 180
+    cos_lat = math.cos(math.radians(points[0][1]))
+    xy = [(lng * m_per_deg * cos_lat, lat * m_per_deg) for _, lat, lng in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = xy[first], xy[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        farthest, max_dist = None, tolerance_m
+        for i in range(first + 1, last):
+            x, y = xy[i]
+            if length == 0:
+                dist = math.hypot(x - x1, y - y1)
+            else:
+                # Distance to the segment, not the infinite line, so back-tracks survive
+                u = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / (length * length)))
+                dist = math.hypot(x - (x1 + u * dx), y - (y1 + u * dy))
+            if dist > max_dist:
+                farthest, max_dist = i, dist
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
@@ -0,0 +1,152 @@
+"""
+Driver gateway
+One persistent WebSocket per driver carries heartbeats, location pings,
+offers, accept/decline and acks, so drivers no longer need a port of their
+own or a poll loop. Connection state lives in memory; heartbeats go to
+the presence service and locations to the location buffer, like their
+HTTP counterparts, and both are written to the database in batches.
+
+The notifier reaches a gateway driver like any pushed client: the driver's
+endpoint is registered with transport "gateway" and a callback URL on the
+server process holding the socket, which relays the offer and answers once
+the driver acks it. That URL names one process: when a push lands on a
+worker that doesn't hold the socket, the notifier falls back to the offer
+announcement on the offers channel, and the worker that does hold it relays
+the offer from there.
+"""
+import asyncio
+import itertools
+import time
+
+
+class DriverConnection:
+    """In-memory state for one connected driver"""
+
+    def __init__(self, driver_id: int, websocket):
+        self.driver_id = driver_id
+        self.websocket = websocket
+        self.connected_at = time.monotonic()
+        # Offer delivery id -> future resolved by the driver's ack
+        self.pending_acks = {}
+        # Match ids offered over this connection and not yet closed
+        self.offers = set()
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message: dict):
+        async with self._send_lock:
+            await self.websocket.send_json(message)
+
+
+class DriverGateway:
+    """Connected drivers in this process, keyed by driver id"""
+
+    def __init__(self, locations, presence, ack_timeout: float = 3.0):
+        # LocationBuffer for location pings, PresenceService for heartbeats
+        self.locations = locations
+        self.presence = presence
+        self.ack_timeout = ack_timeout
+        self.connections = {}
+        self._loop = None
+        self._delivery_ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def is_connected(self, driver_id: int) -> bool:
+        return driver_id in self.connections
+
+    def start(self):
+        """Remember the event loop, for offer events arriving on other threads"""
+        self._loop = asyncio.get_running_loop()
+
+    async def connect(self, driver_id: int, websocket) -> DriverConnection:
+        """Register a new socket, replacing (and closing) any older one for the driver"""
+        old = self.connections.get(driver_id)
+        conn = DriverConnection(driver_id, websocket)
+        self.connections[driver_id] = conn
+        self.locations.mark_known((driver_id,))
+        self.presence.beat(driver_id)
+        if old is not None:
+            self._fail_pending(old)
+            try:
+                await old.websocket.close(code=4000)
+            except Exception:
+                pass
+        return conn
+
+    def disconnect(self, conn: DriverConnection) -> bool:
+        """Forget the connection; False if a newer one already replaced it"""
+        self._fail_pending(conn)
+        if self.connections.get(conn.driver_id) is not conn:
+            return False
+        del self.connections[conn.driver_id]
+        return True
+
+    def _fail_pending(self, conn: DriverConnection):
+        for future in conn.pending_acks.values():
+            if not future.done():
+                future.set_result(False)
+        conn.pending_acks.clear()
+
+    def mark_seen(self, conn: DriverConnection):
+        self.presence.beat(conn.driver_id)
+
+    def set_location(self, conn: DriverConnection, lat: float, lng: float):
+        self.locations.record(conn.driver_id, lat, lng)
+
+    async def deliver_offer(self, driver_id: int, offer: dict) -> bool:
+        """Send an offer and wait for the driver's ack; False if not connected or no ack"""
+        conn = self.connections.get(driver_id)
+        if conn is None:
+            return False
+        delivery_id = next(self._delivery_ids)
+        future = asyncio.get_running_loop().create_future()
+        conn.pending_acks[delivery_id] = future
+        try:
+            await conn.send({"type": "offer", "id": delivery_id, **offer})
+            acked = await asyncio.wait_for(future, self.ack_timeout)
+        except Exception:
+            acked = False
+        finally:
+            conn.pending_acks.pop(delivery_id, None)
+        if acked and offer.get("match_id") is not None:
+            conn.offers.add(offer["match_id"])
+        return acked
+
+    def handle_ack(self, conn: DriverConnection, delivery_id):
+        future = conn.pending_acks.get(delivery_id)
+        if future is not None and not future.done():
+            future.set_result(True)
+
+    def on_offer_event(self, payload: dict):
+        """
+        OFFERS_CHANNEL handler: relay announced offers to drivers connected
+        here, and tell drivers their offer was accepted, withdrawn or expired
+        """
+        if self._loop is None:
+            return
+        offer = payload.get("offered")
+        if offer is not None:
+            if offer.get("driver_id") in self.connections:
+                self._loop.call_soon_threadsafe(self._relay_offer, offer)
+            return
+        self._loop.call_soon_threadsafe(self._close_offers, set(payload.get("match_ids", ())))
+
+    def _relay_offer(self, offer: dict):
+        conn = self.connections.get(offer["driver_id"])
+        # Already pushed to this socket by the notifier and acked
+        if conn is not None and offer.get("match_id") not in conn.offers:
+            asyncio.create_task(self.deliver_offer(conn.driver_id, offer))
+
+    def _close_offers(self, match_ids: set):
+        for conn in list(self.connections.values()):
+            closed = conn.offers & match_ids
+            if closed:
+                conn.offers -= closed
+                asyncio.create_task(self._send_quietly(conn, {"type": "offer_closed", "match_ids": sorted(closed)}))
+
+    async def _send_quietly(self, conn: DriverConnection, message: dict):
+        try:
+            await conn.send(message)
+        except Exception:
+            pass
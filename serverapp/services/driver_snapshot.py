@@ -0,0 +1,127 @@
+"""
+Columnar snapshot of driver state
+Driver positions and flags live in flat NumPy arrays (one row per driver)
+so ranking drivers for a pickup is a single vectorized haversine pass plus
+argpartition, instead of a Python loop over ORM objects.
+Same interface as DriverGridIndex so the matcher can use either.
+"""
+import numpy as np
+
+from services.geo import EARTH_RADIUS_KM
+
+INITIAL_CAPACITY = 1024
+
+
+class DriverSnapshot:
+    """Struct-of-arrays view of every indexed driver"""
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        self._alloc(capacity)
+        # driver_id -> row
+        self._rows = {}
+        # Rows freed by remove(), reused before growing
+        self._free = []
+        self._size = 0
+        # vehicle_type -> small int code
+        self._type_codes = {}
+
+    def _alloc(self, capacity: int):
+        self.ids = np.zeros(capacity, dtype=np.int32)
+        self.lat = np.zeros(capacity, dtype=np.float64)
+        self.lng = np.zeros(capacity, dtype=np.float64)
+        self.available = np.zeros(capacity, dtype=bool)
+        self.safe = np.zeros(capacity, dtype=bool)
+        self.vehicle = np.zeros(capacity, dtype=np.int8)
+
+    def _grow(self):
+        old = (self.ids, self.lat, self.lng, self.available, self.safe, self.vehicle)
+        self._alloc(len(self.ids) * 2)
+        for new, prev in zip((self.ids, self.lat, self.lng, self.available, self.safe, self.vehicle), old):
+            new[:len(prev)] = prev
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._rows
+
+    def _type_code(self, vehicle_type: str) -> int:
+        return self._type_codes.setdefault(vehicle_type or "auto", len(self._type_codes))
+
+    def position(self, driver_id):
+        """Return (lat, lng) for an indexed driver, or None"""
+        row = self._rows.get(driver_id)
+        if row is None:
+            return None
+        return float(self.lat[row]), float(self.lng[row])
+
+    def upsert(self, driver_id: int, lat: float, lng: float,
+               vehicle_type: str = "auto", is_verified_safe: bool = False):
+        """Insert or update one driver's row in place"""
+        row = self._rows.get(driver_id)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                if self._size == len(self.ids):
+                    self._grow()
+                row = self._size
+                self._size += 1
+            self._rows[driver_id] = row
+            self.ids[row] = driver_id
+
+        self.lat[row] = lat
+        self.lng[row] = lng
+        self.available[row] = True
+        self.safe[row] = bool(is_verified_safe)
+        self.vehicle[row] = self._type_code(vehicle_type)
+
+    def remove(self, driver_id: int):
+        row = self._rows.pop(driver_id, None)
+        if row is not None:
+            self.available[row] = False
+            self._free.append(row)
+
+    def clear(self):
+        self._rows.clear()
+        self._free.clear()
+        self._size = 0
+        self.available[:] = False
+
+    def distances_km(self, lat: float, lng: float) -> np.ndarray:
+        """Haversine distance from (lat, lng) to every used row"""
+        n = self._size
+        lat1 = np.radians(lat)
+        lat2 = np.radians(self.lat[:n])
+        dlat = lat2 - lat1
+        dlng = np.radians(self.lng[:n] - lng)
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def nearest(self, lat: float, lng: float, k: int, radius_km: float,
+                vehicle_types=None, safe_only: bool = False, exclude=None):
+        """Return up to k (driver_id, distance_km) pairs sorted by distance"""
+        n = self._size
+        if k <= 0 or n == 0:
+            return []
+
+        mask = self.available[:n].copy()
+        if safe_only:
+            mask &= self.safe[:n]
+        if vehicle_types is not None:
+            codes = [self._type_codes[t] for t in vehicle_types if t in self._type_codes]
+            mask &= np.isin(self.vehicle[:n], codes)
+        if exclude:
+            mask &= ~np.isin(self.ids[:n], np.fromiter(exclude, dtype=np.int64, count=len(exclude)))
+
+        dist = self.distances_km(lat, lng)
+        mask &= dist <= radius_km
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            return []
+
+        if len(rows) > k:
+            top = np.argpartition(dist[rows], k - 1)[:k]
+            rows = rows[top]
+        rows = rows[np.argsort(dist[rows], kind="stable")]
+        return [(int(self.ids[r]), float(dist[r])) for r in rows]
@@ -0,0 +1,114 @@
+"""
+Client endpoint registry
+Riders and drivers say how to reach them when they register or log in:
+"web" clients poll the API, "http" clients (the Python apps) get pushed to
+their callback_url, and "gateway" drivers are pushed through the server
+process holding their driver gateway socket. The notifier reads the registry through a TTL cache, so
+routing a message costs no probe and usually no query; writers NOTIFY so
+cached entries are dropped as soon as an endpoint changes.
+"""
+import time
+from datetime import datetime
+
+from database.models import ClientEndpoint
+from services.events import notify
+
+TRANSPORT_WEB = "web"
+TRANSPORT_HTTP = "http"
+TRANSPORT_GATEWAY = "gateway"
+TRANSPORTS = (TRANSPORT_WEB, TRANSPORT_HTTP, TRANSPORT_GATEWAY)
+# What clients may declare themselves; gateway endpoints are set by the gateway
+CLIENT_TRANSPORTS = (TRANSPORT_WEB, TRANSPORT_HTTP)
+
+# Registry changes are broadcast here so readers can drop cached entries
+ENDPOINTS_CHANNEL = "velo_endpoints"
+
+
+def local_callback_url(port: int) -> str:
+    """Python clients run next to the backend and listen on a local port"""
+    return f"http://localhost:{port}"
+
+
+def register_endpoint(db, role: str, client_id: int, transport: str, callback_url: str = None):
+    """Create or replace a client's endpoint (caller commits)"""
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unknown transport '{transport}'")
+    if transport == TRANSPORT_WEB:
+        callback_url = None
+    elif not callback_url:
+        raise ValueError(f"{transport} clients need a callback_url")
+    
+    now = datetime.utcnow()
+    endpoint = db.query(ClientEndpoint).filter(
+        ClientEndpoint.role == role,
+        ClientEndpoint.client_id == client_id
+    ).first()
+    if endpoint:
+        changed = (endpoint.transport, endpoint.callback_url) != (transport, callback_url)
+        endpoint.transport = transport
+        endpoint.callback_url = callback_url
+        endpoint.last_seen_at = now
+    else:
+        changed = True
+        db.add(ClientEndpoint(
+            role=role, client_id=client_id, transport=transport,
+            callback_url=callback_url, last_seen_at=now
+        ))
+        # Sessions don't autoflush: make the row visible to a repeat call in this transaction
+        db.flush()
+    
+    if changed:
+        notify(db, ENDPOINTS_CHANNEL, role=role, client_id=client_id)
+    return endpoint
+
+
+class EndpointRegistry:
+    """Read-through cache of client endpoints keyed by (role, client_id)"""
+
+    def __init__(self, ttl_seconds: float = 60.0):
+        self.ttl_seconds = ttl_seconds
+        # (role, client_id) -> ({"transport", "url"} or None, expires_at)
+        self._cache = {}
+
+    def invalidate(self, role: str, client_id: int):
+        self._cache.pop((role, client_id), None)
+
+    def on_change(self, payload: dict):
+        """EventListener handler for ENDPOINTS_CHANNEL"""
+        if "role" in payload and "client_id" in payload:
+            self.invalidate(payload["role"], payload["client_id"])
+
+    def remember(self, role: str, client_id: int, transport: str, url: str = None):
+        self._cache[(role, client_id)] = (
+            {"transport": transport, "url": url}, time.monotonic() + self.ttl_seconds
+        )
+
+    def lookup_many(self, db, keys) -> dict:
+        """
+        Endpoints for many (role, client_id) pairs with at most one query
+        per role for cache misses. Unregistered clients map to None.
+        """
+        now = time.monotonic()
+        result, missing = {}, {}
+        for key in set(keys):
+            entry = self._cache.get(key)
+            if entry and entry[1] > now:
+                result[key] = entry[0]
+            else:
+                missing.setdefault(key[0], []).append(key[1])
+        
+        for role, client_ids in missing.items():
+            rows = db.query(
+                ClientEndpoint.client_id, ClientEndpoint.transport, ClientEndpoint.callback_url
+            ).filter(
+                ClientEndpoint.role == role,
+                ClientEndpoint.client_id.in_(client_ids)
+            ).all()
+            found = {client_id: (transport, url) for client_id, transport, url in rows}
+            for client_id in client_ids:
+                endpoint = None
+                if client_id in found:
+                    endpoint = {"transport": found[client_id][0], "url": found[client_id][1]}
+                self._cache[(role, client_id)] = (endpoint, now + self.ttl_seconds)
+                result[(role, client_id)] = endpoint
+        return result
@@ -0,0 +1,190 @@
+"""
+Cross-process wakeups over Postgres LISTEN/NOTIFY
+Writers queue a NOTIFY on their session and it is sent in the same
+transaction, just before commit, so it works the same from sync and async
+(AsyncSession) code; background loops wait on an EventListener instead of
+sleeping a fixed interval. On non-Postgres databases nothing is sent and
+wait() degrades to a plain timed sleep. Stages sharing one process (pipeline
+mode) can also subscribe locally and get the same payloads on commit,
+without a database round-trip.
+"""
+import asyncio
+import json
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+# Something the matcher should look at: new/re-queued ride or a freed driver
+MATCHER_CHANNEL = "velo_matcher"
+# Postgres rejects NOTIFY payloads of 8000 bytes or more; leave room for the other fields
+MAX_LIST_PAYLOAD_BYTES = 7000
+
+
+# channel -> [handler(payload)] for notifications raised in this process
+_local_handlers = {}
+
+
+def subscribe_local(channel: str, handler):
+    """Call handler(payload) after each commit in this process that notified channel"""
+    _local_handlers.setdefault(channel, []).append(handler)
+
+
+@event.listens_for(Session, "before_commit")
+def _send_notifies(session):
+    # Runs inside AsyncSession.commit() too, so the plain execute() is fine there
+    notifies = session.info.get("notifies")
+    if not notifies or session.get_bind().dialect.name != "postgresql":
+        return
+    for channel, payload in notifies:
+        session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": channel, "payload": json.dumps(payload)}
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_local(session):
+    for channel, payload in session.info.pop("notifies", ()):
+        for handler in _local_handlers.get(channel, ()):
+            try:
+                handler(payload)
+            except Exception as e:
+                print(f"⚠️ Local event handler error on {channel}: {e}")
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_notifies(session, previous_transaction):
+    # Every rollback() of the outer transaction, even one that never reached
+    # the database; a savepoint rolling back leaves the rest queued
+    if previous_transaction.parent is None:
+        session.info.pop("notifies", None)
+
+
+def notify(db, channel: str, **payload):
+    """Queue a notification on the session's transaction (sent on commit; db may be an AsyncSession)"""
+    session = getattr(db, "sync_session", db)
+    if not session.in_transaction():
+        # Begin as session.add() would, so a rollback before any SQL still drops it
+        session.begin()
+    session.info.setdefault("notifies", []).append((channel, payload))
+
+
+def notify_list(db, channel: str, key: str, items, **payload):
+    """notify() with payload[key] = items, split over as many notifications as the size limit needs"""
+    chunk, size = [], 0
+    for item in items:
+        item_size = len(json.dumps(item)) + 2
+        if chunk and size + item_size > MAX_LIST_PAYLOAD_BYTES:
+            notify(db, channel, **{key: chunk}, **payload)
+            chunk, size = [], 0
+        chunk.append(item)
+        size += item_size
+    if chunk:
+        notify(db, channel, **{key: chunk}, **payload)
+
+
+def notify_matcher(db, reason: str, **fields):
+    notify(db, MATCHER_CHANNEL, reason=reason, **fields)
+
+
+class EventListener:
+    """
+    Async LISTEN on one or more channels using a dedicated connection
+    registered with the event loop, so waiting never blocks it.
+    """
+
+    def __init__(self, engine, *channels):
+        self.engine = engine
+        self.channels = channels
+        self._conn = None
+        self._event = asyncio.Event()
+        self._handlers = {}
+        # Channels whose notifications only go to handlers, without waking wait()
+        self._quiet = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.engine.dialect.name == "postgresql"
+
+    @property
+    def listening(self) -> bool:
+        """True while notifications are actually being received"""
+        return self._conn is not None
+
+    def add_handler(self, channel: str, handler, wake: bool = True):
+        """Call handler(payload_dict) for every notification on channel; wake=False: don't wake wait() for it"""
+        self._handlers.setdefault(channel, []).append(handler)
+        if not wake:
+            self._quiet.add(channel)
+
+    def start(self):
+        if not self.enabled or self._conn is not None:
+            return
+        import psycopg2.extensions
+
+        raw = self.engine.raw_connection()
+        raw.detach()  # Keep this connection out of the pool for good
+        conn = raw.driver_connection
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            for channel in self.channels:
+                cur.execute(f"LISTEN {channel}")
+
+        self._conn = conn
+        asyncio.get_running_loop().add_reader(conn.fileno(), self._on_readable)
+
+    def close(self):
+        if self._conn is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._conn.fileno())
+        except Exception:
+            pass
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _on_readable(self):
+        try:
+            self._conn.poll()
+        except Exception as e:
+            print(f"⚠️ Event listener connection lost: {e}")
+            self.close()
+            # Wake waiters so they fall back to a sweep right away
+            self._event.set()
+            return
+
+        while self._conn.notifies:
+            note = self._conn.notifies.pop(0)
+            try:
+                payload = json.loads(note.payload) if note.payload else {}
+            except ValueError:
+                payload = {}
+            for handler in self._handlers.get(note.channel, ()):
+                try:
+                    handler(payload)
+                except Exception as e:
+                    print(f"⚠️ Event handler error on {note.channel}: {e}")
+            if note.channel not in self._quiet:
+                self._event.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Sleep until a notification arrives or timeout passes.
+        Returns True if woken by an event, False on timeout.
+        """
+        if self.enabled and self._conn is None:
+            try:
+                self.start()
+            except Exception as e:
+                print(f"⚠️ Could not LISTEN ({e}), using timed sweep")
+
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
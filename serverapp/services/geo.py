@@ -0,0 +1,21 @@
+"""
+Geo helpers shared by the matcher and the server
+Locations are stored as "lat,lng" strings, parsed by parse_location
+(kept with the models, which fill their lat/lng columns with it)
+"""
+import math
+
+from database.locations import parse_location
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in km between two points"""
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat/2) * math.sin(dlat/2) + \
+        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * \
+        math.sin(dlng/2) * math.sin(dlng/2)
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    return EARTH_RADIUS_KM * c
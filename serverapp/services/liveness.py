@@ -0,0 +1,149 @@
+"""
+Driver liveness checks
+Python driver clients are probed on their /status port with a pooled async
+HTTP client; web drivers (no port) fall back to their last heartbeat.
+Verdicts are cached per driver for a short TTL so a matcher tick never
+probes the same driver twice, and probes for a batch of candidates run
+concurrently instead of one 0.5 s timeout after another.
+"""
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import httpx
+
+from services.metrics import LIVENESS_PROBE_SECONDS
+
+# No heartbeat for this long means the driver is gone
+HEARTBEAT_CUTOFF_SECONDS = 30
+
+
+def driver_port(driver) -> int:
+    """Callback port stored in vehicle_details JSON, defaulting to the driver id"""
+    details = getattr(driver, "vehicle_details", None)
+    if details and "{" in details:
+        try:
+            port = json.loads(details).get("port")
+            if port:
+                return int(port)
+        except (ValueError, TypeError, AttributeError):
+            pass
+    return driver.driver_id
+
+
+def heartbeat_age(updated_at, now=None):
+    """Seconds since updated_at (naive UTC), or None if never seen"""
+    if not updated_at:
+        return None
+    if updated_at.tzinfo:
+        updated_at = updated_at.replace(tzinfo=None)
+    return ((now or datetime.utcnow()) - updated_at).total_seconds()
+
+
+class LivenessService:
+    """Cached, concurrent online checks for drivers"""
+
+    def __init__(self, ttl_seconds: float = 10.0, probe_timeout: float = 0.5,
+                 max_concurrency: int = 50):
+        self.ttl_seconds = ttl_seconds
+        self.probe_timeout = probe_timeout
+        self.max_concurrency = max_concurrency
+        # driver_id -> (online, expires_at on the monotonic clock)
+        self._cache = {}
+        # driver_id -> in-flight probe task, so concurrent callers share it
+        self._inflight = {}
+        self._client = None
+        self._semaphore = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.probe_timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def cached(self, driver_id: int):
+        """Cached verdict (True/False) or None if unknown/expired"""
+        entry = self._cache.get(driver_id)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def set(self, driver_id: int, online: bool):
+        self._cache[driver_id] = (online, time.monotonic() + self.ttl_seconds)
+
+    def invalidate(self, driver_id: int):
+        self._cache.pop(driver_id, None)
+
+    def record_heartbeat(self, driver_id: int):
+        """A fresh heartbeat overrides a cached 'offline' verdict"""
+        if self.cached(driver_id) is False:
+            self.invalidate(driver_id)
+
+    async def check(self, driver) -> bool:
+        """Online check for one driver row (driver_id, available, updated_at, vehicle_details)"""
+        verdict = self.cached(driver.driver_id)
+        if verdict is not None:
+            return verdict
+
+        task = self._inflight.get(driver.driver_id)
+        if task is None:
+            task = asyncio.ensure_future(self._probe(driver))
+            self._inflight[driver.driver_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(driver.driver_id, None))
+        online = await task
+        self.set(driver.driver_id, online)
+        return online
+
+    async def check_many(self, drivers) -> dict:
+        """Probe a batch of drivers concurrently -> {driver_id: online}"""
+        drivers = list(drivers)
+        results = await asyncio.gather(*(self.check(d) for d in drivers))
+        return {d.driver_id: online for d, online in zip(drivers, results)}
+
+    async def _probe(self, driver) -> bool:
+        started = time.perf_counter()
+        online = await self._probe_driver(driver)
+        LIVENESS_PROBE_SECONDS.labels("online" if online else "offline").observe(time.perf_counter() - started)
+        return online
+
+    async def _probe_driver(self, driver) -> bool:
+        if not driver.available:
+            return False
+
+        # Python clients answer on their port
+        client = self.client
+        try:
+            async with self._semaphore:
+                response = await client.get(f"http://localhost:{driver_port(driver)}/status")
+            if response.status_code == 200:
+                data = response.json()
+                # Something else on the port: not a driver client, so not live
+                if not isinstance(data, dict):
+                    return False
+                return data.get('driver_id') == f"DRIVER-{driver.driver_id}" and data.get('is_available', False)
+        except (httpx.HTTPError, ValueError):
+            # Port doesn't exist (web driver) - check heartbeat
+            pass
+
+        age = heartbeat_age(driver.updated_at)
+        if age is None:
+            # If updated_at is None (legacy), fallback to True but warn
+            print(f"   ⚠️  Driver {driver.driver_id} has no heartbeat info, assuming online (Legacy)")
+            return True
+        if age < HEARTBEAT_CUTOFF_SECONDS:
+            return True
+        print(f"   ❌ Driver {driver.driver_id} offline (Last heartbeat: {int(age)}s ago)")
+        return False
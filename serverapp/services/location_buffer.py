@@ -0,0 +1,146 @@
+"""
+Write-behind buffer for driver location pings
+Drivers report their position every second or so, over HTTP (one driver
+or a batch) or the gateway socket. Each ping only updates memory here:
+the latest position per driver, replacing any earlier one not yet
+written. A flush task writes everything that changed to driver_info in
+one multi-row UPDATE per flush interval, so the database sees one write
+per interval however many drivers are reporting.
+
+Moves shorter than min_move_meters are not written; the in-memory
+position is always the latest one reported. Every ping, however small the
+move, also counts as a presence heartbeat and goes to the breadcrumb trail.
+"""
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy import Float, Integer, String, bindparam, column, update, values
+
+from database.models import DriverInfo
+from services.geo import haversine_km
+from services.metrics import LOCATION_PINGS
+from services.ride_status import notify_drivers_moved
+
+
+class LocationBuffer:
+    """Latest reported position per driver, flushed to the database in batches"""
+
+    def __init__(self, flush_seconds: float = 0.5, min_move_meters: float = 10.0, trail=None, presence=None,
+                 known_ttl_seconds: float = 300.0):
+        self.flush_seconds = flush_seconds
+        self.min_move_meters = min_move_meters
+        self.known_ttl_seconds = known_ttl_seconds
+        # BreadcrumbRecorder for the location history / PresenceService, if any
+        self.trail = trail
+        self.presence = presence
+        # driver_id -> (lat, lng), the latest ping
+        self.positions = {}
+        # driver_id -> monotonic time it was last found to exist, so pings
+        # don't look it up again until known_ttl_seconds have passed
+        self._known = {}
+        # driver_id -> (lat, lng) last queued for writing, to measure moves against
+        self._written = {}
+        # Unflushed: driver_id -> (lat, lng)
+        self._moved = {}
+        self._flusher = None
+        self._write_batch = None
+        if presence is not None:
+            presence.add_offline_handler(self.forget)
+
+    def start(self, write_batch):
+        """Start the flush task (idempotent); write_batch(moved) runs off the event loop"""
+        self._write_batch = write_batch
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    def record(self, driver_id: int, lat: float, lng: float) -> bool:
+        """Location ping; False if it moved too little to be written"""
+        self.positions[driver_id] = (lat, lng)
+        if self.presence is not None:
+            self.presence.beat(driver_id)
+        if self.trail is not None:
+            self.trail.append(driver_id, lat, lng)
+        last = self._written.get(driver_id)
+        if last is not None and haversine_km(last[0], last[1], lat, lng) * 1000 < self.min_move_meters:
+            LOCATION_PINGS.labels("dropped").inc()
+            return False
+        LOCATION_PINGS.labels("coalesced" if driver_id in self._moved else "queued").inc()
+        self._written[driver_id] = (lat, lng)
+        self._moved[driver_id] = (lat, lng)
+        return True
+
+    def is_known(self, driver_id: int) -> bool:
+        checked = self._known.get(driver_id)
+        return checked is not None and time.monotonic() - checked < self.known_ttl_seconds
+
+    def mark_known(self, driver_ids):
+        now = time.monotonic()
+        for driver_id in driver_ids:
+            self._known[driver_id] = now
+
+    def latest(self, driver_id: int):
+        """Latest "lat,lng" reported to this process, or None"""
+        position = self.positions.get(driver_id)
+        return f"{position[0]},{position[1]}" if position else None
+
+    def forget(self, driver_id: int):
+        """Drop a driver that went offline or was deleted; a move not yet flushed is still written"""
+        self._known.pop(driver_id, None)
+        self.positions.pop(driver_id, None)
+        self._written.pop(driver_id, None)
+
+    def take_dirty(self) -> dict:
+        """-> {driver_id: (lat, lng)} moved since the last call"""
+        moved, self._moved = self._moved, {}
+        return moved
+
+    async def flush(self):
+        """Write whatever is buffered now (also used on shutdown)"""
+        moved = self.take_dirty()
+        if not moved or self._write_batch is None:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_batch, moved)
+        except Exception as e:
+            print(f"⚠️ Location flush error: {e}")
+            # Try again with the next flush; pings since then are newer
+            for driver_id, position in moved.items():
+                self._moved.setdefault(driver_id, position)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+
+def write_location_batch(db, moved: dict):
+    """
+    One UPDATE of current_location, its lat/lng columns and updated_at for
+    every moved driver. The caller commits.
+    """
+    now = datetime.utcnow()
+    drivers = DriverInfo.__table__
+    if db.get_bind().dialect.name == "postgresql":
+        # UPDATE ... FROM (VALUES ...): every row in one statement
+        rows = values(
+            column("driver_id", Integer), column("location", String),
+            column("lat", Float), column("lng", Float), name="moved"
+        ).data([(d, f"{lat},{lng}", lat, lng) for d, (lat, lng) in moved.items()])
+        db.execute(
+            update(drivers).where(drivers.c.driver_id == rows.c.driver_id).values(
+                current_location=rows.c.location, current_lat=rows.c.lat, current_lng=rows.c.lng,
+                updated_at=now
+            )
+        )
+    else:
+        # SQLite can't name VALUES columns: executemany instead
+        db.execute(
+            update(drivers).where(drivers.c.driver_id == bindparam("b_driver_id")).values(
+                current_location=bindparam("b_location"), current_lat=bindparam("b_lat"),
+                current_lng=bindparam("b_lng"), updated_at=now
+            ),
+            [{"b_driver_id": d, "b_location": f"{lat},{lng}", "b_lat": lat, "b_lng": lng}
+             for d, (lat, lng) in moved.items()]
+        )
+    notify_drivers_moved(db, moved)
@@ -0,0 +1,66 @@
+"""
+Prometheus metrics for the matcher, notifier and API services
+Each service runs in its own process and serves its own registry on
+GET /metrics; metrics a process never touches simply stay at zero.
+"""
+from fastapi import Response
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# Latency buckets (seconds) for loop ticks and rider-facing waits
+TICK_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+WAIT_BUCKETS = (0.5, 1, 2, 5, 10, 15, 30, 60, 120, 300, 600)
+
+# Matcher
+MATCHER_TICK_SECONDS = Histogram(
+    "velo_matcher_tick_seconds", "Duration of one matcher tick", ["mode"], buckets=TICK_BUCKETS
+)
+PENDING_RIDES = Gauge("velo_pending_rides", "Rides waiting for a driver at the start of a tick")
+CANDIDATES_PER_RIDE = Histogram(
+    "velo_matcher_candidates_per_ride", "Eligible drivers evaluated per ride",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100)
+)
+TIME_TO_MATCH_SECONDS = Histogram(
+    "velo_time_to_match_seconds", "Ride request to first driver offer", buckets=WAIT_BUCKETS
+)
+MATCHES_CREATED = Counter("velo_matches_created_total", "Driver offers created by the matcher", ["mode"])
+LIVENESS_PROBE_SECONDS = Histogram(
+    "velo_liveness_probe_seconds", "Driver liveness probe latency", ["result"], buckets=TICK_BUCKETS
+)
+
+# Notifier
+NOTIFIER_TICK_SECONDS = Histogram(
+    "velo_notifier_tick_seconds", "Duration of one notifier loop pass", ["loop"], buckets=TICK_BUCKETS
+)
+PENDING_NOTIFICATIONS = Gauge("velo_pending_notifications", "Outbox notifications waiting to be delivered")
+TIME_TO_NOTIFY_SECONDS = Histogram(
+    "velo_time_to_notify_seconds", "Match creation to offer delivered", buckets=WAIT_BUCKETS
+)
+OFFER_TIMEOUTS = Counter("velo_offer_timeouts_total", "Offers expired without an answer")
+OFFER_EXPIRY_LAG_SECONDS = Histogram(
+    "velo_offer_expiry_lag_seconds", "Offer deadline to offer expired", buckets=TICK_BUCKETS
+)
+OUTBOX_DELIVERIES = Counter(
+    "velo_outbox_deliveries_total", "Outbox delivery attempts by outcome (delivered/retry/skipped/dead)",
+    ["result"]
+)
+
+# Pipeline mode
+PIPELINE_QUEUE_DEPTH = Gauge("velo_pipeline_queue_depth", "Items waiting between pipeline stages", ["queue"])
+
+# API server
+OFFER_DECLINES = Counter("velo_offer_declines_total", "Offers declined by drivers")
+GATEWAY_CONNECTIONS = Gauge("velo_gateway_connections", "Drivers connected to this server's driver gateway")
+DRIVERS_PRESENT = Gauge("velo_drivers_present", "Drivers with a recent heartbeat to this server")
+OFFER_MAILBOX_LOOKUPS = Counter(
+    "velo_offer_mailbox_lookups_total", "Driver pending-ride polls, by whether the mailbox answered", ["result"]
+)
+LOCATION_PINGS = Counter(
+    "velo_location_pings_total",
+    "Driver location pings: queued for the next flush, replacing an unflushed one, or dropped as too small a move",
+    ["result"]
+)
+
+
+def metrics_response() -> Response:
+    """Current registry in the Prometheus text format"""
+    return Response(generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
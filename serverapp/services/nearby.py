@@ -0,0 +1,156 @@
+"""
+Nearest available drivers, answered by the database
+The query is ordered by an index, so it reads about k rows however many
+drivers there are:
+- PostGIS: `geog <-> point` on the GiST-indexed geography column that
+  update_schema.py adds when the extension is available.
+- Plain Postgres: `point(lng, lat) <-> point` on the GiST expression index.
+  This is planar distance in degrees, so extra rows are fetched (more at
+  high latitudes) and re-ranked by haversine.
+- Elsewhere (SQLite): a bounding box on the (lat, lng) index, ordered by
+  equirectangular distance.
+"""
+import math
+
+from sqlalchemy import cast, func, inspect, literal_column
+from sqlalchemy.types import UserDefinedType
+
+from database.models import DriverInfo
+from services.geo import EARTH_RADIUS_KM, haversine_km
+
+# Non-PostGIS queries fetch this many times k, then re-rank exactly
+OVERFETCH = 2
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# engine url -> whether driver_info has the PostGIS geog column
+_geography = {}
+
+
+class Geography(UserDefinedType):
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "geography(Point, 4326)"
+
+
+def has_geography(db) -> bool:
+    engine = db.get_bind().engine
+    key = str(engine.url)
+    if key not in _geography:
+        _geography[key] = engine.dialect.name == "postgresql" and any(
+            c["name"] == "geog" for c in inspect(engine).get_columns("driver_info")
+        )
+    return _geography[key]
+
+
+def nearest_available_drivers(db, lat: float, lng: float, k: int, radius_km: float = None,
+                              vehicle_types=None, safe_only: bool = False, exclude=None):
+    """Up to k available drivers as [(driver_id, distance_km, lat, lng)], nearest first"""
+    if k <= 0:
+        return []
+    query = db.query(
+        DriverInfo.driver_id, DriverInfo.current_lat, DriverInfo.current_lng
+    ).filter(
+        DriverInfo.available == True,
+        DriverInfo.current_lat.isnot(None),
+        DriverInfo.current_lng.isnot(None)
+    )
+    if safe_only:
+        query = query.filter(DriverInfo.is_verified_safe == True)
+    if vehicle_types is not None:
+        query = query.filter(DriverInfo.vehicle_type.in_(list(vehicle_types)))
+    if exclude:
+        query = query.filter(DriverInfo.driver_id.notin_(list(exclude)))
+
+    if has_geography(db):
+        geog = literal_column("driver_info.geog", Geography())
+        target = cast(func.ST_SetSRID(func.ST_MakePoint(lng, lat), 4326), Geography())
+        if radius_km is not None:
+            query = query.filter(func.ST_DWithin(geog, target, radius_km * 1000))
+        rows = query.add_columns(func.ST_Distance(geog, target) / 1000).order_by(
+            geog.op("<->")(target)
+        ).limit(k).all()
+        return [(driver_id, float(dist), d_lat, d_lng) for driver_id, d_lat, d_lng, dist in rows]
+
+    if radius_km is not None:
+        dlat = radius_km / KM_PER_DEGREE
+        dlng = dlat / max(math.cos(math.radians(lat)), 0.01)
+        query = query.filter(
+            DriverInfo.current_lat.between(lat - dlat, lat + dlat),
+            DriverInfo.current_lng.between(lng - dlng, lng + dlng)
+        )
+    if db.get_bind().dialect.name == "postgresql":
+        return _nearest_by_planar_distance(query, lat, lng, k, radius_km)
+
+    scale = math.cos(math.radians(lat)) ** 2
+    order = (DriverInfo.current_lat - lat) * (DriverInfo.current_lat - lat) + \
+        (DriverInfo.current_lng - lng) * (DriverInfo.current_lng - lng) * scale
+    return _rerank(query.order_by(order).limit(k * OVERFETCH).all(), lat, lng, k, radius_km)
+
+
+def _rerank(rows, lat, lng, k, radius_km):
+    ranked = sorted(
+        (haversine_km(lat, lng, d_lat, d_lng), driver_id, d_lat, d_lng)
+        for driver_id, d_lat, d_lng in rows
+    )
+    return [
+        (driver_id, dist, d_lat, d_lng) for dist, driver_id, d_lat, d_lng in ranked
+        if radius_km is None or dist <= radius_km
+    ][:k]
+
+
+def _nearest_by_planar_distance(query, lat, lng, k, radius_km):
+    """
+    KNN on the GiST point index, which orders by distance in raw degrees.
+    Away from the equator a degree of longitude is shorter than one of
+    latitude, so that order is not distance order: keep fetching until no
+    row left can be nearer than the kth found.
+    """
+    planar = func.point(DriverInfo.current_lng, DriverInfo.current_lat).op("<->")(func.point(lng, lat))
+    # A circle in degrees holds about 1/cos(lat) times the drivers of the true one
+    limit = math.ceil(k * OVERFETCH / max(math.cos(math.radians(lat)), 0.01))
+    while True:
+        rows = query.add_columns(planar).order_by(planar).limit(limit).all()
+        found = _rerank([row[:3] for row in rows], lat, lng, k, radius_km)
+        if len(rows) < limit:
+            return found
+        # Rows not fetched are at least this far in degrees, so at least
+        # cos(lat) times that in true distance (taking the farther latitude)
+        last = rows[-1][3]
+        cos_far = math.cos(math.radians(min(abs(lat) + last, 90.0)))
+        if len(found) == k and cos_far * last * KM_PER_DEGREE >= found[-1][1]:
+            return found
+        if len(found) < k and radius_km is not None and cos_far * last * KM_PER_DEGREE > radius_km:
+            return found
+        limit *= 4
+
+
+class DatabaseDriverIndex:
+    """
+    Matcher driver index (as DriverSnapshot/DriverGridIndex) that loads
+    nothing: each nearest() is a KNN query in the session given to bind().
+    """
+
+    def __init__(self):
+        self._db = None
+        # Positions of the drivers returned by the last queries, for ETA re-ranking
+        self._positions = {}
+
+    def bind(self, db):
+        """Use this session for the coming tick's queries"""
+        self._db = db
+        self._positions.clear()
+
+    def position(self, driver_id):
+        return self._positions.get(driver_id)
+
+    def clear(self):
+        self._positions.clear()
+
+    def nearest(self, lat: float, lng: float, k: int, radius_km: float,
+                vehicle_types=None, safe_only: bool = False, exclude=None):
+        """Return up to k (driver_id, distance_km) pairs sorted by distance"""
+        rows = nearest_available_drivers(self._db, lat, lng, k, radius_km, vehicle_types, safe_only, exclude)
+        for driver_id, _, d_lat, d_lng in rows:
+            self._positions[driver_id] = (d_lat, d_lng)
+        return [(driver_id, dist) for driver_id, dist, _, _ in rows]
@@ -0,0 +1,177 @@
+"""
+Match notifications to rider and driver clients
+Clients are routed by their registered endpoint: Python clients get pushed
+to their callback URL (gateway drivers via the server holding their
+socket), web clients poll instead. Clients that never
+registered are probed on their legacy port once and the result is reported
+back so it can be recorded. Every delivery shares one pooled async HTTP
+client, so a slow client only holds up its own match, and rider and driver
+are notified concurrently.
+"""
+import asyncio
+
+import httpx
+
+from services.liveness import driver_port
+from services.endpoints import TRANSPORT_WEB, TRANSPORT_HTTP, TRANSPORT_GATEWAY, local_callback_url
+
+# Per-target timeouts (seconds)
+PROBE_TIMEOUT = 0.5
+RIDER_TIMEOUT = 2
+DRIVER_TIMEOUT = 5
+# Driver pushes are retried with exponential backoff: 0.5 s, 1 s, ...
+DRIVER_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 0.5
+
+
+def _endpoint_or_legacy(endpoint, port: int) -> dict:
+    """Registered endpoint, or an unknown transport at the client's legacy port"""
+    if endpoint:
+        return endpoint
+    url = local_callback_url(port) if 0 < port < 65536 else None
+    return {"transport": None if url else TRANSPORT_WEB, "url": url}
+
+
+def build_payload(match, ride, driver, user_endpoint=None, driver_endpoint=None) -> dict:
+    """Everything a delivery needs, read up front so no DB session is held across awaits"""
+    return {
+        "match_id": match.id,
+        "ride_id": ride.id,
+        "user_id": match.user_id,
+        "driver_id": match.driver_id,
+        "user_endpoint": _endpoint_or_legacy(user_endpoint, match.user_id),
+        "driver_endpoint": _endpoint_or_legacy(driver_endpoint, driver_port(driver)),
+        "driver_location": driver.current_location,
+        "pickup_location": ride.source_location,
+        "dropoff_location": ride.dest_location,
+        "ride_type": ride.ride_type,
+        "fare": ride.fare,
+    }
+
+
+class NotificationClient:
+    """Concurrent match delivery over one keep-alive connection pool"""
+
+    def __init__(self, max_concurrency: int = 50):
+        self.max_concurrency = max_concurrency
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency * 2,
+                    max_keepalive_connections=self.max_concurrency * 2
+                )
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def deliver(self, payload: dict) -> dict:
+        """
+        Notify rider and driver for one match at once.
+        Returns {"user": notified, "driver": notified, "web": any web client,
+        "learned": {"user"/"driver": transport probed for unregistered clients}}.
+        """
+        learned = {}
+        (user_ok, web_user), (driver_ok, web_driver) = await asyncio.gather(
+            self._notify_rider(payload, learned),
+            self._notify_driver(payload, learned)
+        )
+        return {"user": user_ok, "driver": driver_ok, "web": web_user or web_driver, "learned": learned}
+
+    async def _has_client(self, url: str):
+        """True/False for a Python client's /status answer, None if nothing listens (web client)"""
+        try:
+            response = await self.client.get(f"{url}/status", timeout=PROBE_TIMEOUT)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return None
+
+    async def _transport(self, endpoint: dict, role: str, learned: dict):
+        """Registered transport, or probe an unregistered client (None: something answered but unhealthy)"""
+        if endpoint["transport"]:
+            return endpoint["transport"]
+        present = await self._has_client(endpoint["url"])
+        if present is None:
+            learned[role] = TRANSPORT_WEB
+            return TRANSPORT_WEB
+        if present:
+            learned[role] = TRANSPORT_HTTP
+            return TRANSPORT_HTTP
+        return None
+
+    async def _notify_rider(self, payload: dict, learned: dict):
+        """-> (notified, is_web)"""
+        endpoint = payload["user_endpoint"]
+        transport = await self._transport(endpoint, "user", learned)
+        if transport == TRANSPORT_WEB:
+            print(f"   ℹ️  User {payload['user_id']} is web client - will poll")
+            return True, True
+        if transport is None:
+            return False, False
+        try:
+            response = await self.client.post(
+                f"{endpoint['url']}/ride/assigned",
+                json={
+                    "ride_id": payload["ride_id"],
+                    "driver_id": payload["driver_id"],
+                    "driver_name": f"Driver {payload['driver_id']}",
+                    "driver_location": payload["driver_location"],
+                    "pickup_location": payload["pickup_location"],
+                    "dropoff_location": payload["dropoff_location"]
+                },
+                timeout=RIDER_TIMEOUT
+            )
+            if response.status_code == 200:
+                print(f"   ✅ User {payload['user_id']} Python client notified")
+                return True, False
+        except httpx.HTTPError:
+            pass
+        return False, False
+
+    async def _notify_driver(self, payload: dict, learned: dict):
+        """-> (notified, is_web)"""
+        endpoint = payload["driver_endpoint"]
+        transport = await self._transport(endpoint, "driver", learned)
+        if transport == TRANSPORT_WEB:
+            print(f"   ℹ️  Driver {payload['driver_id']} is web client - will poll")
+            return True, True
+        if transport is None:
+            # Something answers on the port but it isn't a healthy driver client
+            return False, True
+
+        for attempt in range(DRIVER_ATTEMPTS):
+            try:
+                response = await self.client.post(
+                    f"{endpoint['url']}/ride/assigned",
+                    json={
+                        "match_id": payload["match_id"],
+                        "ride_id": payload["ride_id"],
+                        "user_id": payload["user_id"],
+                        "pickup_location": payload["pickup_location"],
+                        "dropoff_location": payload["dropoff_location"],
+                        "ride_type": payload["ride_type"],
+                        "fare": payload["fare"]
+                    },
+                    timeout=DRIVER_TIMEOUT
+                )
+                if response.status_code == 200:
+                    print(f"   ✅ Driver {payload['driver_id']} notified ({transport})")
+                    return True, False
+                if response.status_code == 404 and transport == TRANSPORT_GATEWAY:
+                    # Not connected to that worker: the announced offer is relayed by the
+                    # worker holding the socket, or waits in the mailbox, like a web client's
+                    print(f"   ℹ️  Driver {payload['driver_id']} not on gateway {endpoint['url']} - offer goes to the mailbox")
+                    return True, True
+            except httpx.HTTPError:
+                pass
+            if attempt < DRIVER_ATTEMPTS - 1:
+                await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+        print(f"   ❌ Failed to notify driver {payload['driver_id']} after {DRIVER_ATTEMPTS} attempts")
+        return False, False
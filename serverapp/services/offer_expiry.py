@@ -0,0 +1,59 @@
+"""
+Offer expiry timers
+Each open offer gets a timer on a hierarchical timing wheel, armed when the
+notifier picks the offer up and cancelled when it is accepted, declined or
+withdrawn. Expired offers are handed to a callback in batches, so expiry
+fires within a wheel tick of the deadline without scanning matched_rides.
+"""
+import asyncio
+import time
+from datetime import datetime
+
+from services.timer_wheel import TimerWheel
+
+
+class OfferExpiryScheduler:
+    """Drives a TimerWheel from the event loop and calls on_expire(match_ids)"""
+
+    def __init__(self, timeout_seconds: float, on_expire, tick_seconds: float = 0.01):
+        self.timeout_seconds = timeout_seconds
+        self.on_expire = on_expire
+        self.wheel = TimerWheel(time.monotonic(), tick_seconds=tick_seconds)
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self.wheel)
+
+    def arm(self, match_id: int, created_at: datetime):
+        """Expire the offer timeout_seconds after created_at (naive UTC)"""
+        if match_id in self.wheel:
+            return
+        remaining = self.timeout_seconds - (datetime.utcnow() - created_at).total_seconds()
+        self.wheel.schedule(match_id, time.monotonic() + remaining)
+        self._wakeup.set()
+
+    def cancel(self, match_id: int):
+        self.wheel.cancel(match_id)
+
+    def on_closed(self, payload: dict):
+        """EventListener handler: offers accepted/declined/withdrawn elsewhere"""
+        for match_id in payload.get("match_ids", []):
+            self.cancel(match_id)
+
+    async def run(self):
+        while True:
+            wakeup = self.wheel.next_wakeup()
+            self._wakeup.clear()
+            timeout = None if wakeup is None else max(0.0, wakeup - time.monotonic())
+            try:
+                # A newly armed timer may be due sooner than the current plan
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            expired = self.wheel.advance(time.monotonic())
+            if expired:
+                try:
+                    self.on_expire(expired)
+                except Exception as e:
+                    print(f"⚠️ Offer expiry error: {e}")
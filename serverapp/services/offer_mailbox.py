@@ -0,0 +1,79 @@
+"""
+Per-driver offer mailbox
+Web drivers poll for their pending offer every few seconds, and almost
+always nothing is waiting. Each API server process keeps the answer per
+driver in memory: the notifier hands it the offer when it is delivered,
+and accept/decline/withdraw/expiry empty it again, all over the offers
+LISTEN/NOTIFY channel so every worker process stays in step. A poll only
+reads the database when the driver's mailbox is unknown or stale.
+
+Only used while the process is listening; without LISTEN/NOTIFY other
+services can't reach it, so every poll goes to the database as before.
+"""
+import threading
+import time
+
+
+class OfferMailbox:
+    """driver_id -> the offer waiting for them (None: known to be empty)"""
+
+    def __init__(self, is_live, ttl_seconds: float = 30.0):
+        # is_live() -> True while offer events are being received
+        self.is_live = is_live
+        # Re-read from the database this often anyway, in case an event was missed
+        self.ttl_seconds = ttl_seconds
+        self._boxes = {}
+        # Bumped by every event, so a database read that raced one isn't cached
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def version(self) -> int:
+        """Take before reading the database; pass to fill()"""
+        return self._version
+
+    def get(self, driver_id: int):
+        """-> (hit, offer); on a miss the caller reads the database and calls fill()"""
+        if not self.is_live():
+            if self._boxes:
+                # Events may have been missed while disconnected
+                self.clear()
+            return False, None
+        with self._lock:
+            box = self._boxes.get(driver_id)
+        if box is None or time.monotonic() - box[1] > self.ttl_seconds:
+            return False, None
+        return True, box[0]
+
+    def fill(self, driver_id: int, offer, version: int):
+        """Cache a database read; dropped if any offer event arrived since version"""
+        with self._lock:
+            if version == self._version and self.is_live():
+                self._put(driver_id, offer)
+
+    def clear(self):
+        with self._lock:
+            self._boxes.clear()
+            self._version += 1
+
+    def on_event(self, payload: dict):
+        """OFFERS_CHANNEL handler; safe to call from any thread"""
+        with self._lock:
+            self._version += 1
+            offered = payload.get("offered")
+            if offered:
+                self._put(offered["driver_id"], offered)
+            for match_id, driver_id in zip(payload.get("match_ids", ()), payload.get("driver_ids", ())):
+                box = self._boxes.get(driver_id)
+                if box is None or box[0] is None:
+                    continue
+                if box[0]["match_id"] == match_id:
+                    # A driver holds one open offer at a time (the matcher skips busy drivers)
+                    self._put(driver_id, None)
+                else:
+                    self._boxes.pop(driver_id)
+
+    def _put(self, driver_id: int, offer):
+        self._boxes[driver_id] = (offer, time.monotonic())
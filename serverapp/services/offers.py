@@ -0,0 +1,99 @@
+"""
+Offer bookkeeping shared by the server, matcher and notifier
+With broadcast matching a ride can have several open offers at once; the
+first driver to accept wins and the rest are withdrawn.
+"""
+from sqlalchemy import update
+
+from database.models import MatchedRide, RideRequest
+from services.events import notify
+from services.ride_status import notify_rider
+
+# Offers a driver can still accept
+OPEN_OFFER_STATUSES = ("pending_notification", "offered")
+
+# Offers delivered ("offered") and closed by accept/decline/withdraw/cancel/expiry,
+# for expiry timers, driver mailboxes and gateway connections
+OFFERS_CHANNEL = "velo_offers"
+
+# What a driver is shown about an offer waiting for them
+OFFER_FIELDS = ("match_id", "ride_id", "user_id", "driver_id",
+                "pickup_location", "dropoff_location", "ride_type", "fare")
+
+
+def announce_closed(db, *offers):
+    """Tell listeners these (match_id, driver_id) offers are no longer open (sent on commit)"""
+    if offers:
+        notify(db, OFFERS_CHANNEL,
+               match_ids=[match_id for match_id, _ in offers],
+               driver_ids=[driver_id for _, driver_id in offers])
+
+
+def announce_offered(db, offer: dict):
+    """Hand a just-delivered offer (OFFER_FIELDS) to driver mailboxes (sent on commit)"""
+    notify(db, OFFERS_CHANNEL, offered={field: offer[field] for field in OFFER_FIELDS})
+
+
+def open_offers(db, ride_id: int, exclude_match_id: int = None):
+    query = db.query(MatchedRide).filter(
+        MatchedRide.ride_id == ride_id,
+        MatchedRide.status.in_(OPEN_OFFER_STATUSES)
+    )
+    if exclude_match_id is not None:
+        query = query.filter(MatchedRide.id != exclude_match_id)
+    return query
+
+
+def withdraw_other_offers(db, ride_id: int, keep_match_id: int) -> list:
+    """Withdraw every other open offer for the ride; returns their driver ids"""
+    # Skip offers a concurrent decline/expiry holds: it is closing them anyway, and
+    # waiting would deadlock with its requeue_if_no_offers on the ride row we hold
+    losers = open_offers(db, ride_id, exclude_match_id=keep_match_id).with_for_update(skip_locked=True).all()
+    for match in losers:
+        match.status = "withdrawn"
+    announce_closed(db, *[(m.id, m.driver_id) for m in losers])
+    return [m.driver_id for m in losers]
+
+
+def expire_offers(db, match_ids=None, created_before=None) -> list:
+    """
+    Mark open offers as declined in one statement, either the given ids or
+    everything created before a cutoff. Returns (id, ride_id, driver_id,
+    user_id, created_at) for the offers that were actually still open.
+    """
+    stmt = update(MatchedRide).where(MatchedRide.status.in_(OPEN_OFFER_STATUSES))
+    if match_ids is not None:
+        stmt = stmt.where(MatchedRide.id.in_(list(match_ids)))
+    if created_before is not None:
+        stmt = stmt.where(MatchedRide.created_at < created_before)
+    stmt = stmt.values(status="declined").returning(
+        MatchedRide.id, MatchedRide.ride_id, MatchedRide.driver_id, MatchedRide.user_id,
+        MatchedRide.created_at
+    )
+    return db.execute(stmt, execution_options={"synchronize_session": False}).all()
+
+
+def requeue_if_no_offers(db, ride_id: int, exclude_match_id: int = None) -> bool:
+    """
+    Put the ride back to 'pending' once its last open offer is gone.
+    Returns True if the ride was re-queued.
+    """
+    if ride_id is None:
+        return False
+    # Lock the ride first: two last offers closed in concurrent transactions
+    # would otherwise each still see the other as open, and neither re-queue
+    status = db.query(RideRequest.status).filter(RideRequest.id == ride_id).with_for_update().scalar()
+    # Only rides still waiting on offers; an accepted ride is already 'matched'
+    if status != "broadcasting":
+        return False
+    if open_offers(db, ride_id, exclude_match_id=exclude_match_id).first():
+        return False
+    stmt = update(RideRequest).where(
+        RideRequest.id == ride_id,
+        RideRequest.status == "broadcasting"
+    ).values(status="pending").returning(RideRequest.user_id)
+    user_id = db.execute(stmt, execution_options={"synchronize_session": "fetch"}).scalar()
+    if user_id is None:
+        return False
+    notify_rider(db, user_id)
+    return True
@@ -0,0 +1,81 @@
+"""
+Transactional outbox for match notifications
+The matcher enqueues a row in the same transaction that creates the match.
+Notifier workers claim due rows with SKIP LOCKED and a short lease (so the
+HTTP calls happen outside any transaction), then record the outcome:
+delivered, skipped (offer no longer open), retried with exponential
+backoff, or dead-lettered after too many attempts.
+"""
+import os
+from datetime import datetime, timedelta
+
+from database.models import NotificationOutbox
+from services.events import notify
+
+# Notifier workers wake on this channel when new rows are committed
+OUTBOX_CHANNEL = "velo_outbox"
+
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "2"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "60"))
+# A claimed row is hidden from other workers this long; if the worker dies
+# mid-delivery the row becomes due again afterwards
+CLAIM_LEASE_SECONDS = 30
+
+
+def enqueue_match(db, match):
+    """Queue delivery of a new match (call inside the match's transaction)"""
+    db.add(NotificationOutbox(match_id=match.id, ride_id=match.ride_id))
+
+
+def wake_workers(db):
+    """Wake notifier workers once the current transaction commits"""
+    notify(db, OUTBOX_CHANNEL)
+
+
+def claim_due(db, limit: int) -> list:
+    """
+    Lock and lease up to limit due rows, oldest first. Rows held by another
+    worker are skipped. The caller commits to publish the lease.
+    """
+    now = datetime.utcnow()
+    entries = db.query(NotificationOutbox).filter(
+        NotificationOutbox.status == "pending",
+        NotificationOutbox.next_attempt_at <= now
+    ).order_by(NotificationOutbox.next_attempt_at).limit(limit).with_for_update(skip_locked=True).all()
+    
+    for entry in entries:
+        entry.attempts += 1
+        entry.next_attempt_at = now + timedelta(seconds=CLAIM_LEASE_SECONDS)
+    return entries
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before the next try after `attempts` failed ones: 2 s, 4 s, 8 s, ... capped"""
+    return min(OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX_SECONDS)
+
+
+def mark_delivered(entry):
+    entry.status = "delivered"
+    entry.delivered_at = datetime.utcnow()
+
+
+def mark_skipped(entry, reason: str):
+    """Nothing left to deliver, e.g. the offer was withdrawn or accepted meanwhile"""
+    entry.status = "skipped"
+    entry.last_error = reason
+
+
+def mark_dead(entry, error: str):
+    entry.status = "dead"
+    entry.last_error = error
+
+
+def schedule_retry(entry, error: str) -> bool:
+    """Back off and retry later; dead-letters the row once attempts run out. Returns True if it will retry."""
+    if entry.attempts >= OUTBOX_MAX_ATTEMPTS:
+        mark_dead(entry, f"gave up after {entry.attempts} attempts: {error}")
+        return False
+    entry.last_error = error
+    entry.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_seconds(entry.attempts))
+    return True
@@ -0,0 +1,126 @@
+"""
+Driver presence
+Heartbeats (HTTP, gateway and location pings) only touch an in-memory
+map of driver_id -> last seen. A sweeper marks drivers offline once they
+go quiet for the TTL.
+
+Transitions are published on PRESENCE_CHANNEL, and each snapshot
+re-announces the drivers still heartbeating; the matcher uses them as a liveness
+cache. The database gets a periodic snapshot instead of a write per heartbeat:
+driver_info.updated_at and client_endpoints.last_seen_at for every
+driver seen since the last one, in one statement each. Processes that
+can't hear the events still judge liveness from that snapshot.
+"""
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy import and_, update
+
+from database.models import ClientEndpoint, DriverInfo
+from services.events import notify_list
+
+# {"online": [driver ids]} or {"offline": [driver ids]}
+PRESENCE_CHANNEL = "velo_presence"
+
+
+class PresenceService:
+    """Last heartbeat per driver seen by this process"""
+
+    def __init__(self, ttl_seconds: float = 30.0, sweep_seconds: float = 1.0, snapshot_seconds: float = 15.0):
+        self.ttl_seconds = ttl_seconds
+        self.sweep_seconds = sweep_seconds
+        self.snapshot_seconds = snapshot_seconds
+        # driver_id -> monotonic time of the last heartbeat, for online drivers only
+        self._last_seen = {}
+        # Since the last snapshot / transitions not yet published
+        self._seen = set()
+        self._online = set()
+        self._offline = set()
+        self._sweeper = None
+        self._write = None
+        self._offline_handlers = []
+
+    def __len__(self):
+        return len(self._last_seen)
+
+    def start(self, write):
+        """Start the sweeper (idempotent); write(seen, online, offline) runs off the event loop"""
+        self._write = write
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    def add_offline_handler(self, handler):
+        """Call handler(driver_id) when the sweeper marks a driver offline"""
+        self._offline_handlers.append(handler)
+
+    def beat(self, driver_id: int):
+        if driver_id not in self._last_seen:
+            self._online.add(driver_id)
+            self._offline.discard(driver_id)
+        self._last_seen[driver_id] = time.monotonic()
+        self._seen.add(driver_id)
+
+    def sweep(self):
+        """Mark drivers silent for longer than the TTL offline"""
+        cutoff = time.monotonic() - self.ttl_seconds
+        for driver_id, last in list(self._last_seen.items()):
+            if last < cutoff:
+                del self._last_seen[driver_id]
+                self._offline.add(driver_id)
+                self._online.discard(driver_id)
+                for handler in self._offline_handlers:
+                    handler(driver_id)
+
+    def take_changes(self, snapshot: bool, closing: bool = False):
+        """
+        -> (drivers seen since the last snapshot, came online, went offline).
+        A snapshot re-announces every online driver seen since the last one,
+        so listeners can expire drivers of a process that died without
+        saying they went offline; closing announces them all offline instead.
+        """
+        seen = []
+        if snapshot or closing:
+            seen, self._seen = list(self._seen), set()
+        if closing:
+            online, offline = [], sorted(self._offline | set(self._last_seen))
+        elif snapshot:
+            online = sorted(self._online | self._last_seen.keys() & set(seen))
+            offline = sorted(self._offline)
+        else:
+            online, offline = sorted(self._online), sorted(self._offline)
+        self._online, self._offline = set(), set()
+        return seen, online, offline
+
+    async def flush(self, snapshot: bool = True, closing: bool = False):
+        seen, online, offline = self.take_changes(snapshot, closing)
+        if not (seen or online or offline) or self._write is None:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, seen, online, offline)
+        except Exception as e:
+            print(f"⚠️ Presence flush error: {e}")
+
+    async def _sweep_loop(self):
+        snapshot_at = time.monotonic() + self.snapshot_seconds
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            self.sweep()
+            snapshot = time.monotonic() >= snapshot_at
+            if snapshot:
+                snapshot_at = time.monotonic() + self.snapshot_seconds
+            await self.flush(snapshot)
+
+
+def write_presence(db, seen, online, offline):
+    """Snapshot last-seen times and publish transitions (sent on commit). The caller commits."""
+    if seen:
+        now = datetime.utcnow()
+        drivers = DriverInfo.__table__
+        db.execute(update(drivers).where(drivers.c.driver_id.in_(seen)).values(updated_at=now))
+        endpoints = ClientEndpoint.__table__
+        db.execute(update(endpoints).where(and_(
+            endpoints.c.role == "driver", endpoints.c.client_id.in_(seen)
+        )).values(last_seen_at=now))
+    notify_list(db, PRESENCE_CHANNEL, "online", online)
+    notify_list(db, PRESENCE_CHANNEL, "offline", offline)
@@ -0,0 +1,117 @@
+"""
+Live ride status for riders and drivers
+Anything that changes what a rider sees (ride status, assigned driver, OTP,
+driver location) queues a NOTIFY on the rides channel. The API server fans
+it out to that rider's open streams and long polls, which re-read the status
+and answer only if it changed, so each rider holds one idle connection
+instead of polling. Drivers' long polls are woken the same way, by ride
+changes naming them and by offer events.
+"""
+import asyncio
+
+from services.events import notify, notify_list
+
+RIDES_CHANNEL = "velo_rides"
+
+
+def notify_rider(db, user_id: int, *driver_ids):
+    """Queue a status push to the rider's streams, and to these drivers' long polls (sent on commit)"""
+    if driver_ids:
+        notify(db, RIDES_CHANNEL, user_id=user_id, drivers=list(driver_ids))
+    else:
+        notify(db, RIDES_CHANNEL, user_id=user_id)
+
+
+def notify_drivers_moved(db, driver_ids):
+    """Queue a push to riders whose assigned driver is one of these (one notification per few hundred drivers)"""
+    notify_list(db, RIDES_CHANNEL, "moved", list(driver_ids))
+
+
+class RideStatusHub:
+    """Rider streams and driver long polls open in this process, woken by RIDES_CHANNEL/OFFERS_CHANNEL payloads"""
+
+    def __init__(self):
+        self._loop = None
+        # user_id -> {asyncio.Event per open stream}
+        self._streams = {}
+        # driver_id -> {asyncio.Event per parked long poll}
+        self._drivers = {}
+        # driver_id -> {user_id}, and the reverse for unwatching
+        self._watchers = {}
+        self._driver_of = {}
+
+    def subscribe(self, user_id: int) -> asyncio.Event:
+        """Event set whenever the rider's status may have changed"""
+        self._loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        self._streams.setdefault(user_id, set()).add(wake)
+        return wake
+
+    def unsubscribe(self, user_id: int, wake: asyncio.Event):
+        streams = self._streams.get(user_id)
+        if streams is None:
+            return
+        streams.discard(wake)
+        if not streams:
+            del self._streams[user_id]
+            self.watch_driver(user_id, None)
+
+    def subscribe_driver(self, driver_id: int) -> asyncio.Event:
+        """Event set whenever the driver's offer or current ride may have changed"""
+        self._loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        self._drivers.setdefault(driver_id, set()).add(wake)
+        return wake
+
+    def unsubscribe_driver(self, driver_id: int, wake: asyncio.Event):
+        waiters = self._drivers.get(driver_id)
+        if waiters is None:
+            return
+        waiters.discard(wake)
+        if not waiters:
+            del self._drivers[driver_id]
+
+    def watch_driver(self, user_id: int, driver_id):
+        """Also wake the rider's streams when this driver moves (None: stop watching)"""
+        old = self._driver_of.get(user_id)
+        if old == driver_id:
+            return
+        if old is not None:
+            watchers = self._watchers.get(old, set())
+            watchers.discard(user_id)
+            if not watchers:
+                self._watchers.pop(old, None)
+        if driver_id is None:
+            self._driver_of.pop(user_id, None)
+        else:
+            self._driver_of[user_id] = driver_id
+            self._watchers.setdefault(driver_id, set()).add(user_id)
+
+    def on_event(self, payload: dict):
+        """Handler for RIDES_CHANNEL; safe to call from any thread"""
+        if self._loop is None:
+            # No stream has been opened in this process yet
+            return
+        self._loop.call_soon_threadsafe(self._wake, payload)
+
+    def on_offer_event(self, payload: dict):
+        """Handler for OFFERS_CHANNEL: wake the long polls of drivers offered or losing an offer"""
+        if self._loop is None:
+            return
+        drivers = list(payload.get("driver_ids", ()))
+        if payload.get("offered"):
+            drivers.append(payload["offered"]["driver_id"])
+        self._loop.call_soon_threadsafe(self._wake, {"drivers": drivers})
+
+    def _wake(self, payload: dict):
+        users = set()
+        for driver_id in payload.get("moved", ()):
+            users.update(self._watchers.get(driver_id, ()))
+        if "user_id" in payload:
+            users.add(payload["user_id"])
+        for user_id in users:
+            for wake in self._streams.get(user_id, ()):
+                wake.set()
+        for driver_id in payload.get("drivers", ()):
+            for wake in self._drivers.get(driver_id, ()):
+                wake.set()
@@ -0,0 +1,445 @@
+"""
+Offline road-network routing
+Loads a local OpenStreetMap extract (.osm XML) into a compact CSR road graph
+with per-edge travel times, precomputes ALT landmarks (A*, Landmarks,
+Triangle inequality) and answers travel-time queries without calling OSRM:
+- travel_time: point-to-point (quotes), A* with landmark lower bounds
+- many_to_one / one_to_many: one Dijkstra that stops once every target is settled
+- matrix: many-to-many distance matrix for the rest of the backend
+
+Build once with scripts/server_utils/build_road_graph.py and point
+ROAD_GRAPH_PATH at the resulting .npz.
+"""
+import heapq
+import math
+import os
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+
+from services.geo import EARTH_RADIUS_KM, haversine_km
+
+# Default speeds by OSM highway class when there is no usable maxspeed tag
+HIGHWAY_SPEEDS_KMH = {
+    "motorway": 80, "motorway_link": 50,
+    "trunk": 60, "trunk_link": 40,
+    "primary": 45, "primary_link": 35,
+    "secondary": 35, "secondary_link": 30,
+    "tertiary": 30, "tertiary_link": 25,
+    "unclassified": 25, "residential": 20,
+    "living_street": 10, "service": 15, "road": 20,
+}
+TRUTHY_ONEWAY = ("yes", "true", "1")
+
+# Pickup/driver points are joined to the nearest graph node at this speed
+OFF_ROAD_SPEED_KMH = 15
+# Points farther than this from any road are treated as unreachable
+MAX_SNAP_KM = 2.0
+# Node grid for snapping: ~1.1 km cells, searched ring by ring
+SNAP_CELL_DEG = 0.01
+SNAP_MAX_RINGS = 3
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180
+
+INF = float('inf')
+
+
+def _speed_kmh(tags: dict) -> float:
+    maxspeed = tags.get("maxspeed", "")
+    try:
+        value = float(maxspeed.split()[0])
+        if "mph" in maxspeed:
+            value *= 1.609
+        if value > 0:
+            return value
+    except (ValueError, IndexError):
+        pass
+    return HIGHWAY_SPEEDS_KMH[tags["highway"]]
+
+
+def _ring_cells(cx: int, cy: int, r: int):
+    """Yield the cells at Chebyshev distance exactly r from (cx, cy)"""
+    if r == 0:
+        yield (cx, cy)
+        return
+    for dx in range(-r, r + 1):
+        yield (cx + dx, cy - r)
+        yield (cx + dx, cy + r)
+    for dy in range(-r + 1, r):
+        yield (cx - r, cy + dy)
+        yield (cx + r, cy + dy)
+
+
+def _build_csr(n: int, src, dst, weight):
+    order = np.lexsort((dst, src))
+    src, dst, weight = src[order], dst[order], weight[order]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(offsets, src + 1, 1)
+    return np.cumsum(offsets), dst.astype(np.int32), weight.astype(np.float32)
+
+
+class RoadGraph:
+    """Directed road graph in CSR form; weights are travel times in seconds"""
+
+    def __init__(self, lat, lng, src, dst, weight, landmarks=None, lm_from=None, lm_to=None):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.src = np.asarray(src, dtype=np.int32)
+        self.dst = np.asarray(dst, dtype=np.int32)
+        self.weight = np.asarray(weight, dtype=np.float32)
+        n = len(self.lat)
+        self.fwd = _build_csr(n, self.src, self.dst, self.weight)
+        self.rev = _build_csr(n, self.dst, self.src, self.weight)
+        # ALT tables: lm_from[l][v] = d(landmark, v), lm_to[l][v] = d(v, landmark)
+        self.landmarks = np.asarray(landmarks if landmarks is not None else [], dtype=np.int32)
+        self.lm_from = lm_from
+        self.lm_to = lm_to
+        self._adjacency = {}
+        self._landmark_rows = None
+        self._grid = None
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.src)
+
+    # ---------- Loading ----------
+
+    @classmethod
+    def from_osm(cls, path: str):
+        """Parse highways out of an .osm XML extract"""
+        coords = {}
+        ways = []
+        for _, elem in ET.iterparse(path, events=("end",)):
+            if elem.tag == "node":
+                coords[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+                elem.clear()
+            elif elem.tag == "way":
+                tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                if tags.get("highway") in HIGHWAY_SPEEDS_KMH:
+                    refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                    ways.append((refs, tags))
+                elem.clear()
+
+        index = {}
+        src, dst, weight = [], [], []
+        for refs, tags in ways:
+            refs = [r for r in refs if r in coords]
+            speed_ms = _speed_kmh(tags) / 3.6
+            oneway = tags.get("oneway", "")
+            implied = tags.get("junction") == "roundabout" or tags["highway"] == "motorway"
+            if oneway == "-1":
+                forward, backward = False, True
+            elif oneway in TRUTHY_ONEWAY or (implied and oneway != "no"):
+                forward, backward = True, False
+            else:
+                forward, backward = True, True
+            for a, b in zip(refs, refs[1:]):
+                ia = index.setdefault(a, len(index))
+                ib = index.setdefault(b, len(index))
+                seconds = haversine_km(*coords[a], *coords[b]) * 1000 / speed_ms
+                if forward:
+                    src.append(ia); dst.append(ib); weight.append(seconds)
+                if backward:
+                    src.append(ib); dst.append(ia); weight.append(seconds)
+
+        lat = np.empty(len(index))
+        lng = np.empty(len(index))
+        for osm_id, i in index.items():
+            lat[i], lng[i] = coords[osm_id]
+        return cls(lat, lng, np.array(src, dtype=np.int32), np.array(dst, dtype=np.int32),
+                   np.array(weight, dtype=np.float32))
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path, lat=self.lat, lng=self.lng, src=self.src, dst=self.dst, weight=self.weight,
+            landmarks=self.landmarks,
+            lm_from=self.lm_from if self.lm_from is not None else np.zeros((0, len(self))),
+            lm_to=self.lm_to if self.lm_to is not None else np.zeros((0, len(self)))
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        if not path.endswith(".npz"):
+            return cls.from_osm(path)
+        data = np.load(path)
+        has_lm = len(data["landmarks"]) > 0
+        return cls(
+            data["lat"], data["lng"], data["src"], data["dst"], data["weight"],
+            landmarks=data["landmarks"],
+            lm_from=data["lm_from"] if has_lm else None,
+            lm_to=data["lm_to"] if has_lm else None
+        )
+
+    # ---------- Search ----------
+
+    def _adj(self, reverse: bool):
+        """Adjacency as Python lists (much faster to walk in a Dijkstra loop)"""
+        if reverse not in self._adjacency:
+            offsets, targets, weights = self.rev if reverse else self.fwd
+            self._adjacency[reverse] = (offsets.tolist(), targets.tolist(), weights.tolist())
+        return self._adjacency[reverse]
+
+    def dijkstra(self, source: int, targets=None, reverse: bool = False, max_seconds: float = INF):
+        """
+        Travel times from source (to source, if reverse). Stops once every
+        target is settled or the frontier passes max_seconds.
+        Returns {node: seconds} for settled nodes.
+        """
+        offsets, adj_targets, adj_weights = self._adj(reverse)
+        remaining = set(targets) if targets is not None else None
+        dist = {source: 0.0}
+        settled = {}
+        heap = [(0.0, source)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if v in settled:
+                continue
+            if d > max_seconds:
+                break
+            settled[v] = d
+            if remaining is not None:
+                remaining.discard(v)
+                if not remaining:
+                    break
+            for e in range(offsets[v], offsets[v + 1]):
+                w = adj_targets[e]
+                nd = d + adj_weights[e]
+                if nd < dist.get(w, INF):
+                    dist[w] = nd
+                    heapq.heappush(heap, (nd, w))
+        return settled
+
+    def _full_dijkstra(self, source: int, reverse: bool) -> np.ndarray:
+        out = np.full(len(self), np.inf)
+        for v, d in self.dijkstra(source, reverse=reverse).items():
+            out[v] = d
+        return out
+
+    def precompute_landmarks(self, count: int = 8):
+        """Pick landmarks by farthest-point selection and store both distance tables"""
+        if len(self) == 0:
+            return
+        landmarks, lm_from, lm_to = [], [], []
+        candidate = 0
+        min_to_chosen = np.full(len(self), np.inf)
+        for _ in range(min(count, len(self))):
+            landmarks.append(candidate)
+            d_from = self._full_dijkstra(candidate, reverse=False)
+            d_to = self._full_dijkstra(candidate, reverse=True)
+            lm_from.append(d_from)
+            lm_to.append(d_to)
+            # Next landmark: reachable node farthest from all chosen ones
+            reach = np.where(np.isfinite(d_from), d_from, -1.0)
+            min_to_chosen = np.minimum(min_to_chosen, reach)
+            min_to_chosen[landmarks] = -1.0
+            candidate = int(np.argmax(min_to_chosen))
+            if min_to_chosen[candidate] <= 0:
+                break
+        self.landmarks = np.array(landmarks, dtype=np.int32)
+        self.lm_from = np.vstack(lm_from)
+        self.lm_to = np.vstack(lm_to)
+
+    def _landmark_tables(self):
+        """Landmark distance rows as arrays of Python floats (cheap to index one node at a time)"""
+        if self._landmark_rows is None:
+            # Doubles, as the searches add up: float32 rounding could push a bound
+            # past the true distance, and A* would then miss the best route
+            self._landmark_rows = (
+                [array("d", row.astype(np.float64).tobytes()) for row in self.lm_from],
+                [array("d", row.astype(np.float64).tobytes()) for row in self.lm_to]
+            )
+        return self._landmark_rows
+
+    def _landmark_slack(self) -> float:
+        """Worst rounding error of a bound from float32 tables (graph files saved before they were doubles)"""
+        if self.lm_from.dtype != np.float32:
+            return 0.0
+        finite = [t[np.isfinite(t)] for t in (self.lm_from, self.lm_to)]
+        largest = max((float(t.max()) for t in finite if t.size), default=0.0)
+        # Each term subtracts two values rounded to 24 bits
+        return largest * 2.0 ** -23
+
+    def _alt_bound(self, target: int):
+        """Heuristic h(v): lower bound on travel time v -> target (INF: target unreachable from v)"""
+        if self.lm_from is None or len(self.landmarks) == 0:
+            return lambda v: 0.0
+        lm_from, lm_to = self._landmark_tables()
+        # Per landmark: (d(L,t), d(L,.), d(.,L), d(t,L))
+        tables = [
+            (from_row[target], from_row, to_row, to_row[target])
+            for from_row, to_row in zip(lm_from, lm_to)
+        ]
+
+        def bound(v):
+            # d(v,t) >= d(L,t) - d(L,v)  and  d(v,t) >= d(v,L) - d(t,L);
+            # inf - inf is nan, which never wins a comparison
+            best = 0.0
+            for from_t, from_row, to_row, to_t in tables:
+                a = from_t - from_row[v]
+                if a > best:
+                    best = a
+                b = to_row[v] - to_t
+                if b > best:
+                    best = b
+            return best
+
+        slack = self._landmark_slack()
+        if slack:
+            return lambda v: max(bound(v) - slack, 0.0)
+        return bound
+
+    def travel_time(self, source: int, target: int) -> float:
+        """Point-to-point travel time (seconds) with ALT-guided A*"""
+        if source == target:
+            return 0.0
+        offsets, adj_targets, adj_weights = self._adj(False)
+        h = self._alt_bound(target)
+        if h(source) == INF:
+            return INF
+        dist = {source: 0.0}
+        closed = set()
+        heap = [(h(source), source)]
+        while heap:
+            _, v = heapq.heappop(heap)
+            if v == target:
+                return dist[v]
+            if v in closed:
+                continue
+            closed.add(v)
+            d = dist[v]
+            for e in range(offsets[v], offsets[v + 1]):
+                w = adj_targets[e]
+                nd = d + adj_weights[e]
+                if nd < dist.get(w, INF):
+                    hw = h(w)
+                    if hw == INF:
+                        # No path from w to the target
+                        continue
+                    dist[w] = nd
+                    heapq.heappush(heap, (nd + hw, w))
+        return INF
+
+    # ---------- Snapping ----------
+
+    def _node_grid(self) -> dict:
+        """(cell_x, cell_y) -> node ids in that cell, built on first use"""
+        if self._grid is None:
+            cx = np.floor(self.lat / SNAP_CELL_DEG).astype(np.int64)
+            cy = np.floor(self.lng / SNAP_CELL_DEG).astype(np.int64)
+            order = np.lexsort((cy, cx))
+            cx, cy = cx[order], cy[order]
+            starts = np.flatnonzero(np.r_[True, (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])])
+            self._grid = {
+                (int(cx[start]), int(cy[start])): nodes
+                for start, nodes in zip(starts, np.split(order, starts[1:]))
+            }
+        return self._grid
+
+    def _closest(self, nodes, lat: float, lng: float):
+        # Equirectangular distance is plenty to pick the closest node
+        x = np.radians(self.lng[nodes] - lng) * math.cos(math.radians(lat))
+        y = np.radians(self.lat[nodes] - lat)
+        node = int(nodes[int(np.argmin(x * x + y * y))])
+        return node, haversine_km(lat, lng, self.lat[node], self.lng[node])
+
+    def snap(self, lat: float, lng: float):
+        """Nearest graph node to a point -> (node, distance_km)"""
+        grid = self._node_grid()
+        cx, cy = math.floor(lat / SNAP_CELL_DEG), math.floor(lng / SNAP_CELL_DEG)
+        best, best_km = None, INF
+        for r in range(SNAP_MAX_RINGS + 1):
+            cells = [grid[cell] for cell in _ring_cells(cx, cy, r) if cell in grid]
+            if cells:
+                node, km = self._closest(np.concatenate(cells), lat, lng)
+                if km < best_km:
+                    best, best_km = node, km
+            # Nodes not yet seen are at least r whole cells away
+            max_lat = min(89.0, abs(lat) + (r + 1) * SNAP_CELL_DEG)
+            if best is not None and best_km <= r * SNAP_CELL_DEG * KM_PER_DEG * math.cos(math.radians(max_lat)):
+                return best, best_km
+        # Far from any road: scan every node
+        return self._closest(np.arange(len(self)), lat, lng)
+
+
+class Router:
+    """lat/lng facing travel-time API on top of a RoadGraph"""
+
+    def __init__(self, graph: RoadGraph, off_road_speed_kmh: float = OFF_ROAD_SPEED_KMH,
+                 max_snap_km: float = MAX_SNAP_KM):
+        self.graph = graph
+        self.off_road_speed_kmh = off_road_speed_kmh
+        self.max_snap_km = max_snap_km
+
+    def _snap(self, point):
+        node, km = self.graph.snap(point[0], point[1])
+        if km > self.max_snap_km:
+            return None, INF
+        return node, km / self.off_road_speed_kmh * 3600
+
+    def eta(self, origin, destination) -> float:
+        """Travel time in seconds between two (lat, lng) points"""
+        a, a_extra = self._snap(origin)
+        b, b_extra = self._snap(destination)
+        if a is None or b is None:
+            return INF
+        return a_extra + self.graph.travel_time(a, b) + b_extra
+
+    def many_to_one(self, origins, destination, max_seconds: float = INF) -> list:
+        """Travel time from each origin to one destination (e.g. drivers -> pickup)"""
+        return self._fan(origins, destination, reverse=True, max_seconds=max_seconds)
+
+    def one_to_many(self, origin, destinations, max_seconds: float = INF) -> list:
+        """Travel time from one origin to each destination"""
+        return self._fan(destinations, origin, reverse=False, max_seconds=max_seconds)
+
+    def _fan(self, points, center, reverse: bool, max_seconds: float) -> list:
+        return self._search(self._snap(center), [self._snap(p) for p in points], reverse, max_seconds)
+
+    def _search(self, center, snapped, reverse: bool, max_seconds: float) -> list:
+        """One Dijkstra from a snapped center, stopping once every snapped point is settled"""
+        c, c_extra = center
+        if c is None:
+            return [INF] * len(snapped)
+        targets = {node for node, _ in snapped if node is not None}
+        settled = self.graph.dijkstra(c, targets=targets, reverse=reverse, max_seconds=max_seconds)
+        return [
+            c_extra + settled[node] + extra if node in settled else INF
+            for node, extra in snapped
+        ]
+
+    def matrix(self, origins, destinations, max_seconds: float = INF) -> list:
+        """
+        Many-to-many travel times: rows are origins, columns destinations.
+        Every point is snapped once; then one search per origin over the
+        forward graph, or per destination over the reverse graph if there
+        are fewer destinations. Pairs beyond max_seconds come back as INF.
+        """
+        from_points = [self._snap(p) for p in origins]
+        to_points = [self._snap(p) for p in destinations]
+        if len(from_points) <= len(to_points):
+            return [self._search(o, to_points, False, max_seconds) for o in from_points]
+        columns = [self._search(d, from_points, True, max_seconds) for d in to_points]
+        return [list(row) for row in zip(*columns)]
+
+
+_router = None
+_router_loaded = False
+
+
+def get_router():
+    """Router for ROAD_GRAPH_PATH (loaded once), or None if no graph is configured"""
+    global _router, _router_loaded
+    if not _router_loaded:
+        _router_loaded = True
+        path = os.getenv("ROAD_GRAPH_PATH")
+        if path:
+            try:
+                graph = RoadGraph.load(path)
+                _router = Router(graph)
+                print(f"🗺️  Road graph loaded: {len(graph)} nodes, {graph.edge_count} edges")
+            except Exception as e:
+                print(f"⚠️ Could not load road graph {path}: {e}")
+    return _router
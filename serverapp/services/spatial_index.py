@@ -0,0 +1,141 @@
+"""
+Spatial grid index of available drivers
+Buckets driver positions into fixed-size lat/lng cells, split by
+(vehicle_type, is_verified_safe), so the matcher only looks at the cells
+around a pickup instead of every driver in the table.
+"""
+import math
+
+from services.geo import haversine_km, EARTH_RADIUS_KM
+
+# ~1.1 km cells at the equator
+DEFAULT_CELL_SIZE_DEG = 0.01
+
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180
+
+
+class DriverGridIndex:
+    """In-memory uniform grid of driver positions"""
+
+    def __init__(self, cell_size_deg: float = DEFAULT_CELL_SIZE_DEG):
+        self.cell_size_deg = cell_size_deg
+        # (vehicle_type, is_verified_safe) -> {(cell_x, cell_y): {driver_id, ...}}
+        self._partitions = {}
+        # driver_id -> (lat, lng, partition_key, cell)
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._entries
+
+    def _cell(self, lat: float, lng: float):
+        return (math.floor(lat / self.cell_size_deg), math.floor(lng / self.cell_size_deg))
+
+    def position(self, driver_id):
+        """Return (lat, lng) for an indexed driver, or None"""
+        entry = self._entries.get(driver_id)
+        return (entry[0], entry[1]) if entry else None
+
+    def upsert(self, driver_id: int, lat: float, lng: float,
+               vehicle_type: str = "auto", is_verified_safe: bool = False):
+        """Insert a driver or move it to its new cell/partition"""
+        key = (vehicle_type or "auto", bool(is_verified_safe))
+        cell = self._cell(lat, lng)
+
+        old = self._entries.get(driver_id)
+        if old and (old[2] != key or old[3] != cell):
+            self._discard(driver_id, old[2], old[3])
+
+        if not old or old[2] != key or old[3] != cell:
+            self._partitions.setdefault(key, {}).setdefault(cell, set()).add(driver_id)
+
+        self._entries[driver_id] = (lat, lng, key, cell)
+
+    def remove(self, driver_id: int):
+        """Drop a driver from the index (went offline / unavailable)"""
+        old = self._entries.pop(driver_id, None)
+        if old:
+            self._discard(driver_id, old[2], old[3])
+
+    def clear(self):
+        self._partitions.clear()
+        self._entries.clear()
+
+    def _discard(self, driver_id, key, cell):
+        cells = self._partitions.get(key)
+        if not cells:
+            return
+        bucket = cells.get(cell)
+        if bucket is not None:
+            bucket.discard(driver_id)
+            if not bucket:
+                del cells[cell]
+        if not cells:
+            del self._partitions[key]
+
+    def _ring(self, cx: int, cy: int, r: int):
+        """Yield the cells at Chebyshev distance exactly r from (cx, cy)"""
+        if r == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-r, r + 1):
+            yield (cx + dx, cy - r)
+            yield (cx + dx, cy + r)
+        for dy in range(-r + 1, r):
+            yield (cx - r, cy + dy)
+            yield (cx + r, cy + dy)
+
+    def nearest(self, lat: float, lng: float, k: int, radius_km: float,
+                vehicle_types=None, safe_only: bool = False, exclude=None):
+        """
+        Return up to k (driver_id, distance_km) pairs sorted by distance,
+        limited to drivers within radius_km. Widens the search one ring of
+        cells at a time and stops as soon as no unseen cell can hold a
+        closer driver.
+        """
+        if k <= 0:
+            return []
+
+        partitions = [
+            cells for (vehicle_type, is_safe), cells in self._partitions.items()
+            if (vehicle_types is None or vehicle_type in vehicle_types)
+            and (is_safe or not safe_only)
+        ]
+        if not partitions:
+            return []
+
+        exclude = exclude or ()
+        cx, cy = self._cell(lat, lng)
+        found = []
+
+        r = 0
+        while True:
+            for cell in self._ring(cx, cy, r):
+                for cells in partitions:
+                    bucket = cells.get(cell)
+                    if not bucket:
+                        continue
+                    for driver_id in bucket:
+                        if driver_id in exclude:
+                            continue
+                        d_lat, d_lng = self._entries[driver_id][:2]
+                        dist = haversine_km(lat, lng, d_lat, d_lng)
+                        if dist <= radius_km:
+                            found.append((dist, driver_id))
+
+            # Anything not yet seen is at least r whole cells away
+            max_lat = min(89.0, abs(lat) + (r + 1) * self.cell_size_deg)
+            covered_km = r * self.cell_size_deg * KM_PER_DEG * math.cos(math.radians(max_lat))
+
+            if covered_km >= radius_km:
+                break
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= covered_km:
+                    break
+            r += 1
+
+        found.sort()
+        return [(driver_id, dist) for dist, driver_id in found[:k]]
@@ -0,0 +1,108 @@
+"""
+Hierarchical timing wheel
+O(1) schedule/cancel for large numbers of timers that mostly get cancelled
+(offers are usually accepted or declined long before they expire). Level 0
+has `slots` buckets of `tick_seconds`; each higher level covers `slots`
+buckets of the level below and cascades down as time reaches it.
+"""
+import math
+
+
+class TimerWheel:
+    """Timers keyed by any hashable id; times are on the caller's clock (e.g. time.monotonic())"""
+
+    def __init__(self, now: float, tick_seconds: float = 0.01, slots: int = 64, levels: int = 4):
+        self.tick_seconds = tick_seconds
+        self.slots = slots
+        self.levels = levels
+        # _wheels[level][slot] -> {key: deadline_tick}
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        # key -> (level, slot, deadline_tick)
+        self._where = {}
+        self._tick = self._to_tick(now)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _to_tick(self, t: float) -> int:
+        return math.floor(t / self.tick_seconds)
+
+    def _place(self, key, deadline_tick: int, earliest_tick: int):
+        # Already-due timers go in the earliest bucket still to be processed
+        bucket_tick = max(deadline_tick, earliest_tick)
+        delta = bucket_tick - self._tick
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots or level == self.levels - 1:
+                # Beyond the top level's horizon: park in its furthest bucket and re-place on cascade
+                bucket_tick = min(bucket_tick, self._tick + span * (self.slots - 1))
+                slot = (bucket_tick // span) % self.slots
+                self._wheels[level][slot][key] = deadline_tick
+                self._where[key] = (level, slot, deadline_tick)
+                return
+            span *= self.slots
+
+    def schedule(self, key, deadline: float):
+        """Arm (or re-arm) the timer for key"""
+        self.cancel(key)
+        self._place(key, math.ceil(deadline / self.tick_seconds), self._tick + 1)
+
+    def cancel(self, key) -> bool:
+        where = self._where.pop(key, None)
+        if where is None:
+            return False
+        level, slot, _ = where
+        self._wheels[level][slot].pop(key, None)
+        return True
+
+    def advance(self, now: float) -> list:
+        """Move time forward to now; returns keys whose deadline has passed"""
+        target = self._to_tick(now)
+        expired = []
+        while self._tick < target:
+            if not self._where:
+                # Nothing armed: jump straight to now
+                self._tick = target
+                break
+            self._tick += 1
+            self._cascade()
+            bucket = self._wheels[0][self._tick % self.slots]
+            if bucket:
+                self._wheels[0][self._tick % self.slots] = {}
+                for key, deadline_tick in bucket.items():
+                    if deadline_tick <= self._tick:
+                        del self._where[key]
+                        expired.append(key)
+                    else:
+                        self._place(key, deadline_tick, self._tick + 1)
+        return expired
+
+    def _cascade(self):
+        """Re-place higher-level buckets that the clock has just reached"""
+        span = self.slots
+        for level in range(1, self.levels):
+            if self._tick % span:
+                break
+            slot = (self._tick // span) % self.slots
+            bucket = self._wheels[level][slot]
+            if bucket:
+                self._wheels[level][slot] = {}
+                for key, deadline_tick in bucket.items():
+                    self._place(key, deadline_tick, self._tick)
+            span *= self.slots
+
+    def next_wakeup(self):
+        """
+        Earliest time advance() could return something, or None if empty.
+        Either the next occupied level-0 bucket or the next cascade point.
+        """
+        if not self._where:
+            return None
+        for offset in range(1, self.slots + 1):
+            tick = self._tick + offset
+            if self._wheels[0][tick % self.slots] or tick % self.slots == 0:
+                return tick * self.tick_seconds
+        return (self._tick + self.slots) * self.tick_seconds
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Same as the services: modules import each other from serverapp/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Nothing here talks to a database, but importing the models builds engines
+os.environ.setdefault("DATABASE_URL", "sqlite://")
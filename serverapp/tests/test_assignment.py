@@ -0,0 +1,62 @@
+import itertools
+import random
+
+import pytest
+
+from services.assignment import min_cost_assignment
+
+UNMATCHED = 1000.0
+
+
+def total_cost(candidates, assignment):
+    cost = 0.0
+    for ride, edges in candidates.items():
+        if ride in assignment:
+            cost += min(c for d, c in edges if d == assignment[ride])
+        else:
+            cost += UNMATCHED
+    return cost
+
+
+def brute_force_cost(candidates):
+    """Cheapest total over every way of giving each ride one of its drivers (or none)"""
+    rides = list(candidates)
+    options = [[None] + sorted({d for d, _ in candidates[ride]}) for ride in rides]
+    best = float('inf')
+    for choice in itertools.product(*options):
+        taken = [d for d in choice if d is not None]
+        if len(taken) != len(set(taken)):
+            continue
+        assignment = {ride: d for ride, d in zip(rides, choice) if d is not None}
+        best = min(best, total_cost(candidates, assignment))
+    return best
+
+
+def test_prefers_global_optimum_over_greedy():
+    # Greedy gives ride 1 its nearest driver A and leaves ride 2 with B at 10
+    candidates = {1: [("A", 1.0), ("B", 2.0)], 2: [("A", 1.5), ("B", 10.0)]}
+    assert min_cost_assignment(candidates, UNMATCHED) == {1: "B", 2: "A"}
+
+
+def test_rides_left_pending_when_drivers_run_out():
+    candidates = {1: [("A", 1.0)], 2: [("A", 2.0)], 3: []}
+    assert min_cost_assignment(candidates, UNMATCHED) == {1: "A"}
+
+
+def test_empty():
+    assert min_cost_assignment({}, UNMATCHED) == {}
+
+
+def test_matches_brute_force_on_random_instances():
+    rng = random.Random(7)
+    for _ in range(200):
+        drivers = [f"d{i}" for i in range(rng.randint(1, 5))]
+        candidates = {
+            ride: [(d, round(rng.uniform(0.1, 20), 2)) for d in rng.sample(drivers, rng.randint(0, len(drivers)))]
+            for ride in range(rng.randint(1, 5))
+        }
+        assignment = min_cost_assignment(candidates, UNMATCHED)
+        assert len(set(assignment.values())) == len(assignment)
+        for ride, driver in assignment.items():
+            assert driver in {d for d, _ in candidates[ride]}
+        assert total_cost(candidates, assignment) == pytest.approx(brute_force_cost(candidates))
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+from services import breadcrumbs
+from services.breadcrumbs import (
+    BreadcrumbRecorder, Segment, decode_points, encode_points, simplify_track, to_sample
+)
+
+
+def random_track(count=500, seed=3):
+    rng = random.Random(seed)
+    t, lat, lng = 1_760_000_000_000, 12_971_600, 77_594_600
+    points = []
+    for _ in range(count):
+        t += rng.randint(800, 1500)
+        lat += rng.randint(-150, 150)
+        lng += rng.randint(-150, 150)
+        points.append((t, lat, lng))
+    return points
+
+
+def test_round_trip():
+    points = random_track()
+    assert decode_points(encode_points(points)) == points
+
+
+def test_round_trip_extremes():
+    points = [(0, 0, 0), (1, -90_000_000, 180_000_000), (2**41, 90_000_000, -180_000_000), (2**41, 0, 0)]
+    assert decode_points(encode_points(points)) == points
+    assert decode_points(encode_points([])) == []
+
+
+def test_encoding_is_compact():
+    # ~1 Hz, a few metres per second: a handful of bytes per sample
+    points = random_track(1000)
+    assert len(encode_points(points)) / len(points) < 6
+
+
+def test_unknown_format_rejected():
+    with pytest.raises(ValueError):
+        decode_points(b"")
+    with pytest.raises(ValueError):
+        decode_points(bytes([99, 1, 2, 3]))
+
+
+def test_segment_matches_encode_points():
+    points = random_track(200)
+    segment = Segment(7)
+    for point in points:
+        segment.add(point)
+    assert bytes(segment.data) == encode_points(points)
+    assert segment.samples() == points
+    assert segment.count == 200
+    assert segment.started_ms == points[0][0]
+    assert segment.last == points[-1]
+
+
+def test_recorder_seals_by_time(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(breadcrumbs.time, "time", lambda: clock[0])
+    recorder = BreadcrumbRecorder(segment_seconds=60)
+    for i in range(150):
+        recorder.append(1, 12.9 + i * 1e-5, 77.5)
+        recorder.append(2, 13.0, 77.6 - i * 1e-5)
+        clock[0] += 1
+
+    # 150 s of pings in 60 s segments: two sealed per driver, one still open
+    sealed = recorder.take_sealed()
+    assert sorted((s.driver_id, s.count) for s in sealed) == [(1, 60), (1, 60), (2, 60), (2, 60)]
+    assert len(recorder.pending(1)) == 30
+
+    rest = recorder.take_sealed(everything=True)
+    assert sorted((s.driver_id, s.count) for s in rest) == [(1, 30), (2, 30)]
+    assert recorder.pending(1) == []
+
+    samples = [s for seg in sorted(sealed + rest, key=lambda s: s.started_ms) if seg.driver_id == 1
+               for s in seg.samples()]
+    assert samples == [to_sample(int((1000 + i) * 1000), 12.9 + i * 1e-5, 77.5) for i in range(150)]
+
+
+def test_pending_returns_degrees(monkeypatch):
+    monkeypatch.setattr(breadcrumbs.time, "time", lambda: 2000.0)
+    recorder = BreadcrumbRecorder()
+    recorder.append(5, 12.971234, 77.594567)
+    assert recorder.pending(5) == [(2_000_000, 12.971234, 77.594567)]
+    assert recorder.pending(6) == []
+
+
+def test_simplify_straight_line_keeps_endpoints():
+    points = [(i * 1000, 12.9 + i * 1e-4, 77.5) for i in range(50)]
+    assert simplify_track(points, tolerance_m=1) == [points[0], points[-1]]
+
+
+def test_simplify_keeps_corners_and_back_tracks():
+    # North, then east, then straight back west past the corner
+    north = [(i, 12.9 + i * 1e-4, 77.5) for i in range(11)]
+    east = [(11 + i, 12.901, 77.5 + (i + 1) * 1e-4) for i in range(10)]
+    west = [(21 + i, 12.901, 77.501 - (i + 1) * 2e-4) for i in range(10)]
+    points = north + east + west
+    kept = simplify_track(points, tolerance_m=5)
+    assert kept[0] == points[0] and kept[-1] == points[-1]
+    assert north[-1] in kept  # the corner
+    assert east[-1] in kept   # the turn back
+
+
+def test_simplify_small_inputs():
+    assert simplify_track([], 10) == []
+    two = [(0, 1.0, 1.0), (1, 1.1, 1.1)]
+    assert simplify_track(two, 10) == two
+    three = [(0, 1.0, 1.0), (1, 1.5, 1.5), (2, 1.1, 1.1)]
+    assert simplify_track(three, 0) == three
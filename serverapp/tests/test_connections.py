@@ -0,0 +1,111 @@
+import pytest
+from sqlalchemy.pool import NullPool
+
+from database import connections
+from database.replica import ReplicaRouter
+
+PG_URL = "postgresql://velo:secret@db/velo"
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    for name in ("POOL_SIZE", "MAX_OVERFLOW", "POOL_TIMEOUT", "POOL_RECYCLE", "POOL_PRE_PING"):
+        monkeypatch.delenv(f"DB_{name}", raising=False)
+        monkeypatch.delenv(f"MATCHER_DB_{name}", raising=False)
+    monkeypatch.setattr(connections, "VELO_SERVICE", "")
+    monkeypatch.setattr(connections, "DB_PGBOUNCER", False)
+
+
+def test_sqlite_uses_the_default_pool():
+    assert connections.engine_options("sqlite://") == {}
+    assert connections.engine_options("sqlite:///velo.db", asyncio=True) == {}
+
+
+def test_default_pool_settings():
+    assert connections.engine_options(PG_URL) == {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30.0,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    }
+
+
+def test_service_setting_wins_over_shared_one(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "8")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "0")
+    monkeypatch.setenv("MATCHER_DB_POOL_SIZE", "2")
+    assert connections.engine_options(PG_URL)["pool_size"] == 8
+
+    monkeypatch.setattr(connections, "VELO_SERVICE", "MATCHER")
+    options = connections.engine_options(PG_URL)
+    assert options["pool_size"] == 2
+    # Falls back to the shared setting where the service has none
+    assert options["pool_pre_ping"] is False
+
+
+def test_pgbouncer_leaves_pooling_to_the_bouncer(monkeypatch):
+    monkeypatch.setattr(connections, "DB_PGBOUNCER", True)
+    assert connections.engine_options(PG_URL) == {"poolclass": NullPool}
+
+    options = connections.engine_options(PG_URL, asyncio=True)
+    assert options["poolclass"] is NullPool
+    args = options["connect_args"]
+    assert args["statement_cache_size"] == 0
+    assert args["prepared_statement_cache_size"] == 0
+    # Statement names must not collide across server connections
+    assert args["prepared_statement_name_func"]() != args["prepared_statement_name_func"]()
+
+
+def test_async_database_url():
+    assert connections.async_database_url(PG_URL).drivername == "postgresql+asyncpg"
+    assert connections.async_database_url("sqlite:///velo.db").drivername == "sqlite+aiosqlite"
+    assert connections.async_database_url("postgresql+asyncpg://db/velo").drivername == "postgresql+asyncpg"
+
+
+class FakeEngine:
+    def __init__(self, lag):
+        self.lag = lag
+
+    def connect(self):
+        if isinstance(self.lag, Exception):
+            raise self.lag
+        return FakeConnection(self.lag)
+
+
+class FakeConnection:
+    def __init__(self, lag):
+        self.lag = lag
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement):
+        return self
+
+    def scalar(self):
+        return self.lag
+
+
+def test_replica_router_follows_lag():
+    engine = FakeEngine(0)
+    router = ReplicaRouter(engine, max_lag_seconds=5)
+    # Reads stay on the primary until the replica has been checked
+    assert router._healthy is False
+
+    router.check()
+    assert router._healthy is True
+    assert router.lag_seconds == 0
+
+    engine.lag = 12.5
+    router.check()
+    assert router._healthy is False
+    assert router.lag_seconds == 12.5
+
+    engine.lag = OSError("connection refused")
+    router.check()
+    assert router._healthy is False
+    assert router.lag_seconds is None
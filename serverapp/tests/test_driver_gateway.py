@@ -0,0 +1,154 @@
+import asyncio
+
+from services.driver_gateway import DriverGateway
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.closed = code
+
+
+class FakeLocations:
+    def __init__(self):
+        self.known = set()
+        self.positions = {}
+
+    def mark_known(self, driver_ids):
+        self.known.update(driver_ids)
+
+    def record(self, driver_id, lat, lng):
+        self.positions[driver_id] = (lat, lng)
+
+
+class FakePresence:
+    def __init__(self):
+        self.beats = []
+
+    def beat(self, driver_id):
+        self.beats.append(driver_id)
+
+
+def gateway(ack_timeout=1.0):
+    return DriverGateway(FakeLocations(), FakePresence(), ack_timeout=ack_timeout)
+
+
+def test_connect_replaces_the_older_socket():
+    async def scenario():
+        gw = gateway()
+        first, second = FakeSocket(), FakeSocket()
+        old = await gw.connect(7, first)
+        new = await gw.connect(7, second)
+        assert first.closed == 4000
+        assert len(gw) == 1
+        assert gw.locations.known == {7}
+        assert gw.presence.beats == [7, 7]
+
+        # The old socket's handler finishing must not drop the new one
+        assert gw.disconnect(old) is False
+        assert gw.is_connected(7)
+        assert gw.disconnect(new) is True
+        assert not gw.is_connected(7)
+
+    run(scenario())
+
+
+def test_heartbeats_and_locations_go_to_their_services():
+    async def scenario():
+        gw = gateway()
+        conn = await gw.connect(7, FakeSocket())
+        gw.mark_seen(conn)
+        gw.set_location(conn, 12.97, 77.59)
+        assert gw.presence.beats == [7, 7]
+        assert gw.locations.positions == {7: (12.97, 77.59)}
+
+    run(scenario())
+
+
+def test_offer_waits_for_ack():
+    async def scenario():
+        gw = gateway()
+        socket = FakeSocket()
+        conn = await gw.connect(7, socket)
+        delivery = asyncio.ensure_future(gw.deliver_offer(7, {"match_id": 3, "fare": 80}))
+        await asyncio.sleep(0)
+        (offer,) = socket.sent
+        assert offer["type"] == "offer" and offer["match_id"] == 3
+        gw.handle_ack(conn, offer["id"])
+        assert await delivery is True
+        assert conn.offers == {3}
+        assert conn.pending_acks == {}
+
+        assert await gw.deliver_offer(8, {"match_id": 4}) is False
+
+    run(scenario())
+
+
+def test_unacked_offer_times_out_or_fails_on_disconnect():
+    async def scenario():
+        gw = gateway(ack_timeout=0.01)
+        conn = await gw.connect(7, FakeSocket())
+        assert await gw.deliver_offer(7, {"match_id": 3}) is False
+        assert conn.offers == set()
+
+        gw.ack_timeout = 5
+        delivery = asyncio.ensure_future(gw.deliver_offer(7, {"match_id": 4}))
+        await asyncio.sleep(0)
+        gw.disconnect(conn)
+        assert await delivery is False
+
+    run(scenario())
+
+
+def test_closed_offers_reach_only_their_drivers():
+    async def scenario():
+        gw = gateway()
+        gw.start()
+        sockets = {driver_id: FakeSocket() for driver_id in (7, 8)}
+        conns = {driver_id: await gw.connect(driver_id, socket) for driver_id, socket in sockets.items()}
+        conns[7].offers.update({3, 5})
+        conns[8].offers.add(4)
+
+        gw.on_offer_event({"match_ids": [3, 5, 9], "driver_ids": [7, 7, 1]})
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert sockets[7].sent == [{"type": "offer_closed", "match_ids": [3, 5]}]
+        assert sockets[8].sent == []
+        assert conns[7].offers == set()
+        assert conns[8].offers == {4}
+
+    run(scenario())
+
+
+def test_announced_offers_are_relayed_once():
+    async def scenario():
+        gw = gateway()
+        gw.start()
+        socket = FakeSocket()
+        conn = await gw.connect(7, socket)
+        conn.offers.add(3)
+
+        # Pushed by the notifier already; not for a driver connected here
+        gw.on_offer_event({"offered": {"match_id": 3, "driver_id": 7}})
+        gw.on_offer_event({"offered": {"match_id": 4, "driver_id": 8}})
+        gw.on_offer_event({"offered": {"match_id": 5, "driver_id": 7}})
+        for _ in range(3):
+            await asyncio.sleep(0)
+        (offer,) = socket.sent
+        assert (offer["type"], offer["match_id"]) == ("offer", 5)
+        gw.handle_ack(conn, offer["id"])
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert conn.offers == {3, 5}
+
+    run(scenario())
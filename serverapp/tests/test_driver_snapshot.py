@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from services.driver_snapshot import DriverSnapshot
+from services.spatial_index import DriverGridIndex
+
+
+def fill(indexes, count=400, seed=11):
+    rng = random.Random(seed)
+    for driver_id in range(count):
+        lat, lng = 12.9 + rng.uniform(-0.08, 0.08), 77.6 + rng.uniform(-0.08, 0.08)
+        vehicle_type, is_safe = rng.choice(["auto", "cab", "bike"]), rng.random() < 0.3
+        for index in indexes:
+            index.upsert(driver_id, lat, lng, vehicle_type, is_safe)
+
+
+def assert_same(a, b):
+    assert [d for d, _ in a] == [d for d, _ in b]
+    assert [dist for _, dist in a] == pytest.approx([dist for _, dist in b], abs=1e-9)
+
+
+def test_nearest_agrees_with_grid_index():
+    snapshot, grid = DriverSnapshot(capacity=16), DriverGridIndex()
+    fill((snapshot, grid))
+    rng = random.Random(12)
+    for _ in range(50):
+        lat, lng = 12.9 + rng.uniform(-0.1, 0.1), 77.6 + rng.uniform(-0.1, 0.1)
+        args = (lat, lng, rng.choice([1, 5, 30]), rng.choice([1.0, 3.0, 20.0]))
+        kwargs = dict(
+            vehicle_types=rng.choice([None, {"cab"}, {"auto", "bike"}]),
+            safe_only=rng.random() < 0.3,
+            exclude=set(rng.sample(range(400), 40))
+        )
+        assert_same(snapshot.nearest(*args, **kwargs), grid.nearest(*args, **kwargs))
+
+
+def test_removed_rows_are_reused():
+    snapshot = DriverSnapshot(capacity=4)
+    for driver_id in range(10):
+        snapshot.upsert(driver_id, 12.9, 77.6 + driver_id * 0.001)
+    snapshot.remove(3)
+    snapshot.remove(7)
+    assert 3 not in snapshot and len(snapshot) == 8
+    assert 3 not in [d for d, _ in snapshot.nearest(12.9, 77.603, 10, 5.0)]
+
+    snapshot.upsert(42, 12.9, 77.603)
+    assert snapshot.position(42) == (12.9, 77.603)
+    assert snapshot.nearest(12.9, 77.603, 1, 5.0)[0][0] == 42
+
+
+def test_unknown_vehicle_type_matches_nothing():
+    snapshot = DriverSnapshot()
+    snapshot.upsert(1, 12.9, 77.6, "cab")
+    assert snapshot.nearest(12.9, 77.6, 5, 5.0, vehicle_types={"boat"}) == []
+
+
+def test_clear():
+    snapshot = DriverSnapshot()
+    snapshot.upsert(1, 12.9, 77.6)
+    snapshot.clear()
+    assert len(snapshot) == 0
+    assert snapshot.nearest(12.9, 77.6, 5, 5.0) == []
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from database.models import ClientEndpoint
+from services.endpoints import (ENDPOINTS_CHANNEL, TRANSPORT_HTTP, TRANSPORT_WEB, EndpointRegistry,
+                                register_endpoint)
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    ClientEndpoint.__table__.create(engine)
+    engine.queries = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: engine.queries.append(statement))
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    with Session(engine) as session:
+        yield session
+
+
+def changes(db):
+    return [payload for name, payload in db.info.get("notifies", []) if name == ENDPOINTS_CHANNEL]
+
+
+def test_register_upserts_and_announces_changes(db):
+    register_endpoint(db, "driver", 1, TRANSPORT_HTTP, "http://localhost:9001")
+    # Same endpoint again in the same transaction: one row, no second announcement
+    register_endpoint(db, "driver", 1, TRANSPORT_HTTP, "http://localhost:9001")
+    assert db.query(ClientEndpoint).count() == 1
+    assert changes(db) == [{"role": "driver", "client_id": 1}]
+
+    # Web clients have nowhere to be pushed
+    endpoint = register_endpoint(db, "driver", 1, TRANSPORT_WEB, "http://ignored")
+    assert (endpoint.transport, endpoint.callback_url) == (TRANSPORT_WEB, None)
+    assert len(changes(db)) == 2
+
+
+def test_register_rejects_bad_endpoints(db):
+    with pytest.raises(ValueError):
+        register_endpoint(db, "user", 1, "carrier-pigeon")
+    with pytest.raises(ValueError):
+        register_endpoint(db, "user", 1, TRANSPORT_HTTP)
+
+
+def test_lookup_many_queries_only_misses(engine, db):
+    register_endpoint(db, "driver", 1, TRANSPORT_HTTP, "http://localhost:9001")
+    register_endpoint(db, "user", 5, TRANSPORT_WEB)
+    db.flush()
+    registry = EndpointRegistry(ttl_seconds=60)
+
+    engine.queries.clear()
+    found = registry.lookup_many(db, [("driver", 1), ("driver", 2), ("user", 5)])
+    assert found == {
+        ("driver", 1): {"transport": TRANSPORT_HTTP, "url": "http://localhost:9001"},
+        ("driver", 2): None,
+        ("user", 5): {"transport": TRANSPORT_WEB, "url": None},
+    }
+    # One query per role
+    assert len(engine.queries) == 2
+
+    # Unregistered clients are cached too
+    engine.queries.clear()
+    assert registry.lookup_many(db, [("driver", 1), ("driver", 2)])[("driver", 2)] is None
+    assert engine.queries == []
+
+
+def test_changes_and_expiry_drop_cached_entries(db, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("services.endpoints.time.monotonic", lambda: now[0])
+    registry = EndpointRegistry(ttl_seconds=60)
+    registry.remember("driver", 1, TRANSPORT_HTTP, "http://localhost:9001")
+    register_endpoint(db, "driver", 1, TRANSPORT_WEB)
+    assert registry.lookup_many(db, [("driver", 1)])[("driver", 1)]["transport"] == TRANSPORT_HTTP
+
+    registry.on_change({"role": "driver", "client_id": 1})
+    assert registry.lookup_many(db, [("driver", 1)])[("driver", 1)]["transport"] == TRANSPORT_WEB
+
+    registry.remember("driver", 1, TRANSPORT_HTTP, "http://localhost:9001")
+    now[0] += 61
+    assert registry.lookup_many(db, [("driver", 1)])[("driver", 1)]["transport"] == TRANSPORT_WEB
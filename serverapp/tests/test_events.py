@@ -0,0 +1,76 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from services.events import EventListener, notify, notify_matcher, subscribe_local
+
+
+class FakeNotify:
+    def __init__(self, channel, payload):
+        self.channel = channel
+        self.payload = payload
+
+
+class FakeConnection:
+    """psycopg2 connection stand-in: poll() is a no-op, notifies are queued by the test"""
+
+    def __init__(self):
+        self.notifies = []
+
+    def poll(self):
+        pass
+
+
+def test_local_handlers_run_on_commit_only():
+    got = []
+    subscribe_local("test_commit", got.append)
+    with Session(create_engine("sqlite://")) as db:
+        notify(db, "test_commit", ride_id=1)
+        assert got == []
+        db.commit()
+        assert got == [{"ride_id": 1}]
+
+        notify(db, "test_commit", ride_id=2)
+        db.rollback()
+        db.commit()
+        assert got == [{"ride_id": 1}]
+
+
+def test_savepoint_rollback_keeps_outer_notifications():
+    got = []
+    subscribe_local("test_savepoint", got.append)
+    with Session(create_engine("sqlite://")) as db:
+        notify(db, "test_savepoint", step="outer")
+        savepoint = db.begin_nested()
+        savepoint.rollback()
+        db.commit()
+        assert got == [{"step": "outer"}]
+
+
+def test_notify_matcher_payload():
+    with Session(create_engine("sqlite://")) as db:
+        notify_matcher(db, "ride_created", ride_id=5)
+        assert db.info["notifies"] == [("velo_matcher", {"reason": "ride_created", "ride_id": 5})]
+
+
+def test_listener_dispatches_and_wakes():
+    listener = EventListener(create_engine("sqlite://"), "a", "quiet")
+    seen = []
+    listener.add_handler("a", seen.append)
+    listener.add_handler("quiet", seen.append, wake=False)
+    listener._conn = FakeConnection()
+
+    listener._conn.notifies.append(FakeNotify("quiet", '{"online": [1]}'))
+    listener._on_readable()
+    assert seen == [{"online": [1]}]
+    assert not listener._event.is_set()
+
+    listener._conn.notifies.append(FakeNotify("a", ""))
+    listener._on_readable()
+    assert seen == [{"online": [1]}, {}]
+    assert listener._event.is_set()
+
+
+def test_listener_disabled_off_postgres():
+    listener = EventListener(create_engine("sqlite://"), "a")
+    assert not listener.enabled
+    assert not listener.listening
@@ -0,0 +1,28 @@
+import pytest
+
+from services.geo import haversine_km, parse_location
+
+
+def test_parse_location():
+    assert parse_location("12.97,77.59") == (12.97, 77.59)
+    assert parse_location(" -33.5 , 151.2 ") == (-33.5, 151.2)
+
+
+@pytest.mark.parametrize("value", [None, "", "12.9", "a,b", "91,0", "0,181", 42])
+def test_parse_location_rejects_invalid(value):
+    assert parse_location(value) is None
+
+
+def test_haversine_known_distances():
+    assert haversine_km(12.97, 77.59, 12.97, 77.59) == 0
+    # One degree of latitude is ~111.2 km anywhere
+    assert haversine_km(0, 0, 1, 0) == pytest.approx(111.19, abs=0.01)
+    assert haversine_km(60, 10, 61, 10) == pytest.approx(111.19, abs=0.01)
+    # One degree of longitude shrinks with cos(latitude)
+    assert haversine_km(60, 10, 60, 11) == pytest.approx(55.6, abs=0.1)
+    # Bangalore -> Chennai
+    assert haversine_km(12.9716, 77.5946, 13.0827, 80.2707) == pytest.approx(290, abs=2)
+
+
+def test_haversine_is_symmetric():
+    assert haversine_km(12.9, 77.5, 13.1, 77.7) == pytest.approx(haversine_km(13.1, 77.7, 12.9, 77.5))
@@ -0,0 +1,128 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import httpx
+
+from services.liveness import LivenessService, driver_port, heartbeat_age
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def driver(driver_id, available=True, seconds_ago=None, details=None):
+    updated_at = None if seconds_ago is None else datetime.utcnow() - timedelta(seconds=seconds_ago)
+    return SimpleNamespace(driver_id=driver_id, available=available, updated_at=updated_at,
+                           vehicle_details=details)
+
+
+def with_transport(service, handler):
+    """Point the service's client at an in-process handler instead of localhost"""
+    service._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    service._semaphore = asyncio.Semaphore(service.max_concurrency)
+    return service
+
+
+def test_driver_port():
+    assert driver_port(driver(7)) == 7
+    assert driver_port(driver(7, details='{"port": 9001}')) == 9001
+    assert driver_port(driver(7, details="Toyota Etios - KA05")) == 7
+    assert driver_port(driver(7, details="{not json")) == 7
+
+
+def test_heartbeat_age():
+    now = datetime(2024, 1, 1, 12, 0, 30)
+    assert heartbeat_age(None, now) is None
+    assert heartbeat_age(datetime(2024, 1, 1, 12, 0, 0), now) == 30
+    # Postgres hands back aware UTC timestamps
+    assert heartbeat_age(datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc), now) == 30
+
+
+def test_probe_answer_decides():
+    def handler(request):
+        port = request.url.port
+        if port == 1:
+            return httpx.Response(200, json={"driver_id": "DRIVER-1", "is_available": True})
+        if port == 2:
+            return httpx.Response(200, json={"driver_id": "DRIVER-2", "is_available": False})
+        if port == 4:
+            return httpx.Response(200, json=["not", "a", "driver"])
+        # Someone else on the port
+        return httpx.Response(200, json={"driver_id": "DRIVER-99", "is_available": True})
+
+    async def scenario():
+        service = with_transport(LivenessService(), handler)
+        try:
+            return await service.check_many([driver(1), driver(2), driver(3, seconds_ago=300),
+                                             driver(4, seconds_ago=5)])
+        finally:
+            await service.aclose()
+
+    assert run(scenario()) == {1: True, 2: False, 3: False, 4: False}
+
+
+def test_unreachable_drivers_fall_back_to_heartbeat():
+    def handler(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    async def scenario():
+        service = with_transport(LivenessService(), handler)
+        try:
+            return await service.check_many([
+                driver(1, seconds_ago=5),
+                driver(2, seconds_ago=300),
+                driver(3),
+                driver(4, available=False, seconds_ago=5),
+            ])
+        finally:
+            await service.aclose()
+
+    assert run(scenario()) == {1: True, 2: False, 3: True, 4: False}
+
+
+def test_verdicts_are_cached_and_probes_shared():
+    probes = []
+
+    async def handler(request):
+        probes.append(request.url.port)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"driver_id": "DRIVER-1", "is_available": True})
+
+    async def scenario():
+        service = with_transport(LivenessService(ttl_seconds=60), handler)
+        try:
+            # Concurrent checks of one driver share a single probe
+            assert await asyncio.gather(service.check(driver(1)), service.check(driver(1))) == [True, True]
+            assert await service.check(driver(1)) is True
+            assert len(probes) == 1
+
+            service.invalidate(1)
+            assert service.cached(1) is None
+            assert await service.check(driver(1)) is True
+            assert len(probes) == 2
+        finally:
+            await service.aclose()
+
+    run(scenario())
+
+
+def test_heartbeat_clears_an_offline_verdict():
+    service = LivenessService(ttl_seconds=60)
+    service.set(1, True)
+    service.set(2, False)
+    service.record_heartbeat(1)
+    service.record_heartbeat(2)
+    assert service.cached(1) is True
+    assert service.cached(2) is None
+
+
+def test_cached_verdicts_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("services.liveness.time.monotonic", lambda: now[0])
+    service = LivenessService(ttl_seconds=10)
+    service.set(1, True)
+    now[0] += 9
+    assert service.cached(1) is True
+    now[0] += 2
+    assert service.cached(1) is None
@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from services.events import notify_list
+from services.location_buffer import LocationBuffer
+from services.presence import PresenceService
+
+
+def test_latest_ping_wins_until_flush():
+    buffer = LocationBuffer(min_move_meters=10)
+    assert buffer.record(1, 12.9, 77.5)
+    assert buffer.record(1, 12.91, 77.5)
+    assert buffer.latest(1) == "12.91,77.5"
+    assert buffer.take_dirty() == {1: (12.91, 77.5)}
+    assert buffer.take_dirty() == {}
+
+
+def test_small_moves_are_not_written():
+    buffer = LocationBuffer(min_move_meters=10)
+    buffer.record(1, 12.9, 77.5)
+    buffer.take_dirty()
+    # ~1 m: kept in memory, not queued
+    assert buffer.record(1, 12.90001, 77.5) is False
+    assert buffer.latest(1) == "12.90001,77.5"
+    assert buffer.take_dirty() == {}
+    # ~22 m from the last written position
+    assert buffer.record(1, 12.9002, 77.5) is True
+    assert buffer.take_dirty() == {1: (12.9002, 77.5)}
+
+
+def test_failed_flush_is_retried():
+    writes = []
+
+    def write_batch(moved):
+        writes.append(dict(moved))
+        if len(writes) == 1:
+            raise RuntimeError("database is down")
+
+    async def scenario():
+        buffer = LocationBuffer(min_move_meters=10)
+        buffer._write_batch = write_batch
+        buffer.record(1, 12.9, 77.5)
+        buffer.record(2, 13.0, 77.6)
+        await buffer.flush()
+        # Driver 1 moved again before the retry; driver 2 stays within min_move_meters
+        buffer.record(1, 12.91, 77.5)
+        assert buffer.record(2, 13.00001, 77.6) is False
+        await buffer.flush()
+        await buffer.flush()
+
+    asyncio.run(scenario())
+    assert writes == [{1: (12.9, 77.5), 2: (13.0, 77.6)}, {1: (12.91, 77.5), 2: (13.0, 77.6)}]
+
+
+def test_known_drivers_expire(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("services.location_buffer.time.monotonic", lambda: clock[0])
+    buffer = LocationBuffer(known_ttl_seconds=60)
+    buffer.mark_known([1, 2])
+    assert buffer.is_known(1) and not buffer.is_known(3)
+    clock[0] += 61
+    assert not buffer.is_known(1)
+
+
+def test_offline_drivers_are_forgotten(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("services.presence.time.monotonic", lambda: clock[0])
+    presence = PresenceService(ttl_seconds=30)
+    buffer = LocationBuffer(presence=presence)
+    buffer.mark_known([1])
+    buffer.record(1, 12.9, 77.5)
+    clock[0] += 31
+    presence.sweep()
+    assert buffer.latest(1) is None
+    assert not buffer.is_known(1)
+    # The move queued before going quiet is still written
+    assert buffer.take_dirty() == {1: (12.9, 77.5)}
+
+
+def test_notify_list_splits_under_payload_limit():
+    db = Session(create_engine("sqlite://"))
+    ids = list(range(1_000_000, 1_003_000))
+    notify_list(db, "velo_rides", "moved", ids)
+    notes = db.info["notifies"]
+    assert len(notes) > 1
+    # Postgres rejects NOTIFY payloads of 8000 bytes or more
+    assert all(len(json.dumps(payload)) < 8000 for _, payload in notes)
+    assert [i for _, payload in notes for i in payload["moved"]] == ids
+
+
+def test_notify_list_empty_sends_nothing():
+    db = Session(create_engine("sqlite://"))
+    notify_list(db, "velo_rides", "moved", [])
+    assert "notifies" not in db.info
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+import server
+from server import long_poll, response_version
+
+
+@pytest.fixture(autouse=True)
+def no_listener(monkeypatch):
+    # Tests wake the poll themselves instead of through LISTEN
+    monkeypatch.setattr(server.server_events, "start", lambda: None)
+
+
+class Source:
+    """A poll response that tests change, with the hub's subscribe/unsubscribe"""
+
+    def __init__(self, body):
+        self.body = body
+        self.reads = []
+        self.waiters = set()
+
+    async def read(self, replica):
+        self.reads.append(replica)
+        return dict(self.body)
+
+    def subscribe(self):
+        wake = asyncio.Event()
+        self.waiters.add(wake)
+        return wake
+
+    def unsubscribe(self, wake):
+        self.waiters.discard(wake)
+
+    def change(self, **body):
+        self.body = body
+        for wake in self.waiters:
+            wake.set()
+
+    def poll(self, wait, since):
+        return long_poll(self.read, wait, since, self.subscribe, self.unsubscribe)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_version_is_stable_and_content_based():
+    assert response_version({"a": 1, "b": 2}) == response_version({"b": 2, "a": 1})
+    assert response_version({"a": 1}) != response_version({"a": 2})
+
+
+def test_plain_poll_reads_the_replica():
+    source = Source({"status": "pending"})
+    body = run(source.poll(0, None))
+    assert body == {"status": "pending", "version": response_version({"status": "pending"})}
+    assert source.reads == [True]
+
+
+def test_stale_since_returns_at_once():
+    async def scenario():
+        source = Source({"status": "matched"})
+        started = asyncio.get_running_loop().time()
+        body = await source.poll(20, "old-version")
+        return source, body, asyncio.get_running_loop().time() - started
+
+    source, body, elapsed = run(scenario())
+    assert body["status"] == "matched"
+    assert elapsed < 1
+    # Held polls read the primary
+    assert source.reads == [False]
+    assert not source.waiters
+
+
+def test_change_wakes_the_poll_before_the_timeout():
+    async def scenario():
+        source = Source({"status": "pending"})
+        since = response_version(source.body)
+        poll = asyncio.ensure_future(source.poll(20, since))
+        await asyncio.sleep(0.01)
+        assert not poll.done()
+        source.change(status="matched")
+        return source, await asyncio.wait_for(poll, 1)
+
+    source, body = run(scenario())
+    assert body["status"] == "matched"
+    assert body["version"] == response_version({"status": "matched"})
+    assert not source.waiters
+
+
+def test_timeout_returns_the_unchanged_version():
+    async def scenario():
+        source = Source({"status": "pending"})
+        since = response_version(source.body)
+        started = asyncio.get_running_loop().time()
+        body = await source.poll(0.05, since)
+        return source, since, body, asyncio.get_running_loop().time() - started
+
+    source, since, body, elapsed = run(scenario())
+    assert body == {"status": "pending", "version": since}
+    assert 0.04 <= elapsed < 1
+    assert not source.waiters
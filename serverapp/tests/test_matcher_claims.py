@@ -0,0 +1,115 @@
+import random
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+import server_matcher
+from database.models import RideRequest
+from server_matcher import claim_pending_rides, ride_shard
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'velo.db'}")
+    RideRequest.__table__.create(engine)
+    return engine
+
+
+def add_rides(engine, locations, **fields):
+    with Session(engine) as db:
+        rides = [RideRequest(user_id=i, source_location=loc, dest_location="12.9,77.6", **fields)
+                 for i, loc in enumerate(locations)]
+        db.add_all(rides)
+        db.commit()
+        return [ride.id for ride in rides]
+
+
+def shard(monkeypatch, index, count):
+    monkeypatch.setattr(server_matcher, "MATCHER_SHARD_INDEX", index)
+    monkeypatch.setattr(server_matcher, "MATCHER_SHARD_COUNT", count)
+
+
+def test_ride_shard_follows_the_pickup_cell(monkeypatch):
+    shard(monkeypatch, 0, 4)
+    assert ride_shard("12.971,77.591") == ride_shard("12.972,77.592")
+    assert ride_shard("somewhere") == 0
+    rng = random.Random(1)
+    shards = {ride_shard(f"{rng.uniform(12.7, 13.2)},{rng.uniform(77.4, 77.8)}") for _ in range(500)}
+    assert shards == {0, 1, 2, 3}
+
+
+def test_shards_split_rides_without_overlap_or_gaps(engine, monkeypatch):
+    rng = random.Random(2)
+    ride_ids = add_rides(engine, [f"{rng.uniform(12.7, 13.2)},{rng.uniform(77.4, 77.8)}" for _ in range(60)]
+                         + ["no coordinates"])
+    claimed = []
+    for index in range(3):
+        shard(monkeypatch, index, 3)
+        with Session(engine) as db:
+            claimed.append({ride.id for ride in claim_pending_rides(db)})
+    assert all(claimed)
+    assert sum(len(ids) for ids in claimed) == len(ride_ids)
+    assert set().union(*claimed) == set(ride_ids)
+
+
+def test_claims_skip_rides_locked_by_another_worker(engine, monkeypatch):
+    shard(monkeypatch, 0, 1)
+    ride_ids = add_rides(engine, ["12.97,77.59"] * 4)
+    add_rides(engine, ["12.97,77.59"], status="broadcasting")
+
+    # SQLite has no row locks: stand in for Postgres' FOR UPDATE SKIP LOCKED,
+    # with rows locked until the claiming transaction ends
+    locked = {}
+
+    def worker():
+        db = Session(engine)
+
+        @event.listens_for(db, "do_orm_execute")
+        def skip_locked(state):
+            lock = state.statement._for_update_arg
+            if state.is_select and lock is not None and lock.skip_locked:
+                others = [ride_id for ride_id, holder in locked.items() if holder is not db]
+                rows = state.invoke_statement(
+                    statement=state.statement.where(RideRequest.id.notin_(others))
+                ).scalars().all()
+                for ride in rows:
+                    locked[ride.id] = db
+                return state.invoke_statement(statement=state.statement.where(
+                    RideRequest.id.in_([ride.id for ride in rows])
+                ))
+
+        @event.listens_for(db, "after_commit")
+        @event.listens_for(db, "after_rollback")
+        def unlock(db):
+            for ride_id in [ride_id for ride_id, holder in locked.items() if holder is db]:
+                del locked[ride_id]
+
+        return db
+
+    monkeypatch.setattr(server_matcher, "MATCHER_CLAIM_BATCH", 2)
+    first, second = worker(), worker()
+    first_claim = [ride.id for ride in claim_pending_rides(first)]
+    second_claim = [ride.id for ride in claim_pending_rides(second)]
+    assert first_claim == ride_ids[:2]
+    assert second_claim == ride_ids[2:]
+
+    # Once the first worker's tick ends, its unmatched rides can be claimed again
+    first.rollback()
+    second.rollback()
+    assert [ride.id for ride in claim_pending_rides(second)] == ride_ids[:2]
+    first.close()
+    second.close()
+
+
+def test_claim_query_skips_locked_rows_on_postgres(engine):
+    captured = []
+    with Session(engine) as db:
+        @event.listens_for(db, "do_orm_execute")
+        def capture(state):
+            captured.append(state.statement)
+
+        claim_pending_rides(db)
+    sql = str(captured[-1].compile(dialect=postgresql.dialect()))
+    assert sql.endswith("FOR UPDATE SKIP LOCKED")
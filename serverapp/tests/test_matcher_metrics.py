@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+import server_matcher
+from database.connections import Base
+from database.models import DriverInfo, MatchedRide, RideRequest
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'velo.db'}")
+    Base.metadata.create_all(engine)
+    sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(server_matcher, "SessionLocal", sessions)
+    monkeypatch.setattr(server_matcher, "MATCHER_SHARD_COUNT", 1)
+    # Drivers in these tests run no client to probe: take their heartbeat
+    monkeypatch.setattr(server_matcher, "is_present", lambda driver_id: True)
+    return sessions
+
+
+def test_tick_records_latency_and_matches(sessions):
+    mode = server_matcher.MATCHER_ASSIGNMENT_MODE
+    with sessions() as db:
+        db.add_all([
+            RideRequest(user_id=5, source_location="12.9716,77.5946", dest_location="12.93,77.62"),
+            RideRequest(user_id=6, source_location="12.9720,77.5950", dest_location="12.95,77.60"),
+            DriverInfo(driver_id=41, available=True, current_location="12.9717,77.5947",
+                       updated_at=datetime.utcnow()),
+        ])
+        db.commit()
+
+    ticks = sample("velo_matcher_tick_seconds_count", mode=mode)
+    tick_time = sample("velo_matcher_tick_seconds_sum", mode=mode)
+    matches = sample("velo_matches_created_total", mode=mode)
+    waits = sample("velo_time_to_match_seconds_count")
+
+    assigned = asyncio.run(server_matcher.match_pending("test"))
+
+    # One driver for two rides: one match, the other ride waits
+    assert [driver_id for _, driver_id, _ in assigned] == [41]
+    assert sample("velo_matcher_tick_seconds_count", mode=mode) == ticks + 1
+    assert sample("velo_matcher_tick_seconds_sum", mode=mode) > tick_time
+    assert sample("velo_matches_created_total", mode=mode) == matches + 1
+    assert sample("velo_time_to_match_seconds_count") == waits + 1
+    assert sample("velo_pending_rides") == 2
+    with Session(sessions.kw["bind"]) as db:
+        assert db.query(MatchedRide).count() == 1
+
+
+def test_empty_tick_is_timed_without_matches(sessions):
+    mode = server_matcher.MATCHER_ASSIGNMENT_MODE
+    ticks = sample("velo_matcher_tick_seconds_count", mode=mode)
+    matches = sample("velo_matches_created_total", mode=mode)
+    assert asyncio.run(server_matcher.match_pending("test")) == []
+    assert sample("velo_matcher_tick_seconds_count", mode=mode) == ticks + 1
+    assert sample("velo_matches_created_total", mode=mode) == matches
+    assert sample("velo_pending_rides") == 0
@@ -0,0 +1,115 @@
+import math
+import random
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from database.models import DriverInfo
+from services.geo import haversine_km
+from services.nearby import DatabaseDriverIndex, _nearest_by_planar_distance, nearest_available_drivers
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    DriverInfo.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def add_driver(db, driver_id, lat, lng, **fields):
+    db.add(DriverInfo(driver_id=driver_id, current_lat=lat, current_lng=lng, **fields))
+    db.flush()
+
+
+def test_sqlite_nearest_first(db):
+    add_driver(db, 1, 12.99, 77.60)
+    add_driver(db, 2, 12.975, 77.60)
+    add_driver(db, 3, 13.05, 77.60)
+    add_driver(db, 4, 12.97, 77.61, available=False)
+    add_driver(db, 5, 12.97, 77.59, vehicle_type="moto")
+
+    found = nearest_available_drivers(db, 12.97, 77.60, k=3)
+    assert [row[0] for row in found] == [2, 5, 1]
+    assert found[1][1] == pytest.approx(haversine_km(12.97, 77.60, 12.97, 77.59))
+    assert found[1][2:] == (12.97, 77.59)
+
+    assert [row[0] for row in nearest_available_drivers(db, 12.97, 77.60, k=5, radius_km=3)] == [2, 5, 1]
+    assert [row[0] for row in nearest_available_drivers(db, 12.97, 77.60, k=5, vehicle_types=["auto"])] == [2, 1, 3]
+    assert [row[0] for row in nearest_available_drivers(db, 12.97, 77.60, k=2, exclude=[5])] == [2, 1]
+    assert nearest_available_drivers(db, 12.97, 77.60, k=5, safe_only=True) == []
+    assert nearest_available_drivers(db, 12.97, 77.60, k=0) == []
+
+
+def test_database_driver_index_remembers_positions(db):
+    add_driver(db, 1, 12.98, 77.60)
+    index = DatabaseDriverIndex()
+    index.bind(db)
+    assert [driver_id for driver_id, _ in index.nearest(12.97, 77.60, k=2, radius_km=5)] == [1]
+    assert index.position(1) == (12.98, 77.60)
+
+    index.bind(db)
+    assert index.position(1) is None
+
+
+class PlanarQuery:
+    """Stands in for the GiST-ordered query: rows sorted by distance in raw degrees"""
+
+    def __init__(self, drivers, lat, lng):
+        self.rows = sorted(
+            ((driver_id, d_lat, d_lng, math.hypot(d_lat - lat, d_lng - lng))
+             for driver_id, d_lat, d_lng in drivers),
+            key=lambda row: (row[3], row[0])
+        )
+        self.limits = []
+
+    def add_columns(self, column):
+        return self
+
+    def order_by(self, column):
+        return self
+
+    def limit(self, n):
+        self.limits.append(n)
+        self._limit = n
+        return self
+
+    def all(self):
+        return self.rows[:self._limit]
+
+
+def brute_force(drivers, lat, lng, k, radius_km):
+    ranked = sorted((haversine_km(lat, lng, d_lat, d_lng), driver_id) for driver_id, d_lat, d_lng in drivers)
+    return [driver_id for dist, driver_id in ranked if radius_km is None or dist <= radius_km][:k]
+
+
+@pytest.mark.parametrize("lat", [0.0, 45.0, 64.0])
+def test_planar_order_finds_the_true_nearest(lat):
+    rng = random.Random(lat)
+    for _ in range(50):
+        drivers = [(i, lat + rng.uniform(-0.2, 0.2), rng.uniform(-0.2, 0.2)) for i in range(300)]
+        k = rng.choice([1, 5, 20])
+        radius_km = rng.choice([None, 5.0])
+        query = PlanarQuery(drivers, lat, 0.0)
+        found = _nearest_by_planar_distance(query, lat, 0.0, k, radius_km)
+        assert [row[0] for row in found] == brute_force(drivers, lat, 0.0, k, radius_km)
+
+
+def test_planar_fetch_grows_until_proven():
+    # A crowd due north is nearer in degrees than the drivers due east,
+    # which at 60° are nearer on the ground
+    north = [(i, 60.01, 0.0) for i in range(100)]
+    east = [(1000 + i, 60.0, 0.015) for i in range(3)]
+    query = PlanarQuery(north + east, 60.0, 0.0)
+    found = _nearest_by_planar_distance(query, 60.0, 0.0, 3, None)
+    assert [row[0] for row in found] == [1000, 1001, 1002]
+    assert query.limits == [12, 48, 192]
+
+
+def test_planar_fetch_stops_once_proven():
+    drivers = [(i, 60.0, 0.001 * (i + 1)) for i in range(100)]
+    query = PlanarQuery(drivers, 60.0, 0.0)
+    found = _nearest_by_planar_distance(query, 60.0, 0.0, 3, None)
+    assert [row[0] for row in found] == [0, 1, 2]
+    assert query.limits == [12]
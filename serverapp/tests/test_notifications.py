@@ -0,0 +1,106 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from services.endpoints import TRANSPORT_GATEWAY, TRANSPORT_HTTP, TRANSPORT_WEB
+from services.notifications import DRIVER_ATTEMPTS, NotificationClient, build_payload
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr("services.notifications.RETRY_BACKOFF_SECONDS", 0)
+
+
+def payload(user_endpoint=None, driver_endpoint=None, user_id=5, driver_port=7):
+    match = SimpleNamespace(id=1, user_id=user_id, driver_id=7)
+    ride = SimpleNamespace(id=2, source_location="a", dest_location="b", ride_type="auto", fare=80)
+    driver = SimpleNamespace(driver_id=driver_port, current_location="c", vehicle_details=None)
+    return build_payload(match, ride, driver, user_endpoint, driver_endpoint)
+
+
+def deliver(handler, payload):
+    async def scenario():
+        client = NotificationClient()
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await client.deliver(payload)
+        finally:
+            await client.aclose()
+
+    return run(scenario())
+
+
+def test_payload_falls_back_to_the_legacy_port():
+    built = payload()
+    assert built["user_endpoint"] == {"transport": None, "url": "http://localhost:5"}
+    assert built["driver_endpoint"] == {"transport": None, "url": "http://localhost:7"}
+    assert built["fare"] == 80
+
+    # No usable port: nothing to probe, the client polls
+    assert payload(user_id=70000)["user_endpoint"] == {"transport": TRANSPORT_WEB, "url": None}
+
+    registered = {"transport": TRANSPORT_HTTP, "url": "http://rider"}
+    assert payload(user_endpoint=registered)["user_endpoint"] is registered
+
+
+def test_registered_clients_are_pushed_without_probing():
+    requests = []
+
+    def handler(request):
+        requests.append((request.method, str(request.url)))
+        return httpx.Response(200)
+
+    result = deliver(handler, payload(
+        user_endpoint={"transport": TRANSPORT_WEB, "url": None},
+        driver_endpoint={"transport": TRANSPORT_HTTP, "url": "http://driver"},
+    ))
+    assert result == {"user": True, "driver": True, "web": True, "learned": {}}
+    assert requests == [("POST", "http://driver/ride/assigned")]
+
+
+def test_unregistered_clients_are_probed_and_learned():
+    def handler(request):
+        if request.url.port == 5:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200)
+
+    result = deliver(handler, payload())
+    assert result["user"] and result["driver"]
+    assert result["learned"] == {"user": TRANSPORT_WEB, "driver": TRANSPORT_HTTP}
+
+
+def test_driver_push_retries_then_gives_up():
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.url.path)
+        return httpx.Response(500)
+
+    result = deliver(handler, payload(
+        user_endpoint={"transport": TRANSPORT_WEB, "url": None},
+        driver_endpoint={"transport": TRANSPORT_HTTP, "url": "http://driver"},
+    ))
+    assert result["driver"] is False
+    assert len(attempts) == DRIVER_ATTEMPTS
+
+
+def test_push_to_a_gateway_without_the_socket_falls_back_to_the_mailbox():
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.url.path)
+        return httpx.Response(404)
+
+    result = deliver(handler, payload(
+        user_endpoint={"transport": TRANSPORT_WEB, "url": None},
+        driver_endpoint={"transport": TRANSPORT_GATEWAY, "url": "http://api/gateway/7"},
+    ))
+    # Not a driver failure: the offer is announced for the worker holding the socket
+    assert result["driver"] is True and result["web"] is True
+    assert len(attempts) == 1
@@ -0,0 +1,56 @@
+import pytest
+
+from services.offer_mailbox import OfferMailbox
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("services.offer_mailbox.time.monotonic", lambda: now[0])
+    return now
+
+
+def offer(match_id, driver_id):
+    return {"match_id": match_id, "driver_id": driver_id, "ride_id": 1}
+
+
+def test_fill_then_hit(clock):
+    mailbox = OfferMailbox(is_live=lambda: True, ttl_seconds=30)
+    assert mailbox.get(1) == (False, None)
+    mailbox.fill(1, None, mailbox.version())
+    assert mailbox.get(1) == (True, None)
+    clock[0] += 31
+    assert mailbox.get(1) == (False, None)
+
+
+def test_fill_dropped_if_an_event_raced_the_read(clock):
+    mailbox = OfferMailbox(is_live=lambda: True)
+    version = mailbox.version()
+    mailbox.on_event({"offered": offer(7, 1)})
+    mailbox.fill(1, None, version)
+    assert mailbox.get(1) == (True, offer(7, 1))
+
+
+def test_offer_closed_empties_the_box(clock):
+    mailbox = OfferMailbox(is_live=lambda: True)
+    mailbox.on_event({"offered": offer(7, 1)})
+    mailbox.on_event({"match_ids": [7], "driver_ids": [1]})
+    assert mailbox.get(1) == (True, None)
+
+
+def test_unexpected_close_forgets_the_box(clock):
+    mailbox = OfferMailbox(is_live=lambda: True)
+    mailbox.on_event({"offered": offer(7, 1)})
+    mailbox.on_event({"match_ids": [8], "driver_ids": [1]})
+    assert mailbox.get(1) == (False, None)
+
+
+def test_not_live_always_misses(clock):
+    live = [True]
+    mailbox = OfferMailbox(is_live=lambda: live[0])
+    mailbox.on_event({"offered": offer(7, 1)})
+    live[0] = False
+    assert mailbox.get(1) == (False, None)
+    assert len(mailbox) == 0
+    mailbox.fill(1, None, mailbox.version())
+    assert len(mailbox) == 0
@@ -0,0 +1,159 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from database.models import MatchedRide, RideRequest
+from services.offers import (OFFERS_CHANNEL, announce_offered, expire_offers, requeue_if_no_offers,
+                             withdraw_other_offers)
+from services.ride_status import RIDES_CHANNEL
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    RideRequest.__table__.create(engine)
+    MatchedRide.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def broadcast(db, driver_ids, status="broadcasting", created_at=None):
+    """A ride with one open offer per driver; returns (ride, offers)"""
+    ride = RideRequest(user_id=5, source_location="a", dest_location="b", status=status)
+    db.add(ride)
+    db.flush()
+    offers = [
+        MatchedRide(user_id=5, driver_id=driver_id, ride_id=ride.id, status="offered",
+                    created_at=created_at or datetime.utcnow())
+        for driver_id in driver_ids
+    ]
+    db.add_all(offers)
+    db.flush()
+    return ride, offers
+
+
+def queued(db, channel):
+    return [payload for name, payload in db.info.get("notifies", []) if name == channel]
+
+
+def test_first_accept_withdraws_the_rest(db):
+    ride, (winner, *losers) = broadcast(db, [1, 2, 3])
+    assert sorted(withdraw_other_offers(db, ride.id, winner.id)) == [2, 3]
+    assert winner.status == "offered"
+    assert [offer.status for offer in losers] == ["withdrawn", "withdrawn"]
+    closed = queued(db, OFFERS_CHANNEL)
+    assert closed == [{"match_ids": [offer.id for offer in losers], "driver_ids": [2, 3]}]
+
+    # Nothing left to withdraw, nothing announced
+    assert withdraw_other_offers(db, ride.id, winner.id) == []
+    assert len(queued(db, OFFERS_CHANNEL)) == 1
+
+
+def test_expire_by_id_and_age(db):
+    old = datetime.utcnow() - timedelta(minutes=5)
+    _, (stale,) = broadcast(db, [1], created_at=old)
+    _, (fresh, accepted) = broadcast(db, [2, 3])
+    accepted.status = "accepted"
+    db.flush()
+
+    rows = expire_offers(db, created_before=datetime.utcnow() - timedelta(minutes=1))
+    assert [(row.id, row.driver_id) for row in rows] == [(stale.id, 1)]
+
+    rows = expire_offers(db, match_ids=[fresh.id, accepted.id, stale.id])
+    assert [row.id for row in rows] == [fresh.id]
+    db.expire_all()
+    assert [stale.status, fresh.status, accepted.status] == ["declined", "declined", "accepted"]
+
+
+def test_requeue_once_the_last_offer_is_gone(db):
+    ride, (first, second) = broadcast(db, [1, 2])
+    first.status = "declined"
+    db.flush()
+    assert requeue_if_no_offers(db, ride.id) is False
+    # The offer being closed right now doesn't count
+    assert requeue_if_no_offers(db, ride.id, exclude_match_id=second.id) is True
+    db.expire_all()
+    assert ride.status == "pending"
+    assert queued(db, RIDES_CHANNEL) == [{"user_id": 5}]
+
+
+def test_concurrent_last_declines_requeue_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'velo.db'}")
+    RideRequest.__table__.create(engine)
+    MatchedRide.__table__.create(engine)
+    with Session(engine) as setup:
+        ride, offers = broadcast(setup, [1, 2])
+        ride_id, match_ids = ride.id, [offer.id for offer in offers]
+        setup.commit()
+
+    # SQLite has no row locks: stand in for Postgres' FOR UPDATE on the ride row,
+    # held until the transaction ends, as under READ COMMITTED
+    ride_lock = threading.Lock()
+    a_checked, b_waiting = threading.Event(), threading.Event()
+
+    def session():
+        db = Session(engine, autoflush=False)
+
+        @event.listens_for(db, "do_orm_execute")
+        def lock_rows(state):
+            if state.is_select and state.statement._for_update_arg is not None:
+                if db.info.get("thread") == "b":
+                    b_waiting.set()
+                ride_lock.acquire()
+                db.info["locked"] = True
+
+        @event.listens_for(db, "after_commit")
+        def unlock(db):
+            if db.info.pop("locked", False):
+                ride_lock.release()
+
+        return db
+
+    results = {}
+
+    def decline(name, match_id):
+        with session() as db:
+            db.info["thread"] = name
+            if name == "b":
+                a_checked.wait(5)
+            # The decline is uncommitted, so invisible to the other transaction
+            db.get(MatchedRide, match_id).status = "declined"
+            results[name] = requeue_if_no_offers(db, ride_id, exclude_match_id=match_id)
+            if name == "a":
+                a_checked.set()
+                # Commit only once B has checked too, or is blocked on the ride lock
+                b_waiting.wait(5)
+            else:
+                b_waiting.set()
+            db.commit()
+
+    threads = [threading.Thread(target=decline, args=args) for args in (("a", match_ids[0]), ("b", match_ids[1]))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert results == {"a": False, "b": True}
+    with Session(engine) as db:
+        assert db.get(RideRequest, ride_id).status == "pending"
+
+
+def test_accepted_ride_is_not_requeued(db):
+    ride, _ = broadcast(db, [], status="matched")
+    assert requeue_if_no_offers(db, ride.id) is False
+    assert requeue_if_no_offers(db, None) is False
+    db.expire_all()
+    assert ride.status == "matched"
+    assert queued(db, RIDES_CHANNEL) == []
+
+
+def test_announce_offered_sends_only_offer_fields(db):
+    offer = {"match_id": 1, "ride_id": 2, "user_id": 5, "driver_id": 3, "pickup_location": "a",
+             "dropoff_location": "b", "ride_type": "auto", "fare": 80, "otp": "1234"}
+    announce_offered(db, offer)
+    (payload,) = queued(db, OFFERS_CHANNEL)
+    assert "otp" not in payload["offered"]
+    assert payload["offered"]["fare"] == 80
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.models import NotificationOutbox
+from services import outbox
+from services.outbox import backoff_seconds, schedule_retry
+
+
+def test_backoff_doubles_then_caps(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_BACKOFF_SECONDS", 2.0)
+    monkeypatch.setattr(outbox, "OUTBOX_BACKOFF_MAX_SECONDS", 60.0)
+    assert [backoff_seconds(n) for n in range(1, 8)] == [2, 4, 8, 16, 32, 60, 60]
+
+
+def test_retry_is_scheduled_after_backoff(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    entry = NotificationOutbox(match_id=1, ride_id=1, status="pending", attempts=2)
+    before = datetime.utcnow()
+    assert schedule_retry(entry, "connection refused") is True
+    assert entry.status == "pending"
+    assert entry.last_error == "connection refused"
+    delay = (entry.next_attempt_at - before).total_seconds()
+    assert delay == pytest.approx(backoff_seconds(2), abs=1)
+
+
+def test_dead_letter_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    entry = NotificationOutbox(match_id=1, ride_id=1, status="pending", attempts=3,
+                               next_attempt_at=datetime.utcnow() - timedelta(seconds=1))
+    assert schedule_retry(entry, "timeout") is False
+    assert entry.status == "dead"
+    assert "3 attempts" in entry.last_error and "timeout" in entry.last_error
+
+
+def test_mark_delivered_and_skipped():
+    delivered = NotificationOutbox(match_id=1, ride_id=1, status="pending")
+    outbox.mark_delivered(delivered)
+    assert delivered.status == "delivered" and delivered.delivered_at is not None
+
+    skipped = NotificationOutbox(match_id=2, ride_id=1, status="pending")
+    outbox.mark_skipped(skipped, "offer withdrawn")
+    assert skipped.status == "skipped" and skipped.last_error == "offer withdrawn"
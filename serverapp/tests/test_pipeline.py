@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import server_pipeline as pipeline
+from services.events import notify_matcher
+
+
+@pytest.fixture(autouse=True)
+def fresh_queues(monkeypatch):
+    # asyncio queues belong to the loop that first waits on them: one per test
+    monkeypatch.setattr(pipeline, "intake_queue", asyncio.Queue(maxsize=2))
+    monkeypatch.setattr(pipeline, "offer_queue", asyncio.Queue(maxsize=2))
+    monkeypatch.setattr(pipeline, "_loop", None)
+
+
+def run_stage(stage, until, timeout=1.0):
+    """Run one stage until until() holds, then stop it"""
+    async def scenario():
+        task = asyncio.ensure_future(stage())
+        try:
+            deadline = asyncio.get_running_loop().time() + timeout
+            while not until():
+                assert asyncio.get_running_loop().time() < deadline, "stage did not hand off"
+                await asyncio.sleep(0.005)
+        finally:
+            task.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_intake_hands_events_to_match(monkeypatch):
+    woken = iter([True, False])
+
+    async def wait(timeout):
+        return next(woken, False)
+
+    monkeypatch.setattr(pipeline.matcher.matcher_events, "wait", wait)
+    run_stage(pipeline.intake_stage, lambda: pipeline.intake_queue.qsize() == 2)
+    assert [pipeline.intake_queue.get_nowait() for _ in range(2)] == ["event", "sweep"]
+
+
+def test_match_runs_one_tick_per_batch_and_hands_offers_on(monkeypatch):
+    ticks = []
+
+    async def match_pending(reason):
+        ticks.append(reason)
+        return [(7, 1, 2.0), (8, 2, 3.5)]
+
+    monkeypatch.setattr(pipeline.matcher, "match_pending", match_pending)
+    pipeline.intake_queue.put_nowait("ride_created")
+    pipeline.intake_queue.put_nowait("driver_available")
+    run_stage(pipeline.match_stage, lambda: not pipeline.offer_queue.empty())
+    # Wakeups queued before the tick are covered by it
+    assert ticks == ["ride_created"]
+    assert pipeline.offer_queue.get_nowait() == [7, 8]
+
+
+def test_notify_delivers_as_soon_as_offers_arrive(monkeypatch):
+    batches = []
+
+    async def deliver_due(semaphore):
+        batches.append(True)
+        # One full batch, then done
+        return pipeline.notifier.NOTIFIER_BATCH if len(batches) == 1 else 0
+
+    monkeypatch.setattr(pipeline.notifier, "deliver_due", deliver_due)
+    monkeypatch.setattr(pipeline.notifier, "NOTIFIER_POLL_SECONDS", 60)
+    pipeline.offer_queue.put_nowait([7])
+    run_stage(pipeline.notify_stage, lambda: len(batches) == 2)
+    assert pipeline.offer_queue.empty()
+
+
+def test_requeued_rides_reach_intake_once():
+    async def scenario():
+        pipeline._loop = asyncio.get_running_loop()
+        with Session(create_engine("sqlite://")) as db:
+            notify_matcher(db, "ride_requeued", ride_id=3)
+            db.commit()
+        await asyncio.sleep(0)
+        return [pipeline.intake_queue.get_nowait() for _ in range(pipeline.intake_queue.qsize())]
+
+    # Without LISTEN (SQLite) the local handler is the only path
+    assert not pipeline.matcher.matcher_events.enabled
+    assert asyncio.run(scenario()) == ["ride_requeued"]
+
+
+def test_full_intake_drops_extra_wakeups():
+    pipeline._put_intake("a")
+    pipeline._put_intake("b")
+    pipeline._put_intake("c")
+    assert pipeline.intake_queue.qsize() == 2
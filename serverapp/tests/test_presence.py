@@ -0,0 +1,61 @@
+import pytest
+
+from services.presence import PresenceService
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("services.presence.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_transitions(clock):
+    presence = PresenceService(ttl_seconds=30)
+    presence.beat(1)
+    presence.beat(2)
+    presence.beat(1)
+    assert len(presence) == 2
+    assert presence.take_changes(snapshot=False) == ([], [1, 2], [])
+
+    clock[0] += 20
+    presence.beat(2)
+    clock[0] += 15
+    presence.sweep()
+    assert len(presence) == 1
+    assert presence.take_changes(snapshot=False) == ([], [], [1])
+
+    # Coming back is a new transition
+    presence.beat(1)
+    assert presence.take_changes(snapshot=False) == ([], [1], [])
+
+
+def test_snapshot_reannounces_drivers_seen_since_the_last_one(clock):
+    presence = PresenceService(ttl_seconds=30)
+    presence.beat(1)
+    presence.beat(2)
+    assert presence.take_changes(snapshot=True) == ([1, 2], [1, 2], [])
+
+    clock[0] += 10
+    presence.beat(2)
+    # Driver 1 is still online but hasn't beaten since: not re-announced
+    seen, online, offline = presence.take_changes(snapshot=True)
+    assert (seen, online, offline) == ([2], [2], [])
+
+
+def test_closing_announces_everyone_offline(clock):
+    presence = PresenceService(ttl_seconds=30)
+    presence.beat(1)
+    presence.beat(2)
+    presence.take_changes(snapshot=True)
+    assert presence.take_changes(snapshot=False, closing=True) == ([], [], [1, 2])
+
+
+def test_offline_handlers(clock):
+    presence = PresenceService(ttl_seconds=5)
+    gone = []
+    presence.add_offline_handler(gone.append)
+    presence.beat(1)
+    clock[0] += 6
+    presence.sweep()
+    assert gone == [1]
@@ -0,0 +1,134 @@
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+import server
+from database.connections import Base
+from database.models import DriverInfo, MatchedRide, RideRequest
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    url = f"sqlite:///{tmp_path / 'velo.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return url
+
+
+@pytest.fixture
+def api(db_url):
+    """Call the API in-process against its own SQLite file"""
+    async_engine = create_async_engine(db_url.replace("sqlite://", "sqlite+aiosqlite://"))
+    sessions = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def get_async_db():
+        async with sessions() as db:
+            yield db
+
+    server.app.dependency_overrides[server.get_async_db] = get_async_db
+
+    def call(*paths):
+        async def scenario():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app),
+                                         base_url="http://velo") as client:
+                return await asyncio.gather(*(client.post(path) for path in paths))
+
+        return asyncio.run(scenario())
+
+    yield call
+    server.app.dependency_overrides.pop(server.get_async_db, None)
+    asyncio.run(async_engine.dispose())
+
+
+def broadcast(db_url, driver_ids, status="offered"):
+    """A broadcasting ride with one offer per driver; returns (ride_id, match_ids)"""
+    with Session(create_engine(db_url)) as db:
+        ride = RideRequest(user_id=5, source_location="12.97,77.59", dest_location="12.93,77.62",
+                           status="broadcasting")
+        db.add(ride)
+        db.add_all([DriverInfo(driver_id=driver_id, available=True) for driver_id in driver_ids])
+        db.flush()
+        matches = [MatchedRide(user_id=5, driver_id=driver_id, ride_id=ride.id, status=status)
+                   for driver_id in driver_ids]
+        db.add_all(matches)
+        db.commit()
+        return ride.id, [match.id for match in matches]
+
+
+def statuses(db_url, ride_id):
+    with Session(create_engine(db_url)) as db:
+        ride = db.get(RideRequest, ride_id)
+        matches = db.scalars(select(MatchedRide).where(MatchedRide.ride_id == ride_id).order_by(MatchedRide.id))
+        return ride.status, [match.status for match in matches]
+
+
+def test_first_accept_wins_and_withdraws_the_rest(api, db_url):
+    ride_id, (first, second) = broadcast(db_url, [1, 2])
+    (won,) = api(f"/api/driver/1/accept-ride/{first}")
+    assert won.status_code == 200 and won.json()["status"] == "accepted"
+    assert statuses(db_url, ride_id) == ("matched", ["accepted", "withdrawn"])
+
+    # The withdrawn offer can't be accepted any more
+    (lost,) = api(f"/api/driver/2/accept-ride/{second}")
+    assert lost.status_code == 409
+    assert statuses(db_url, ride_id) == ("matched", ["accepted", "withdrawn"])
+
+
+def test_second_accept_loses(api, db_url):
+    ride_id, (first, second) = broadcast(db_url, [1, 2])
+    responses = api(f"/api/driver/1/accept-ride/{first}", f"/api/driver/2/accept-ride/{second}")
+    assert sorted(response.status_code for response in responses) == [200, 409]
+    ride_status, match_statuses = statuses(db_url, ride_id)
+    assert ride_status == "matched"
+    assert match_statuses.count("accepted") == 1
+
+    # Accepting the same offer twice doesn't issue a second OTP
+    winner = first if responses[0].status_code == 200 else second
+    driver_id = 1 if winner == first else 2
+    (again,) = api(f"/api/driver/{driver_id}/accept-ride/{winner}")
+    assert again.status_code == 409
+
+
+def test_decline_of_a_closed_offer_is_a_no_op(api, db_url):
+    ride_id, (first, second) = broadcast(db_url, [1, 2])
+    (declined,) = api(f"/api/driver/1/decline-ride/{first}")
+    assert declined.json() == {"status": "declined"}
+    # Driver 2 still holds an offer: the ride keeps broadcasting
+    assert statuses(db_url, ride_id) == ("broadcasting", ["declined", "offered"])
+
+    (again,) = api(f"/api/driver/1/decline-ride/{first}")
+    assert again.status_code == 200 and again.json() == {"status": "declined"}
+    assert statuses(db_url, ride_id) == ("broadcasting", ["declined", "offered"])
+
+    # The last decline puts the ride back in the queue
+    api(f"/api/driver/2/decline-ride/{second}")
+    assert statuses(db_url, ride_id) == ("pending", ["declined", "declined"])
+
+
+def test_decline_after_accept_keeps_the_accept(api, db_url):
+    ride_id, (first,) = broadcast(db_url, [1])
+    api(f"/api/driver/1/accept-ride/{first}")
+    (declined,) = api(f"/api/driver/1/decline-ride/{first}")
+    assert declined.json() == {"status": "accepted"}
+    assert statuses(db_url, ride_id) == ("matched", ["accepted"])
+
+
+def test_cancel_and_complete_free_the_driver(api, db_url):
+    ride_id, (first, second) = broadcast(db_url, [1, 2])
+    api(f"/api/driver/1/accept-ride/{first}")
+    (cancelled,) = api(f"/api/ride/{ride_id}/cancel")
+    assert cancelled.status_code == 200
+    assert statuses(db_url, ride_id) == ("cancelled", [])
+
+    ride_id, (match_id,) = broadcast(db_url, [3])
+    api(f"/api/driver/3/accept-ride/{match_id}")
+    (completed,) = api(f"/api/driver/3/complete-ride/{ride_id}")
+    assert completed.json() == {"status": "completed"}
+    assert statuses(db_url, ride_id) == ("completed", [])
+    with Session(create_engine(db_url)) as db:
+        assert all(db.scalars(select(DriverInfo.available).where(DriverInfo.driver_id.in_([1, 3]))))
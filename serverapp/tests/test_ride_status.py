@@ -0,0 +1,68 @@
+import asyncio
+
+from services.ride_status import RideStatusHub
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_rider_woken_by_own_status_and_watched_driver():
+    async def scenario():
+        hub = RideStatusHub()
+        rider = hub.subscribe(5)
+        other = hub.subscribe(6)
+        hub.watch_driver(5, 9)
+
+        hub.on_event({"user_id": 5})
+        await asyncio.sleep(0)
+        assert rider.is_set() and not other.is_set()
+
+        rider.clear()
+        hub.on_event({"moved": [1, 9, 12]})
+        await asyncio.sleep(0)
+        assert rider.is_set() and not other.is_set()
+
+        rider.clear()
+        hub.watch_driver(5, None)
+        hub.on_event({"moved": [9]})
+        await asyncio.sleep(0)
+        assert not rider.is_set()
+    run(scenario())
+
+
+def test_driver_long_polls_woken_by_rides_and_offers():
+    async def scenario():
+        hub = RideStatusHub()
+        driver = hub.subscribe_driver(9)
+        hub.on_event({"user_id": 5, "drivers": [9]})
+        await asyncio.sleep(0)
+        assert driver.is_set()
+
+        driver.clear()
+        hub.on_offer_event({"offered": {"driver_id": 9, "match_id": 1}})
+        await asyncio.sleep(0)
+        assert driver.is_set()
+
+        driver.clear()
+        hub.on_offer_event({"match_ids": [2], "driver_ids": [10]})
+        await asyncio.sleep(0)
+        assert not driver.is_set()
+    run(scenario())
+
+
+def test_unsubscribe_stops_watching():
+    async def scenario():
+        hub = RideStatusHub()
+        wake = hub.subscribe(5)
+        hub.watch_driver(5, 9)
+        hub.unsubscribe(5, wake)
+        assert hub._watchers == {} and hub._streams == {}
+    run(scenario())
+
+
+def test_events_before_any_stream_are_ignored():
+    # No loop captured yet: nothing to wake, and nothing may raise
+    hub = RideStatusHub()
+    hub.on_event({"user_id": 5})
+    hub.on_offer_event({"offered": {"driver_id": 1}})
@@ -0,0 +1,127 @@
+import random
+
+import numpy as np
+import pytest
+
+from services.geo import haversine_km
+from services.routing import INF, RoadGraph, Router
+
+N = 30
+STEP_DEG = 0.002
+
+
+@pytest.fixture(scope="module")
+def graph():
+    """N x N grid of streets with random travel times, a few of them one-way"""
+    rng = np.random.default_rng(0)
+    ii, jj = np.meshgrid(np.arange(N), np.arange(N), indexing="ij")
+    lat = (12.9 + ii * STEP_DEG).ravel()
+    lng = (77.5 + jj * STEP_DEG).ravel()
+    idx = ii * N + jj
+    src, dst = [], []
+    for a, b in ((idx[:-1, :], idx[1:, :]), (idx[:, :-1], idx[:, 1:])):
+        src += [a.ravel(), b.ravel()]
+        dst += [b.ravel(), a.ravel()]
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    keep = rng.random(len(src)) > 0.1
+    graph = RoadGraph(lat, lng, src[keep], dst[keep], rng.uniform(5, 30, keep.sum()).astype(np.float32))
+    graph.precompute_landmarks(4)
+    return graph
+
+
+def test_alt_matches_dijkstra(graph):
+    rng = random.Random(1)
+    for _ in range(100):
+        a, b = rng.randrange(len(graph)), rng.randrange(len(graph))
+        expected = graph.dijkstra(a, targets={b}).get(b, INF)
+        assert graph.travel_time(a, b) == pytest.approx(expected, rel=1e-6)
+
+
+def test_unreachable_target():
+    # 0 <-> 1, 2 -> 0 one-way, 3 <-> 4 disconnected
+    graph = RoadGraph([0] * 5, [0, 1, 2, 3, 4], [0, 1, 2, 3, 4], [1, 0, 0, 4, 3], [1.0] * 5)
+    graph.precompute_landmarks(3)
+    assert graph.travel_time(2, 1) == 2.0
+    assert graph.travel_time(0, 2) == INF
+    assert graph.travel_time(0, 4) == INF
+    assert graph.travel_time(3, 4) == 1.0
+
+
+def test_snap_matches_full_scan(graph):
+    rng = random.Random(2)
+    for _ in range(200):
+        lat = 12.9 + rng.uniform(-0.05, 0.11)
+        lng = 77.5 + rng.uniform(-0.05, 0.11)
+        node, km = graph.snap(lat, lng)
+        best = min(haversine_km(lat, lng, a, b) for a, b in zip(graph.lat, graph.lng))
+        assert km == pytest.approx(best, abs=1e-9)
+        assert km == pytest.approx(haversine_km(lat, lng, graph.lat[node], graph.lng[node]))
+
+
+def test_matrix_matches_pairwise_eta(graph):
+    router = Router(graph)
+    rng = random.Random(3)
+    point = lambda: (12.9 + rng.uniform(0, N * STEP_DEG), 77.5 + rng.uniform(0, N * STEP_DEG))
+    # Both orientations: fewer origins (forward searches) and fewer destinations (reverse)
+    for origins, destinations in (([point() for _ in range(3)], [point() for _ in range(7)]),
+                                  ([point() for _ in range(7)], [point() for _ in range(3)])):
+        matrix = router.matrix(origins, destinations)
+        for o, row in zip(origins, matrix):
+            for d, seconds in zip(destinations, row):
+                assert seconds == pytest.approx(router.eta(o, d), rel=1e-6)
+
+
+def test_matrix_max_seconds(graph):
+    router = Router(graph)
+    origin, near = (12.9, 77.5), (12.9 + STEP_DEG, 77.5)
+    far = (12.9 + (N - 1) * STEP_DEG, 77.5 + (N - 1) * STEP_DEG)
+    limit = router.eta(origin, near) + 1
+    assert router.eta(origin, far) > limit
+    [[to_near, to_far]] = router.matrix([origin], [near, far], max_seconds=limit)
+    assert to_near == pytest.approx(router.eta(origin, near))
+    assert to_far == INF
+
+
+def test_far_from_road_is_unreachable(graph):
+    router = Router(graph)
+    assert router.eta((12.9, 77.5), (13.5, 78.5)) == INF
+    assert router.many_to_one([(13.5, 78.5), (12.9, 77.5)], (12.9, 77.5))[0] == INF
+
+
+def test_off_road_leg_is_added(graph):
+    router = Router(graph)
+    node = 0
+    lat, lng = graph.lat[node] - 0.001, graph.lng[node] - 0.001
+    walk = haversine_km(lat, lng, graph.lat[node], graph.lng[node]) / router.off_road_speed_kmh * 3600
+    assert router.eta((lat, lng), (graph.lat[node], graph.lng[node])) == pytest.approx(walk)
+
+
+def test_alt_bound_never_overestimates():
+    # Long trips: float32 rounding of distances this large is worth seconds
+    rng = np.random.default_rng(3)
+    n = 400
+    src = np.concatenate([np.arange(n - 1), np.arange(1, n), rng.integers(0, n, 300)])
+    dst = np.concatenate([np.arange(1, n), np.arange(n - 1), rng.integers(0, n, 300)])
+    graph = RoadGraph(np.zeros(n), np.arange(n) * 0.01, src, dst,
+                      rng.uniform(1000, 5000, len(src)).astype(np.float32))
+    graph.precompute_landmarks(4)
+    for target in (0, n // 2, n - 1):
+        h = graph._alt_bound(target)
+        for v, d in graph.dijkstra(target, reverse=True).items():
+            assert h(v) <= d
+
+
+def test_float32_tables_from_old_graph_files_stay_admissible():
+    rng = np.random.default_rng(4)
+    n = 200
+    src = np.concatenate([np.arange(n - 1), np.arange(1, n), rng.integers(0, n, 150)])
+    dst = np.concatenate([np.arange(1, n), np.arange(n - 1), rng.integers(0, n, 150)])
+    graph = RoadGraph(np.zeros(n), np.arange(n) * 0.01, src, dst,
+                      rng.uniform(1000, 5000, len(src)).astype(np.float32))
+    graph.precompute_landmarks(4)
+    graph.lm_from = graph.lm_from.astype(np.float32)
+    graph.lm_to = graph.lm_to.astype(np.float32)
+    for target in (0, n - 1):
+        h = graph._alt_bound(target)
+        for v, d in graph.dijkstra(target, reverse=True).items():
+            assert h(v) <= d
@@ -0,0 +1,64 @@
+import random
+
+from services.geo import haversine_km
+from services.spatial_index import DriverGridIndex
+
+
+def brute_force(drivers, lat, lng, k, radius_km, vehicle_types=None, safe_only=False, exclude=()):
+    found = sorted(
+        (haversine_km(lat, lng, d_lat, d_lng), driver_id)
+        for driver_id, (d_lat, d_lng, vehicle_type, is_safe) in drivers.items()
+        if (vehicle_types is None or vehicle_type in vehicle_types)
+        and (is_safe or not safe_only)
+        and driver_id not in exclude
+        and haversine_km(lat, lng, d_lat, d_lng) <= radius_km
+    )
+    return [(driver_id, dist) for dist, driver_id in found[:k]]
+
+
+def build(seed=1, count=500):
+    rng = random.Random(seed)
+    drivers = {
+        i: (12.9 + rng.uniform(-0.1, 0.1), 77.6 + rng.uniform(-0.1, 0.1),
+            rng.choice(["auto", "cab"]), rng.random() < 0.3)
+        for i in range(count)
+    }
+    index = DriverGridIndex()
+    for driver_id, (lat, lng, vehicle_type, is_safe) in drivers.items():
+        index.upsert(driver_id, lat, lng, vehicle_type, is_safe)
+    return index, drivers
+
+
+def test_nearest_matches_brute_force():
+    index, drivers = build()
+    rng = random.Random(2)
+    for _ in range(50):
+        lat, lng = 12.9 + rng.uniform(-0.12, 0.12), 77.6 + rng.uniform(-0.12, 0.12)
+        k, radius = rng.choice([1, 5, 20]), rng.choice([0.5, 2.0, 10.0])
+        assert index.nearest(lat, lng, k, radius) == brute_force(drivers, lat, lng, k, radius)
+
+
+def test_nearest_filters():
+    index, drivers = build()
+    exclude = set(range(0, 500, 3))
+    assert index.nearest(12.9, 77.6, 10, 5.0, vehicle_types={"cab"}, safe_only=True, exclude=exclude) == \
+        brute_force(drivers, 12.9, 77.6, 10, 5.0, {"cab"}, True, exclude)
+
+
+def test_upsert_moves_and_remove():
+    index = DriverGridIndex()
+    index.upsert(1, 12.9, 77.6, "cab", False)
+    index.upsert(1, 13.5, 78.0, "cab", False)
+    assert len(index) == 1
+    assert index.position(1) == (13.5, 78.0)
+    assert index.nearest(12.9, 77.6, 1, 5.0) == []
+
+    index.remove(1)
+    assert 1 not in index
+    assert index.position(1) is None
+    assert index.nearest(13.5, 78.0, 1, 5.0) == []
+
+
+def test_nearest_zero_k():
+    index, _ = build(count=10)
+    assert index.nearest(12.9, 77.6, 0, 10.0) == []
@@ -0,0 +1,80 @@
+import math
+import random
+
+from services.timer_wheel import TimerWheel
+
+
+def test_fires_at_deadline_not_before():
+    wheel = TimerWheel(now=0.0, tick_seconds=0.01)
+    wheel.schedule("a", 0.05)
+    assert wheel.advance(0.04) == []
+    assert wheel.advance(0.05) == ["a"]
+    assert len(wheel) == 0
+
+
+def test_cancel_and_reschedule():
+    wheel = TimerWheel(now=0.0, tick_seconds=0.01)
+    wheel.schedule("a", 0.1)
+    wheel.schedule("b", 0.1)
+    assert wheel.cancel("a") is True
+    assert wheel.cancel("a") is False
+    wheel.schedule("b", 0.5)
+    assert wheel.advance(0.2) == []
+    assert "b" in wheel
+    assert wheel.advance(0.5) == ["b"]
+
+
+def test_past_deadline_fires_on_next_advance():
+    wheel = TimerWheel(now=10.0, tick_seconds=0.01)
+    wheel.schedule("late", 5.0)
+    assert wheel.advance(10.01) == ["late"]
+
+
+def test_far_deadlines_cascade_through_levels():
+    # 64 slots x 4 levels of 10 ms: level 0 covers 0.64 s, level 2 about 41 s
+    wheel = TimerWheel(now=0.0, tick_seconds=0.01, slots=64, levels=4)
+    wheel.schedule("far", 30.0)
+    wheel.schedule("beyond", 5000.0)  # past the top level's horizon
+    assert wheel.advance(29.99) == []
+    assert wheel.advance(30.0) == ["far"]
+    assert wheel.advance(4999.99) == []
+    assert wheel.advance(5000.0) == ["beyond"]
+
+
+def test_next_wakeup():
+    wheel = TimerWheel(now=0.0, tick_seconds=0.01, slots=64)
+    assert wheel.next_wakeup() is None
+    wheel.schedule("a", 0.03)
+    assert abs(wheel.next_wakeup() - 0.03) < 1e-9
+    wheel.schedule("b", 100.0)
+    wheel.cancel("a")
+    # Nothing in level 0: wake for the next cascade point
+    assert abs(wheel.next_wakeup() - 0.64) < 1e-9
+
+
+def test_matches_sorted_reference():
+    rng = random.Random(5)
+    tick = 0.01
+    wheel = TimerWheel(now=0.0, tick_seconds=tick, slots=16, levels=3)
+    pending = {}
+    now = 0.0
+    for step in range(3000):
+        action = rng.random()
+        if action < 0.5:
+            key = rng.randrange(300)
+            deadline = now + rng.choice([rng.uniform(0, 0.2), rng.uniform(0, 5), rng.uniform(0, 60)])
+            wheel.schedule(key, deadline)
+            pending[key] = deadline
+        elif action < 0.7 and pending:
+            key = rng.choice(list(pending))
+            assert wheel.cancel(key)
+            del pending[key]
+        else:
+            now += rng.uniform(0, 0.5)
+            fired = set(wheel.advance(now))
+            # A deadline fires on the first tick at or after it
+            expected = {k for k, d in pending.items() if math.ceil(d / tick) <= math.floor(now / tick)}
+            assert fired == expected, step
+            for key in fired:
+                del pending[key]
+        assert len(wheel) == len(pending)
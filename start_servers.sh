@@ -50,8 +50,13 @@ start_service() {
 
 # Start all server services
 start_service "Main Server" "server.py" "8000"
-start_service "Matcher Service" "server_matcher.py" "8001"
-start_service "Notifier Service" "server_notifier.py" "8002"
+if [ "$PIPELINE_MODE" = "1" ]; then
+    # Matcher and notifier as stages of one process
+    start_service "Dispatch Pipeline" "server_pipeline.py" "8001"
+else
+    start_service "Matcher Service" "server_matcher.py" "8001"
+    start_service "Notifier Service" "server_notifier.py" "8002"
+fi
 
 echo ""
 echo "✅ All server services started!"